@@ -0,0 +1,297 @@
+'''
+Benchmark suite for the load, search and filter paths
+
+For each dataset size, builds users and statuses CSV files with
+dataset_generator (size statuses, of size // STATUSES_PER_USER
+users), then times:
+
+- main.load_users and main.load_status_updates, once per run, each
+  into an empty database
+- main.search_user, main.search_status,
+  main.search_all_status_updates and main.filter_status_by_string
+  (reading every match), --queries calls per run, after --warmup
+  untimed calls
+
+Each operation reports p50/p95/p99 and mean latency and operations a
+second over every timed call of every run. The results, with details
+of the machine and settings, are printed and written as JSON to
+--output so that runs can be compared over time:
+
+    python benchmarks/bench_suite.py [--backend memory|sqlite|mongo]
+        [--sizes 1000,10000] [--repeat 3] [--warmup 10] [--queries 100]
+        [--seed 1] [--output bench-results.json]
+
+The mongo backend needs a server (see storage_backends.mongo) and
+uses a scratch database that is dropped afterwards.
+'''
+
+import argparse
+import csv
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ),
+                                  os.pardir, "src" ) )
+
+import dataset_generator  # noqa:E402
+import log_config  # noqa:E402
+import main  # noqa:E402
+from sqlite_backend import SQLiteBackend  # noqa:E402
+from storage_backends import MemoryBackend, MongoBackend  # noqa:E402
+
+#
+# Users in a dataset of size statuses
+#
+STATUSES_PER_USER = 5
+
+#
+# Filters look for one of this many of the most frequent words
+#
+FILTER_WORDS = 50
+
+PERCENTILES = ( 50, 95, 99 )
+
+
+def write_dataset( directory, size, seed ):
+    '''
+    Write the users and statuses of a dataset of size statuses to
+    directory. Returns their paths and the user and status IDs.
+    '''
+    user_count = max( 1, size // STATUSES_PER_USER )
+    users, statuses = dataset_generator.write_dataset( directory, user_count, size,
+                                                       seed )
+    population = dataset_generator.Population( user_count, seed )
+    user_ids = [ population.user_id( index ) for index in range( user_count ) ]
+    with open( statuses.path, newline="", encoding="utf-8" ) as statuses_file:
+        status_ids = [ row[ "STATUS_ID" ] for row in csv.DictReader( statuses_file ) ]
+    return users.path, statuses.path, user_ids, status_ids
+
+
+class Scratch():
+    '''
+    Makes empty backends of one kind, and removes them when closed
+    '''
+    def __init__( self, kind, directory ):
+        self.kind = kind
+        self.directory = directory
+        self.backends = []
+
+    def new_backend( self ):
+        '''
+        A new, empty backend, with empty caches of its own
+        '''
+        number = len( self.backends )
+        if self.kind == "memory":
+            backend = MemoryBackend()
+        elif self.kind == "sqlite":
+            backend = SQLiteBackend(
+                os.path.join( self.directory, f"bench_{number}.db" ) )
+        else:
+            backend = MongoBackend( database=f"bench_{os.getpid()}_{number}" )
+            backend.connection.connection.drop_database( backend.database )
+        self.backends.append( backend )
+        return backend
+
+    def close( self ):
+        '''
+        Drop every backend made
+        '''
+        for backend in self.backends:
+            if self.kind == "mongo":
+                backend.connection.connection.drop_database( backend.database )
+            elif self.kind == "sqlite":
+                backend.close()
+        self.backends = []
+
+
+def percentile( ordered, percent ):
+    '''
+    The nearest-rank percent percentile of the sorted list ordered
+    '''
+    rank = max( 1, -( -percent * len( ordered ) // 100 ) )
+    return ordered[ rank - 1 ]
+
+
+def summarize( operation, size, samples, rows=None ):
+    '''
+    Result dictionary for samples, a list of call times in seconds
+    '''
+    ordered = sorted( samples )
+    total = sum( ordered )
+    result = {
+        'operation': operation,
+        'size': size,
+        'calls': len( ordered ),
+        'mean_ms': total / len( ordered ) * 1e3,
+        'ops_per_second': len( ordered ) / total if total else None,
+    }
+    for percent in PERCENTILES:
+        result[ f"p{percent}_ms" ] = percentile( ordered, percent ) * 1e3
+    if rows is not None:
+        result[ 'rows_per_second' ] = rows * len( ordered ) / total if total else None
+    return result
+
+
+def time_call( function, *args ):
+    '''
+    Seconds taken by function( *args ), and its result
+    '''
+    start = time.perf_counter()
+    result = function( *args )
+    return time.perf_counter() - start, result
+
+
+def bench_loads( scratch, size, dataset, repeat ):
+    '''
+    Results for main.load_users and main.load_status_updates
+    '''
+    users_path, statuses_path, user_ids, _ = dataset
+    user_samples = []
+    status_samples = []
+    for _ in range( repeat ):
+        backend = scratch.new_backend()
+        seconds, loaded = time_call( main.load_users, users_path,
+                                     main.init_user_collection( backend ) )
+        if not loaded:
+            raise RuntimeError( f"main.load_users failed on {users_path}" )
+        user_samples.append( seconds )
+        seconds, loaded = time_call( main.load_status_updates, statuses_path,
+                                     main.init_status_collection( backend ) )
+        if not loaded:
+            raise RuntimeError( f"main.load_status_updates failed on {statuses_path}" )
+        status_samples.append( seconds )
+    return [ summarize( "load_users", size, user_samples, rows=len( user_ids ) ),
+             summarize( "load_status_updates", size, status_samples, rows=size ) ]
+
+
+def bench_queries( scratch, size, dataset, args ):
+    '''
+    Results for the search and filter operations, on one loaded
+    database
+    '''
+    users_path, statuses_path, user_ids, status_ids = dataset
+    backend = scratch.new_backend()
+    user_collection = main.init_user_collection( backend )
+    status_collection = main.init_status_collection( backend )
+    main.load_users( users_path, user_collection )
+    main.load_status_updates( statuses_path, status_collection )
+
+    def filter_statuses( word ):
+        return list( main.filter_status_by_string( word, status_collection ) )
+
+    operations = (
+        ( "search_user", lambda user_id: main.search_user( user_id, user_collection ),
+          user_ids ),
+        ( "search_status",
+          lambda status_id: main.search_status( status_id, status_collection ),
+          status_ids ),
+        ( "search_all_status_updates",
+          lambda user_id: main.search_all_status_updates( user_id, status_collection ),
+          user_ids ),
+        ( "filter_status_by_string", filter_statuses,
+          dataset_generator.vocabulary( FILTER_WORDS, args.seed ) ),
+    )
+    generator = random.Random( args.seed )
+    results = []
+    for operation, function, keys in operations:
+        for key in generator.choices( keys, k=args.warmup ):
+            function( key )
+        samples = []
+        for _ in range( args.repeat ):
+            for key in generator.choices( keys, k=args.queries ):
+                samples.append( time_call( function, key )[ 0 ] )
+        results.append( summarize( operation, size, samples ) )
+    return results
+
+
+def environment( args ):
+    '''
+    What the results were measured on
+    '''
+    return {
+        'started': datetime.datetime.now( datetime.timezone.utc ).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+        'backend': args.backend,
+        'sizes': args.sizes,
+        'repeat': args.repeat,
+        'warmup': args.warmup,
+        'queries': args.queries,
+        'seed': args.seed,
+    }
+
+
+def sizes( text ):
+    '''
+    argparse type for a comma-separated list of dataset sizes
+    '''
+    return [ int( size ) for size in text.split( "," ) if size ]
+
+
+def run( argv=None ):
+    '''
+    Run the suite, print a line per result and write the JSON report
+    '''
+    parser = argparse.ArgumentParser( description=__doc__.split( "\n\n" )[ 0 ] )
+    parser.add_argument( "--backend", choices=( "memory", "sqlite", "mongo" ),
+                         default="memory", help="storage backend to measure" )
+    parser.add_argument( "--sizes", type=sizes, default=[ 1000, 10000 ],
+                         help="comma-separated numbers of statuses" )
+    parser.add_argument( "--repeat", type=int, default=3,
+                         help="timed runs of each operation" )
+    parser.add_argument( "--warmup", type=int, default=10,
+                         help="untimed calls before each query operation" )
+    parser.add_argument( "--queries", type=int, default=100,
+                         help="timed calls of each query operation per run" )
+    parser.add_argument( "--seed", type=int, default=1,
+                         help="seed for data and queries" )
+    parser.add_argument( "--output", default="bench-results.json",
+                         help="JSON file for the results" )
+    args = parser.parse_args( argv )
+
+    #
+    # As the application runs: INFO and above, and no file sink
+    #
+    log_config.configure( level="INFO", log_file="" )
+
+    directory = tempfile.mkdtemp( prefix="sn-bench-" )
+    scratch = Scratch( args.backend, directory )
+    results = []
+    try:
+        for size in args.sizes:
+            dataset = write_dataset( directory, size, args.seed )
+            results.extend( bench_loads( scratch, size, dataset, args.repeat ) )
+            results.extend( bench_queries( scratch, size, dataset, args ) )
+            scratch.close()
+    finally:
+        scratch.close()
+        shutil.rmtree( directory, ignore_errors=True )
+
+    for result in results:
+        print( f"{result['operation']:26} {result['size']:>8} "
+               f"p50 {result['p50_ms']:9.3f}  p95 {result['p95_ms']:9.3f}  "
+               f"p99 {result['p99_ms']:9.3f} ms  "
+               f"{result['ops_per_second']:10.1f} ops/s" )
+
+    with open( args.output, "w", encoding="utf-8" ) as output_file:
+        json.dump( { 'environment': environment( args ), 'results': results },
+                   output_file, indent=2 )
+        output_file.write( "\n" )
+    print( f"Results written to {args.output}" )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit( run() )
+
+
+# --- END --- #
@@ -0,0 +1,261 @@
+'''
+asyncio pipeline for loading a CSV file
+
+Three stages run concurrently on one event loop, connected by bounded
+queues so that a slow stage holds back the ones before it rather than
+letting rows pile up in memory:
+
+- parse: reads rows with csv.DictReader (on a worker thread, a chunk
+  at a time) and queues them
+- validate: rejects rows with empty fields and groups the rest into
+  batches
+- write: N writer tasks, each awaiting one batch insert at a time
+
+Per-stage counts and throughput, and the depth of each queue, are
+available from AsyncLoadPipeline.stats() while the load runs.
+'''
+
+import asyncio
+import csv
+import time
+from itertools import islice
+
+from loguru import logger
+
+#
+# Number of concurrent writer tasks
+#
+DEFAULT_WRITERS = 4
+
+#
+# Capacity of each queue: rows waiting for validation, and batches
+# waiting for a writer
+#
+DEFAULT_ROW_QUEUE_SIZE = 10000
+DEFAULT_BATCH_QUEUE_SIZE = 8
+
+#
+# Rows read from the file per trip to the worker thread
+#
+PARSE_CHUNK_SIZE = 1000
+
+#
+# Marks the end of a queue's input
+#
+DONE = object()
+
+
+class StageStats():
+    '''
+    Running totals for one stage: items handled, and the time spent
+    working on them (as opposed to waiting on a queue)
+    '''
+    def __init__( self, name ):
+        self.name = name
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.started = None
+        self.finished = None
+
+    def snapshot( self ):
+        '''
+        Returns the totals as a dictionary, with items_per_second over
+        the stage's lifetime so far and busy as a fraction of it
+        '''
+        if self.started is None:
+            elapsed = 0.0
+        else:
+            elapsed = ( self.finished or time.perf_counter() ) - self.started
+        return {
+            'items': self.items,
+            'items_per_second': self.items / elapsed if elapsed else 0.0,
+            'busy': self.busy_seconds / elapsed if elapsed else 0.0,
+        }
+
+
+class MonitoredQueue( asyncio.Queue ):
+    '''
+    asyncio.Queue that remembers its deepest point and average depth
+    '''
+    def __init__( self, maxsize ):
+        super().__init__( maxsize )
+        self.max_depth = 0
+        self._depth_total = 0
+        self._samples = 0
+
+    async def put( self, item ):
+        await super().put( item )
+        depth = self.qsize()
+        self.max_depth = max( self.max_depth, depth )
+        self._depth_total += depth
+        self._samples += 1
+
+    def snapshot( self ):
+        '''
+        Returns the current, maximum and mean depth and the capacity
+        '''
+        return {
+            'depth': self.qsize(),
+            'max_depth': self.max_depth,
+            'mean_depth': self._depth_total / self._samples if self._samples else 0.0,
+            'capacity': self.maxsize,
+        }
+
+
+class AsyncLoadPipeline():
+    '''
+    Loads the rows of a CSV file with write_batch( rows, summary ), a
+    coroutine called by writers concurrent tasks with up to
+    batch_size row dictionaries at a time.
+
+    Rows with empty fields are counted in summary.rejected and
+    summary.malformed and never reach write_batch.
+    '''
+    def __init__( self, filename, write_batch, summary,
+                  writers=DEFAULT_WRITERS, batch_size=1000,
+                  row_queue_size=DEFAULT_ROW_QUEUE_SIZE,
+                  batch_queue_size=DEFAULT_BATCH_QUEUE_SIZE ):
+        self.filename = filename
+        self.write_batch = write_batch
+        self.summary = summary
+        self.writers = writers
+        self.batch_size = batch_size
+        self.row_queue_size = row_queue_size
+        self.batch_queue_size = batch_queue_size
+        self.rows = None
+        self.batches = None
+        self.stages = {
+            name: StageStats( name ) for name in ( "parse", "validate", "write" )
+        }
+
+    def stats( self ):
+        '''
+        Returns the per-stage throughput and the queue depths
+        '''
+        return {
+            'stages': { name: stage.snapshot() for name, stage in self.stages.items() },
+            'queues': {
+                name: queue.snapshot()
+                for name, queue in ( ( "rows", self.rows ),
+                                     ( "batches", self.batches ) )
+                if queue is not None
+            },
+        }
+
+    async def _parse( self ):
+        stage = self.stages[ "parse" ]
+        stage.started = time.perf_counter()
+        with open( self.filename, newline='', encoding="utf-8" ) as csvfile:
+            reader = csv.DictReader( csvfile )
+            while True:
+                start = time.perf_counter()
+                chunk = await asyncio.to_thread(
+                    lambda: list( islice( reader, PARSE_CHUNK_SIZE ) ) )
+                stage.busy_seconds += time.perf_counter() - start
+                if not chunk:
+                    break
+                stage.items += len( chunk )
+                for row in chunk:
+                    await self.rows.put( row )
+        await self.rows.put( DONE )
+        stage.finished = time.perf_counter()
+
+    async def _validate( self ):
+        stage = self.stages[ "validate" ]
+        stage.started = time.perf_counter()
+        batch = []
+        while True:
+            row = await self.rows.get()
+            if row is DONE:
+                break
+            start = time.perf_counter()
+            stage.items += 1
+            if not all( row.values() ) or None in row:
+                self.summary.rejected += 1
+                self.summary.malformed += 1
+            else:
+                batch.append( row )
+            stage.busy_seconds += time.perf_counter() - start
+            if len( batch ) >= self.batch_size:
+                await self.batches.put( batch )
+                batch = []
+        if batch:
+            await self.batches.put( batch )
+        for _ in range( self.writers ):
+            await self.batches.put( DONE )
+        stage.finished = time.perf_counter()
+
+    async def _write( self ):
+        stage = self.stages[ "write" ]
+        if stage.started is None:
+            stage.started = time.perf_counter()
+        while True:
+            batch = await self.batches.get()
+            if batch is DONE:
+                break
+            start = time.perf_counter()
+            await self.write_batch( batch, self.summary )
+            #
+            # Writers overlap, so busy time can exceed elapsed time;
+            # a busy fraction of 3.5 means 3.5 writers were working
+            # on average.
+            #
+            stage.busy_seconds += time.perf_counter() - start
+            stage.items += len( batch )
+        stage.finished = time.perf_counter()
+
+    async def _report( self, interval, on_progress ):
+        while True:
+            await asyncio.sleep( interval )
+            stats = self.stats()
+            logger.info( f"Load progress: {stats}" )
+            if on_progress is not None:
+                on_progress( stats )
+
+    async def run( self, report_interval=None, on_progress=None ):
+        '''
+        Load the whole file. Every report_interval seconds (if set),
+        logs stats() and passes them to on_progress.
+
+        Returns the summary, with seconds and rows_per_second set.
+        '''
+        logger.debug( "Entering method" )
+        start_time = time.perf_counter()
+        self.rows = MonitoredQueue( self.row_queue_size )
+        self.batches = MonitoredQueue( self.batch_queue_size )
+
+        tasks = [
+            asyncio.create_task( self._parse(), name="parse" ),
+            asyncio.create_task( self._validate(), name="validate" ),
+        ] + [
+            asyncio.create_task( self._write(), name=f"write-{number}" )
+            for number in range( self.writers )
+        ]
+        reporter = None
+        if report_interval:
+            reporter = asyncio.create_task(
+                self._report( report_interval, on_progress ), name="report" )
+        try:
+            await asyncio.gather( *tasks )
+        finally:
+            pending = [ task for task in tasks + [ reporter ]
+                        if task is not None and not task.done() ]
+            for task in pending:
+                task.cancel()
+            #
+            # Let them finish unwinding, so that none outlives the run
+            #
+            await asyncio.gather( *pending, return_exceptions=True )
+
+        self.summary.seconds = time.perf_counter() - start_time
+        rows = self.stages[ "parse" ].items
+        self.summary.rows_per_second = ( rows / self.summary.seconds
+                                         if self.summary.seconds else 0.0 )
+        logger.info( f"Loaded {rows} rows from {self.filename} with "
+                     f"{self.writers} writers in {self.summary.seconds:.3f}s "
+                     f"({self.summary.rows_per_second:.0f} rows/s)" )
+        logger.info( f"Pipeline stats: {self.stats()}" )
+        return self.summary
+
+
+# --- END --- #
@@ -0,0 +1,157 @@
+'''
+Streaming CSV export of users and statuses
+'''
+
+import csv
+import gzip
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+
+from loguru import logger
+
+try:
+    import zstandard  # type: ignore
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+#
+# CSV header and record field for each exported column, matching the
+# files that main.load_users and main.load_status_updates read
+#
+USER_COLUMNS = (
+    ( "USER_ID", "user_id" ),
+    ( "NAME", "user_name" ),
+    ( "LASTNAME", "user_last_name" ),
+    ( "EMAIL", "email" ),
+)
+STATUS_COLUMNS = (
+    ( "STATUS_ID", "status_id" ),
+    ( "USER_ID", "user_id" ),
+    ( "STATUS_TEXT", "status_text" ),
+)
+
+#
+# Compression formats, chosen from the file name when not given
+#
+COMPRESSION_NONE = "none"
+COMPRESSION_GZIP = "gzip"
+COMPRESSION_ZSTD = "zstd"
+COMPRESSION_SUFFIXES = {
+    ".gz": COMPRESSION_GZIP,
+    ".zst": COMPRESSION_ZSTD,
+}
+
+#
+# Bytes buffered before each write to the file (or compressor)
+#
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def compression_for( path ):
+    '''
+    The compression implied by the suffix of path
+    '''
+    return COMPRESSION_SUFFIXES.get(
+        os.path.splitext( path )[ 1 ].lower(), COMPRESSION_NONE )
+
+
+def open_output( path, compression=None ):
+    '''
+    Opens path for writing CSV text through a large write buffer,
+    compressed with gzip or zstd if asked (or if the file name ends
+    in .gz or .zst).
+
+    Raises ValueError for an unknown compression, or for zstd when
+    the zstandard package is not installed.
+    '''
+    compression = compression or compression_for( path )
+    if compression == COMPRESSION_NONE:
+        # pylint:disable-next=consider-using-with
+        binary = open( path, "wb", buffering=WRITE_BUFFER_SIZE )
+    elif compression == COMPRESSION_GZIP:
+        binary = io.BufferedWriter(
+            gzip.open( path, "wb", compresslevel=GZIP_LEVEL ), WRITE_BUFFER_SIZE )
+    elif compression == COMPRESSION_ZSTD:
+        if zstandard is None:
+            raise ValueError( "zstd compression needs the zstandard package" )
+        binary = io.BufferedWriter(
+            zstandard.ZstdCompressor( level=ZSTD_LEVEL ).stream_writer(
+                open( path, "wb" ) ),  # pylint:disable=consider-using-with
+            WRITE_BUFFER_SIZE )
+    else:
+        raise ValueError( f"Unknown compression: {compression}" )
+    return io.TextIOWrapper( binary, encoding="utf-8", newline="" )
+
+
+def write_csv( path, records, columns, compression=None ):
+    '''
+    Write records (dictionaries) to path as CSV, with a header row
+    and one row per record, taking only the given columns.
+
+    Records are written as they arrive, so memory use does not
+    depend on how many there are. Returns the number of rows written.
+    '''
+    headers = [ header for header, _ in columns ]
+    row_of = itemgetter( *( field for _, field in columns ) )
+    written = 0
+    with open_output( path, compression ) as csv_file:
+        writer = csv.writer( csv_file )
+        writer.writerow( headers )
+        for record in records:
+            writer.writerow( row_of( record ) )
+            written += 1
+    return written
+
+
+def part_path( path, part ):
+    '''
+    File name for one part of a split export:
+    status_updates.csv.gz -> status_updates-002.csv.gz
+    '''
+    directory, name = os.path.split( path )
+    stem, dot, suffixes = name.partition( "." )
+    return os.path.join( directory, f"{stem}-{part:03d}{dot}{suffixes}" )
+
+
+def export_csv( path, read_records, columns, compression=None,
+                key_ranges=None ):
+    '''
+    Export to path the records yielded by read_records( key_range ).
+
+    Without key_ranges, everything is read with read_records( None )
+    and written to path. Otherwise, each range is read on its own
+    thread and written to its own part file (see part_path), each
+    with a header row so that it can be loaded on its own.
+
+    Returns a dictionary with the files written, the number of rows
+    and the time taken.
+    '''
+    logger.debug( "Entering function" )
+    start_time = time.perf_counter()
+
+    if not key_ranges:
+        files = [ path ]
+        rows = write_csv( path, read_records( None ), columns, compression )
+    else:
+        files = [ part_path( path, part ) for part in range( len( key_ranges ) ) ]
+        compression = compression or compression_for( path )
+        with ThreadPoolExecutor( max_workers=len( key_ranges ),
+                                 thread_name_prefix="csv-export" ) as pool:
+            rows = sum( pool.map(
+                lambda part: write_csv( part[ 0 ], read_records( part[ 1 ] ),
+                                        columns, compression ),
+                zip( files, key_ranges ) ) )
+
+    seconds = time.perf_counter() - start_time
+    logger.info( f"Exported {rows} rows to {len( files )} file(s) "
+                 f"in {seconds:.3f}s" )
+    return { 'files': files, 'rows': rows, 'seconds': seconds }
+
+
+# --- END --- #
@@ -0,0 +1,377 @@
+'''
+Seeded synthetic users and statuses for scale testing
+
+Writes accounts and status update CSV files in the layout that
+main.load_users and main.load_status_updates read (the same columns
+that csv_export writes), one row at a time, so files of millions of
+rows never have to fit in memory. The same arguments and seed always
+produce the same files.
+
+- User IDs look like those in accounts.csv ("First.Last123"), and
+  status IDs are "<user_id>_<number>".
+- Statuses are spread over users with a Zipf distribution, so that
+  a few users have most of them. Status texts are made of words from
+  a generated vocabulary, which are also chosen with a Zipf
+  distribution, as words in real text are.
+- bad_rate adds rows that the loaders reject: rows with an empty
+  field, rows with a field missing and, for statuses, rows whose user
+  does not exist.
+- duplicate_rate adds rows that repeat a recent row's ID.
+
+count is always the number of distinct, valid users or statuses; bad
+and duplicate rows are written in addition, so about
+count / ( 1 - bad_rate - duplicate_rate ) rows are written in all.
+Every valid status belongs to one of the user_count users written
+with the same seed.
+
+    python src/dataset_generator.py --users 1000000 --statuses 10000000
+'''
+
+import argparse
+import csv
+import math
+import os
+import random
+import sys
+import time
+from collections import deque
+
+from loguru import logger
+
+import csv_export
+
+DEFAULT_SEED = 1
+
+#
+# Zipf exponent of statuses per user and of word frequencies
+#
+DEFAULT_SKEW = 1.1
+
+#
+# Words per status text, and distinct words in the vocabulary
+#
+DEFAULT_MIN_WORDS = 3
+DEFAULT_MAX_WORDS = 12
+DEFAULT_VOCABULARY_SIZE = 5000
+
+#
+# Recent IDs that duplicate rows are copied from
+#
+DUPLICATE_WINDOW = 10000
+
+#
+# Bytes of output buffered before each write
+#
+WRITE_BUFFER = 1024 * 1024
+
+FIRST_NAMES = (
+    "Abby", "Ben", "Carla", "Dev", "Edith", "Femi", "Gita", "Hugo", "Ines",
+    "Jonas", "Keri", "Liam", "Mara", "Nils", "Olga", "Priya", "Quinn",
+    "Rosa", "Sami", "Tara", "Umar", "Vera", "Wendy", "Xavi", "Yuki", "Zoe",
+)
+LAST_NAMES = (
+    "Abbott", "Baptiste", "Chen", "Dimitrov", "Eriksen", "Fontaine", "Garcia",
+    "Haddad", "Ito", "Jansen", "Kowalski", "Larsen", "Moreau", "Nakamura",
+    "Okafor", "Petrov", "Quispe", "Rossi", "Schmidt", "Tanaka", "Usman",
+    "Varga", "Weber", "Xu", "Yilmaz", "Zhang",
+)
+EMAIL_DOMAINS = ( "goodmail.com", "funmail.com", "example.com", "uw.edu" )
+SYLLABLES = (
+    "ba", "ce", "di", "fo", "gu", "ha", "ke", "li", "mo", "nu", "pa", "qui",
+    "ra", "se", "ti", "vo", "wa", "xe", "yo", "zu", "bri", "cla", "dro",
+    "fle", "gri", "pla", "sto", "tre",
+)
+
+
+class GeneratedFile():
+    '''
+    What was written to one generated file
+    '''
+    def __init__( self, path ):
+        self.path = path
+        self.rows = 0
+        self.bad = 0
+        self.duplicates = 0
+        self.seconds = 0.0
+
+    @property
+    def valid( self ):
+        '''
+        Number of distinct, valid rows
+        '''
+        return self.rows - self.bad - self.duplicates
+
+    def __repr__( self ):
+        return ( f"GeneratedFile( path={self.path!r}, rows={self.rows}, "
+                 f"bad={self.bad}, duplicates={self.duplicates} )" )
+
+
+class ZipfSampler():
+    '''
+    Draws ranks from 0 to size - 1 with probability roughly
+    proportional to 1 / ( rank + 1 ) ** skew, in constant time and
+    memory (by inverting the continuous power law)
+    '''
+    def __init__( self, size, skew ):
+        self.size = size
+        self.skew = skew
+        if skew == 1:
+            self.log_size = math.log( size + 1 )
+        else:
+            self.exponent = 1 - skew
+            self.span = ( size + 1 ) ** self.exponent - 1
+
+    def rank( self, uniform ):
+        '''
+        The rank for uniform, a number in [ 0, 1 )
+        '''
+        if self.skew == 1:
+            value = math.exp( uniform * self.log_size )
+        else:
+            value = ( 1 + uniform * self.span ) ** ( 1 / self.exponent )
+        return min( int( value ) - 1, self.size - 1 )
+
+
+class Population():
+    '''
+    The users of a dataset: user number index (0 to count - 1) always
+    has the same ID and details for a given seed
+    '''
+    def __init__( self, count, seed=DEFAULT_SEED ):
+        self.count = count
+        generator = random.Random( f"{seed}:names" )
+        self.first_names = generator.sample( FIRST_NAMES, len( FIRST_NAMES ) )
+        self.last_names = generator.sample( LAST_NAMES, len( LAST_NAMES ) )
+        #
+        # Which users are the most prolific: rank r is user
+        # ( r * stride + offset ) % count, a permutation when stride
+        # and count are coprime
+        #
+        self.stride = generator.randrange( 1, max( 2, count ) ) | 1
+        while math.gcd( self.stride, count ) != 1:
+            self.stride += 2
+        self.offset = generator.randrange( max( 1, count ) )
+
+    def names( self, index ):
+        '''
+        First and last name of user number index
+        '''
+        first_count = len( self.first_names )
+        return ( self.first_names[ index % first_count ],
+                 self.last_names[ index // first_count % len( self.last_names ) ] )
+
+    def user_id( self, index ):
+        '''
+        ID of user number index
+        '''
+        first, last = self.names( index )
+        return f"{first}.{last}{index}"
+
+    def user( self, index ):
+        '''
+        Row for user number index, in csv_export.USER_COLUMNS order
+        '''
+        first, last = self.names( index )
+        user_id = f"{first}.{last}{index}"
+        return ( user_id, first, last,
+                 f"{user_id}@{EMAIL_DOMAINS[ index % len( EMAIL_DOMAINS ) ]}" )
+
+    def by_rank( self, rank ):
+        '''
+        Number of the user with the rank-th most statuses
+        '''
+        return ( rank * self.stride + self.offset ) % self.count
+
+
+def vocabulary( size=DEFAULT_VOCABULARY_SIZE, seed=DEFAULT_SEED ):
+    '''
+    size distinct made-up words, most frequent first
+    '''
+    syllables = random.Random( f"{seed}:words" ).sample( SYLLABLES, len( SYLLABLES ) )
+    base = len( syllables )
+    words = []
+    for number in range( base, base + size ):
+        parts = []
+        while number:
+            number, digit = divmod( number, base )
+            parts.append( syllables[ digit ] )
+        words.append( "".join( parts ) )
+    return words
+
+
+def _bad_row( row, generator, unknown_user=False ):
+    '''
+    row made invalid: with a field emptied or dropped, or (for
+    statuses) given a user ID that does not exist
+    '''
+    kind = generator.randrange( 3 if unknown_user else 2 )
+    row = list( row )
+    if kind == 0:
+        row[ generator.randrange( len( row ) ) ] = ""
+    elif kind == 1:
+        del row[ generator.randrange( len( row ) ) ]
+    else:
+        row[ 1 ] = f"Nobody.Known{generator.randrange( 1000000 )}"
+    return row
+
+
+def _rows( summary, count, make_row, generator, bad_rate, duplicate_rate,
+           unknown_user=False ):
+    '''
+    Yields count rows from make_row( number ), with bad and duplicate
+    rows mixed in, counting them in summary
+    '''
+    recent = deque( maxlen=DUPLICATE_WINDOW )
+    written = 0
+    while written < count:
+        draw = generator.random()
+        if draw < bad_rate:
+            #
+            # Numbered after the valid rows, so its ID is not reused
+            #
+            row = _bad_row( make_row( count + summary.bad ), generator, unknown_user )
+            summary.bad += 1
+        elif draw < bad_rate + duplicate_rate and recent:
+            summary.duplicates += 1
+            row = list( make_row( written ) )
+            row[ 0 ] = recent[ generator.randrange( len( recent ) ) ]
+        else:
+            row = make_row( written )
+            recent.append( row[ 0 ] )
+            written += 1
+        summary.rows += 1
+        yield row
+
+
+def _write( path, columns, rows, summary ):
+    start = time.perf_counter()
+    with open( path, "w", newline="", encoding="utf-8",
+               buffering=WRITE_BUFFER ) as csv_file:
+        writer = csv.writer( csv_file )
+        writer.writerow( [ header for header, _ in columns ] )
+        writer.writerows( rows )
+    summary.seconds = time.perf_counter() - start
+    logger.info( f"Wrote {summary.rows} rows to {path} ({summary.bad} bad, "
+                 f"{summary.duplicates} duplicates) in {summary.seconds:.3f}s" )
+    return summary
+
+
+def write_users( path, count, seed=DEFAULT_SEED, bad_rate=0.0, duplicate_rate=0.0 ):
+    '''
+    Write count users to the CSV file path. Returns a GeneratedFile.
+    '''
+    logger.debug( "Entering function" )
+    check_rates( bad_rate, duplicate_rate )
+    population = Population( count, seed )
+    summary = GeneratedFile( path )
+    generator = random.Random( f"{seed}:users" )
+    rows = _rows( summary, count, population.user, generator, bad_rate, duplicate_rate )
+    return _write( path, csv_export.USER_COLUMNS, rows, summary )
+
+
+def write_statuses( path, count, user_count, seed=DEFAULT_SEED, skew=DEFAULT_SKEW,
+                    min_words=DEFAULT_MIN_WORDS, max_words=DEFAULT_MAX_WORDS,
+                    vocabulary_size=DEFAULT_VOCABULARY_SIZE,
+                    bad_rate=0.0, duplicate_rate=0.0 ):
+    '''
+    Write count statuses of the user_count users that write_users
+    makes with the same seed to the CSV file path. Returns a
+    GeneratedFile.
+    '''
+    logger.debug( "Entering function" )
+    check_rates( bad_rate, duplicate_rate )
+    if user_count < 1:
+        raise ValueError( "Statuses need at least one user" )
+    if not 1 <= min_words <= max_words:
+        raise ValueError( "Need 1 <= min_words <= max_words" )
+    population = Population( user_count, seed )
+    users = ZipfSampler( user_count, skew )
+    words = vocabulary( vocabulary_size, seed )
+    word_weights = list( _cumulative_zipf( vocabulary_size, skew ) )
+    generator = random.Random( f"{seed}:statuses" )
+    uniform = generator.random
+    choices = generator.choices
+    randint = generator.randint
+
+    def status( number ):
+        user_id = population.user_id( population.by_rank( users.rank( uniform() ) ) )
+        text = " ".join( choices( words, cum_weights=word_weights,
+                                  k=randint( min_words, max_words ) ) )
+        return ( f"{user_id}_{number}", user_id, text )
+
+    summary = GeneratedFile( path )
+    rows = _rows( summary, count, status, generator, bad_rate, duplicate_rate,
+                  unknown_user=True )
+    return _write( path, csv_export.STATUS_COLUMNS, rows, summary )
+
+
+def write_dataset( directory, user_count, status_count, seed=DEFAULT_SEED, **options ):
+    '''
+    Write accounts_<user_count>.csv and
+    status_updates_<status_count>.csv to directory. options are
+    passed to write_statuses, except bad_rate and duplicate_rate,
+    which apply to both files. Returns the two GeneratedFiles.
+    '''
+    rates = { name: options[ name ] for name in ( "bad_rate", "duplicate_rate" )
+              if name in options }
+    users = write_users( os.path.join( directory, f"accounts_{user_count}.csv" ),
+                         user_count, seed, **rates )
+    statuses = write_statuses(
+        os.path.join( directory, f"status_updates_{status_count}.csv" ),
+        status_count, user_count, seed, **options )
+    return users, statuses
+
+
+def check_rates( bad_rate, duplicate_rate ):
+    '''
+    Raises ValueError unless the rates leave room for valid rows
+    '''
+    if bad_rate < 0 or duplicate_rate < 0 or bad_rate + duplicate_rate >= 1:
+        raise ValueError(
+            "bad_rate and duplicate_rate must be >= 0 and add up to less than 1" )
+
+
+def _cumulative_zipf( size, skew ):
+    total = 0.0
+    for rank in range( 1, size + 1 ):
+        total += 1 / rank ** skew
+        yield total
+
+
+def main( argv=None ):
+    '''
+    Write a dataset as the command line says
+    '''
+    parser = argparse.ArgumentParser( description=__doc__.split( "\n\n" )[ 0 ] )
+    parser.add_argument( "--users", type=int, required=True,
+                         help="distinct valid users" )
+    parser.add_argument( "--statuses", type=int, required=True,
+                         help="distinct valid statuses" )
+    parser.add_argument( "--directory", default=".", help="where to write the files" )
+    parser.add_argument( "--seed", type=int, default=DEFAULT_SEED )
+    parser.add_argument( "--skew", type=float, default=DEFAULT_SKEW,
+                         help="Zipf exponent of statuses per user and of words" )
+    parser.add_argument( "--min-words", type=int, default=DEFAULT_MIN_WORDS )
+    parser.add_argument( "--max-words", type=int, default=DEFAULT_MAX_WORDS )
+    parser.add_argument( "--vocabulary", type=int, default=DEFAULT_VOCABULARY_SIZE,
+                         help="distinct words in status texts" )
+    parser.add_argument( "--bad-rate", type=float, default=0.0,
+                         help="share of rows that the loaders reject" )
+    parser.add_argument( "--duplicate-rate", type=float, default=0.0,
+                         help="share of rows that repeat an ID" )
+    args = parser.parse_args( argv )
+
+    for generated in write_dataset(
+            args.directory, args.users, args.statuses, args.seed, skew=args.skew,
+            min_words=args.min_words, max_words=args.max_words,
+            vocabulary_size=args.vocabulary, bad_rate=args.bad_rate,
+            duplicate_rate=args.duplicate_rate ):
+        print( generated )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit( main() )
+
+
+# --- END --- #
@@ -0,0 +1,144 @@
+'''
+Logging configuration shared by every module
+
+Settings come from the environment, or from keyword arguments to
+configure():
+
+- SN_LOG_LEVEL: level for every module (default INFO)
+- SN_LOG_LEVELS: per-module overrides, such as
+  "main=DEBUG,socialnetwork_model=WARNING"
+- SN_LOG_FILE: file sink, rotated daily through the {time} field
+  (default log_{time:YYYY-MM-DD}.log; empty for no file)
+- SN_LOG_STDERR: 0 to stop logging to stderr (default 1)
+- SN_LOG_DEBUG_SAMPLE: fraction of DEBUG lines kept, between 0 and 1
+  (default 1)
+
+Modules log with loguru's logger and pass values as arguments, as in
+logger.debug( "Param: user_id: {}", user_id ), so that a message is
+only formatted when some sink is going to write it. Below the lowest
+configured level, a call returns without building a record. The file
+sink is enqueued: lines are written by loguru's own thread, so the
+caller never waits on the disk.
+'''
+
+import os
+import random
+import sys
+
+from loguru import logger
+
+DEFAULT_LEVEL = "INFO"
+DEFAULT_LOG_FILE = "log_{time:YYYY-MM-DD}.log"
+
+LOG_FORMAT = "{time:YYYY-MM-DD @ HH:mm:ss} | {level} | " + \
+             "{file} : {function} : {line} : {message}"
+
+#
+# Whether configure() has run in this process
+#
+configured = False  # pylint:disable=invalid-name
+
+
+def parse_module_levels( text ):
+    '''
+    Turns "module=LEVEL,module=LEVEL" into a dictionary
+    '''
+    levels = {}
+    for item in text.split( "," ):
+        if item.strip():
+            module, _, level = item.partition( "=" )
+            levels[ module.strip() ] = level.strip().upper()
+    return levels
+
+
+class LevelFilter():
+    '''
+    loguru filter that applies a minimum level per module (the most
+    specific matching prefix of the module's dotted name wins) and
+    keeps only a sample of DEBUG lines
+    '''
+    def __init__( self, level, module_levels, debug_sample=1.0 ):
+        self.default_level = logger.level( level ).no
+        self.module_levels = { module: logger.level( module_level ).no
+                               for module, module_level in module_levels.items() }
+        self.debug_sample = debug_sample
+        self.debug_level = logger.level( "DEBUG" ).no
+        self._cache = {}
+
+    def min_level( self ):
+        '''
+        The lowest level that any module logs at
+        '''
+        return min( [ self.default_level ] + list( self.module_levels.values() ) )
+
+    def _level_for( self, module ):
+        level = self._cache.get( module )
+        if level is None:
+            level = self.default_level
+            name = module
+            while name:
+                if name in self.module_levels:
+                    level = self.module_levels[ name ]
+                    break
+                name = name.rpartition( "." )[ 0 ]
+            self._cache[ module ] = level
+        return level
+
+    def __call__( self, record ):
+        level_no = record[ "level" ].no
+        if level_no < self._level_for( record[ "name" ] or "" ):
+            return False
+        if level_no <= self.debug_level and self.debug_sample < 1.0:
+            return random.random() < self.debug_sample
+        return True
+
+
+def configure( level=None, module_levels=None, log_file=None, stderr=None,
+               debug_sample=None ):
+    '''
+    Replace loguru's sinks with the configured stderr and file sinks.
+    Arguments left as None are taken from the environment.
+
+    Returns the LevelFilter in use.
+    '''
+    global configured  # pylint:disable=global-statement,invalid-name
+
+    if level is None:
+        level = os.environ.get( "SN_LOG_LEVEL", DEFAULT_LEVEL ).upper()
+    if module_levels is None:
+        module_levels = parse_module_levels( os.environ.get( "SN_LOG_LEVELS", "" ) )
+    if log_file is None:
+        log_file = os.environ.get( "SN_LOG_FILE", DEFAULT_LOG_FILE )
+    if stderr is None:
+        stderr = os.environ.get( "SN_LOG_STDERR", "1" ) != "0"
+    if debug_sample is None:
+        debug_sample = float( os.environ.get( "SN_LOG_DEBUG_SAMPLE", "1" ) )
+
+    level_filter = LevelFilter( level, module_levels, debug_sample )
+    #
+    # The sink level is the lowest one any module needs, so that calls
+    # below it return before a record is built.
+    #
+    sink_level = level_filter.min_level()
+
+    logger.remove()
+    if stderr:
+        logger.add( sys.stderr, format=LOG_FORMAT, level=sink_level,
+                    filter=level_filter )
+    if log_file:
+        logger.add( log_file, format=LOG_FORMAT, level=sink_level,
+                    filter=level_filter, enqueue=True )
+    configured = True
+    return level_filter
+
+
+def setup():
+    '''
+    Configure logging from the environment, unless it has already
+    been configured in this process
+    '''
+    if not configured:
+        configure()
+
+
+# --- END --- #
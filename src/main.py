@@ -7,8 +7,10 @@ main driver for a simple social network project
 #
 # pylint: disable=W0611
 
-import sys
+import os
 import csv
+import functools
+import time
 
 #
 # When specifying both flake8 and pylint directives
@@ -18,39 +20,321 @@ import csv
 import pysnooper  # noqa:F401  type: ignore  pylint:disable=unused-import
 from loguru import logger
 
+import async_load
+import csv_export
+import log_config
+import metrics
+import parallel_load
 import socialnetwork_model as sn
+import status_reaper
+import tracing
+import trigram_index
 
-logger.remove()
+log_config.setup()
 
-LOG_FORMAT = "{time:YYYY-MM-DD @ HH:mm:ss} | {level} | " + \
-             "{file} : {function} : {line} : {message}"
+#
+# Number of CSV rows written per round trip by the bulk loaders
+#
+DEFAULT_BATCH_SIZE = 1000
+
+#
+# Maximum number of seconds that parsed rows wait before being
+# written, even if the batch is not full yet
+#
+DEFAULT_FLUSH_INTERVAL = 1.0
 
-logger.add( sys.stderr,
-            format=LOG_FORMAT,
-            level="DEBUG" )
 
-logger.add( "log_{time:YYYY-MM-DD}.log",
-            format=LOG_FORMAT,
-            level="DEBUG" )
+class LoadSummary():
+    '''
+    Counts of what happened to the rows of a CSV file during a
+    bulk load. Rows with empty or missing fields count as malformed
+    as well as rejected; rejected also counts rows whose write failed.
 
-def init_user_collection():
+    With record_ids, inserted_ids lists the IDs written, so that a
+    process that did not write them can learn what was added. stats
+    holds the pipeline's stats after an async load, and is None
+    otherwise.
+    '''
+    def __init__( self, record_ids=False ):
+        self.inserted_ids = [] if record_ids else None
+        self.stats = None
+        self.inserted = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.malformed = 0
+        self.unknown_user = 0
+        self.seconds = 0.0
+        self.rows_per_second = 0.0
+
+    def merge( self, other ):
+        '''
+        Add the counts of another LoadSummary to this one
+        '''
+        self.inserted += other.inserted
+        self.duplicates += other.duplicates
+        self.rejected += other.rejected
+        self.malformed += other.malformed
+        self.unknown_user += other.unknown_user
+        if other.inserted_ids:
+            if self.inserted_ids is None:
+                self.inserted_ids = []
+            self.inserted_ids.extend( other.inserted_ids )
+
+    @property
+    def total( self ):
+        '''
+        Total number of rows processed
+        '''
+        return ( self.inserted + self.duplicates +
+                 self.rejected + self.unknown_user )
+
+    def __repr__( self ):
+        return ( f"LoadSummary(inserted={self.inserted}, "
+                 f"duplicates={self.duplicates}, rejected={self.rejected}, "
+                 f"unknown_user={self.unknown_user})" )
+
+
+def batched( iterable, batch_size ):
+    '''
+    Yields lists of up to batch_size items from iterable
+    '''
+    batch = []
+    for item in iterable:
+        batch.append( item )
+        if len( batch ) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def init_user_collection( backend=None ):
     '''
     Creates and returns a new instance of UserCollection
+
+    backend selects the storage engine; by default the one named by
+    the SN_BACKEND environment variable ("mongo", "memory" or
+    "sqlite") is used.
     '''
     logger.debug( "Entering function" )
-    user_col = sn.UserCollection()
+    sn.IndexManager.ensure( backend=backend )
+    user_col = sn.UserCollection( backend )
     return user_col
 
 
-def init_status_collection():
+def init_status_collection( backend=None ):
     '''
     Creates and returns a new instance of UserStatusCollection
+
+    backend selects the storage engine; by default the one named by
+    the SN_BACKEND environment variable ("mongo", "memory" or
+    "sqlite") is used.
     '''
     logger.debug( "Entering function" )
-    status_col = sn.UserStatusCollection()
+    sn.IndexManager.ensure( backend=backend )
+    status_col = sn.UserStatusCollection( backend )
     return status_col
 
 
+def enable_status_cache( capacity=sn.DEFAULT_STATUS_CACHE_CAPACITY ):
+    '''
+    Turns on the read-through cache in front of status lookups
+
+    Requirements:
+    - A capacity of 0 turns the cache off.
+    '''
+    logger.debug( "Entering function" )
+    sn.StatusCache.configure( capacity )
+
+
+def status_cache_stats( status_collection=None ):
+    '''
+    Returns the size and hit-rate counters of the status cache of
+    status_collection's backend (the default backend if None), or
+    None if the cache is off
+    '''
+    logger.debug( "Entering function" )
+    backend = status_collection.backend if status_collection is not None else None
+    return sn.StatusCache.of( backend ).stats()
+
+
+def metrics_snapshot():
+    '''
+    Returns the call counts, error counts and latency percentiles of
+    every instrumented operation since the last reset (see metrics)
+    '''
+    logger.debug( "Entering function" )
+    return metrics.snapshot()
+
+
+def save_metrics( filename, reset=False ):
+    '''
+    Writes metrics_snapshot() to a JSON file, then starts counting
+    afresh if reset
+
+    Requirements:
+    - Returns False if the file cannot be written.
+    - Otherwise, it returns True.
+    '''
+    logger.debug( "Entering function" )
+    try:
+        metrics.dump( filename, reset_after=reset )
+    except OSError as os_error:
+        logger.error( f"Could not write metrics to {filename}: {os_error}" )
+        return False
+    return True
+
+
+def reset_metrics():
+    '''
+    Starts counting every instrumented operation afresh
+    '''
+    logger.debug( "Entering function" )
+    metrics.reset()
+
+
+def serve_metrics( port=metrics.DEFAULT_METRICS_PORT ):
+    '''
+    Serves metrics_snapshot() at http://127.0.0.1:<port>/metrics
+    (POST /metrics/reset to reset) from a background thread.
+
+    Requirements:
+    - Returns the server, or None if the port cannot be used.
+    '''
+    logger.debug( "Entering function" )
+    try:
+        return metrics.serve( port )
+    except OSError as os_error:
+        logger.error( f"Could not serve metrics on port {port}: {os_error}" )
+        return None
+
+
+def start_tracing( filename ):
+    '''
+    Appends a trace of every later top-level call of a function in
+    this module to filename, one JSON line per call, with the
+    collection methods it called and the database commands they
+    issued (see tracing)
+
+    Requirements:
+    - Returns False if the file cannot be opened.
+    - Otherwise, it returns True.
+    '''
+    logger.debug( "Entering function" )
+    try:
+        tracing.start( filename )
+    except OSError as os_error:
+        logger.error( f"Could not trace to {filename}: {os_error}" )
+        return False
+    return True
+
+
+def is_tracing():
+    '''
+    Returns whether start_tracing is in effect
+    '''
+    return tracing.running()
+
+
+def stop_tracing():
+    '''
+    Stops tracing and returns the number of traces written
+    '''
+    logger.debug( "Entering function" )
+    return tracing.stop()
+
+
+def status_reaper_stats( user_collection ):
+    '''
+    Returns the progress and backlog of the reaper that deletes the
+    statuses of users deleted from user_collection
+    '''
+    logger.debug( "Entering function" )
+    return status_reaper.reaper_for( user_collection.backend ).stats()
+
+
+def enable_trigram_index( status_collection, path=None ):
+    '''
+    Turns on the in-process trigram index for substring searches
+
+    Requirements:
+    - If path names an existing index file that matches the database
+      (see UserStatusCollection.trigram_index_current), the index is
+      loaded from it; otherwise it is built from the database.
+    - Returns True if the index is enabled, False otherwise.
+    '''
+    logger.debug( "Entering function" )
+    index = None
+    if path and os.path.exists( path ):
+        try:
+            index = trigram_index.TrigramIndex.load( path )
+        except ( OSError, ValueError ) as load_error:
+            logger.error( f"Could not load trigram index from {path}" )
+            logger.error( load_error )
+        else:
+            if not status_collection.trigram_index_current( index ):
+                logger.info( f"Trigram index in {path} is out of date; rebuilding it" )
+                index = None
+    if index is None:
+        index = status_collection.build_trigram_index()
+    if index is None:
+        return False
+    status_collection.enable_trigram_index( index )
+    return True
+
+
+def save_trigram_index( status_collection, path ):
+    '''
+    Writes the trigram index to path, so that the next start can load
+    it instead of rebuilding it
+
+    Requirements:
+    - Returns False if the index is not enabled or cannot be written.
+    - Otherwise, it returns True.
+    '''
+    logger.debug( "Entering function" )
+    if status_collection.trigram_index is None:
+        return False
+    try:
+        status_collection.trigram_index.save( path )
+    except OSError as save_error:
+        logger.error( f"Could not save trigram index to {path}" )
+        logger.error( save_error )
+        return False
+    return True
+
+
+def verify_indexes():
+    '''
+    Checks that the indexes the collections rely on exist
+
+    Requirements:
+    - Returns a dictionary listing the present, missing and unused
+      indexes.
+    - Returns None if the database could not be checked.
+    '''
+    logger.debug( "Entering function" )
+    return sn.IndexManager.verify()
+
+
+def warm_user_cache( background=False, user_collection=None ):
+    '''
+    Loads every user ID from the database into the user cache of
+    user_collection's backend (the default backend if None)
+
+    Requirements:
+    - If background is True, starts the warm-up on a separate thread
+      and returns the thread.
+    - Otherwise, returns a dictionary with the number of entries and
+      the time taken, or None if there were errors.
+    '''
+    logger.debug( "Entering function" )
+    backend = user_collection.backend if user_collection is not None else None
+    if background:
+        return sn.UserCache.of( backend ).warm_in_background()
+    return sn.UserCache.of( backend ).warm()
+
+
 def load_users(filename, user_collection):
     '''
     Opens a CSV file with user data and
@@ -66,8 +350,8 @@ def load_users(filename, user_collection):
     - Otherwise, it returns True.
     '''
     logger.debug( "Entering function" )
-    logger.debug( "Param: filename: " + filename )
-    logger.debug( "Param: user_collection: " + str( type( user_collection ) ) )
+    logger.debug( "Param: filename: {}", filename )
+    logger.debug( "Param: user_collection: {}", type( user_collection ) )
 
     with open(filename, newline='', encoding="utf-8") as csvfile:
         reader = csv.DictReader(csvfile)
@@ -93,13 +377,138 @@ def load_users(filename, user_collection):
     return True
 
 
-def save_users(filename, user_collection):  # pylint:disable=unused-argument
+def _write_user_batch( batch, user_collection, summary ):
+    '''
+    Writes the new users in a chunk of (complete) user rows
     '''
-    This function is now a stub
+    candidates = {}
+    for row in batch:
+        if row['USER_ID'] in candidates:
+            summary.duplicates += 1
+        else:
+            candidates[ row['USER_ID'] ] = row
+
+    existing = user_collection.existing_user_ids( candidates )
+    if existing is None:
+        summary.rejected += len( candidates )
+        return
+    summary.duplicates += len( existing )
+    #
+    # Users already there are as good as inserted ones to the status
+    # load that usually follows
+    #
+    sn.UserCache.of( user_collection.backend ).store_many( existing )
+
+    new_users = [
+        sn.UsersTable.as_dict(
+            user_id = row['USER_ID'],
+            user_name = row['NAME'],
+            user_last_name = row['LASTNAME'],
+            email = row['EMAIL']
+        )
+        for user_id, row in candidates.items()
+        if user_id not in existing
+    ]
+    inserted, duplicates, failed = \
+        user_collection.insert_users( new_users )
+    summary.inserted += len( inserted )
+    if summary.inserted_ids is not None:
+        summary.inserted_ids.extend( inserted )
+    summary.duplicates += len( duplicates )
+    summary.rejected += len( failed )
+
+
+def load_users_bulk( filename, user_collection,
+                     batch_size=DEFAULT_BATCH_SIZE ):
+    '''
+    Opens a CSV file with user data and adds it to an existing
+    instance of UserCollection, batch_size rows at a time.
+
+    For each batch, the IDs that already exist are resolved with a
+    single query and the new users are written with a single
+    unordered insert_many.
+
+    Requirements:
+    - Users whose user_id already exists are skipped.
+    - Rows with empty fields are rejected, and loading continues.
+    - Returns a LoadSummary with the inserted, duplicate and
+      rejected counts.
     '''
     logger.debug( "Entering function" )
-    logger.debug( "This function is now stub" )
-    return True
+    logger.debug( "Param: filename: {}", filename )
+
+    summary = LoadSummary()
+    with open(filename, newline='', encoding="utf-8") as csvfile:
+        reader = csv.DictReader(csvfile)
+        #
+        # USER_ID, EMAIL, NAME, LASTNAME
+        #
+        for batch in batched( reader, batch_size ):
+            valid = []
+            for row in batch:
+                if not all( row.values() ) or None in row:
+                    summary.rejected += 1
+                    summary.malformed += 1
+                else:
+                    valid.append( row )
+            _write_user_batch( valid, user_collection, summary )
+
+    logger.debug( "Bulk user load: {}", summary )
+    return summary
+
+
+def save_users( filename, user_collection,
+                batch_size=sn.DEFAULT_EXPORT_BATCH_SIZE,
+                compression=None, parts=1 ):
+    '''
+    Saves all users in user_collection into a CSV file, in the
+    format that load_users reads.
+
+    Users are streamed from the database batch_size at a time, so
+    memory use stays flat however many there are. The file is
+    compressed with gzip or zstd if compression says so, or if
+    filename ends in .gz or .zst.
+
+    With parts greater than 1, the users are split into that many
+    ranges which are exported in parallel, each to its own file
+    (filename with -000, -001, ... after the stem).
+
+    Requirements:
+    - Returns False if there are any errors (such as the database or
+      the file being unavailable).
+    - Otherwise, it returns True.
+    '''
+    logger.debug( "Entering function" )
+    logger.debug( "Param: filename: {}", filename )
+
+    return _export( filename, user_collection.iter_users,
+                    user_collection.key_ranges, csv_export.USER_COLUMNS,
+                    batch_size, compression, parts )
+
+
+def _export( filename, read_records, key_ranges, columns,
+             batch_size, compression, parts ):
+    '''
+    Common part of save_users and save_status_updates
+    '''
+    try:
+        ranges = key_ranges( parts ) if parts > 1 else None
+        report = csv_export.export_csv(
+            filename,
+            lambda key_range: read_records( batch_size, key_range ),
+            columns,
+            compression=compression,
+            key_ranges=ranges
+        )
+
+    except ( sn.StorageError, OSError, ValueError ) as export_error:
+        logger.error( f'Error exporting to {filename}' )
+        logger.error( export_error )
+        return False
+
+    else:
+        logger.debug( "Export report: {}", report )
+        return True
 
 
 def load_status_updates(filename, status_collection):
@@ -112,11 +521,94 @@ def load_status_updates(filename, status_collection):
       the next.
     - Returns False if there are any errors(such as empty fields in the
       source CSV file)
-    - Otherwise, it returns True.
+    - Otherwise, it returns True. Statuses that are skipped, because
+      they are duplicates, belong to unknown users or fail to be
+      written, do not make it return False.
+    '''
+    logger.debug( "Entering function" )
+
+    summary = load_status_updates_bulk( filename, status_collection,
+                                        stop_on_rejected=True )
+
+    logger.debug( "Number of statuses added: {}", summary.inserted )
+    if summary.rejected > summary.malformed:
+        logger.debug( "Statuses not written: {}", summary.rejected - summary.malformed )
+    return summary.malformed == 0
+
+
+def _write_status_batch( batch, status_collection, summary ):
+    '''
+    Validates a chunk of status rows and writes the valid ones
+    '''
+    candidates = {}
+    for row in batch:
+        if row['STATUS_ID'] in candidates:
+            summary.duplicates += 1
+        else:
+            candidates[ row['STATUS_ID'] ] = row
+
+    #
+    # Under MongoDB we have to verify ownership ourselves; do it for
+    # the whole chunk at once against the cache.
+    #
+    known_users = sn.confirm_users(
+        { row['USER_ID'] for row in candidates.values() },
+        status_collection.backend )
+    owned = { status_id: row for status_id, row in candidates.items()
+              if row['USER_ID'] in known_users }
+    summary.unknown_user += len( candidates ) - len( owned )
+
+    existing = status_collection.existing_status_ids( owned )
+    if existing is None:
+        summary.rejected += len( owned )
+        return
+    summary.duplicates += len( existing )
+
+    new_statuses = [
+        sn.StatusTable.as_dict(
+            status_id = status_id,
+            user_id = row['USER_ID'],
+            status_text = row['STATUS_TEXT'],
+        )
+        for status_id, row in owned.items()
+        if status_id not in existing
+    ]
+    inserted, duplicates, failed = \
+        status_collection.insert_statuses( new_statuses )
+    summary.inserted += len( inserted )
+    if summary.inserted_ids is not None:
+        summary.inserted_ids.extend( inserted )
+    summary.duplicates += len( duplicates )
+    summary.rejected += len( failed )
+
+
+def load_status_updates_bulk( filename, status_collection,
+                              batch_size=DEFAULT_BATCH_SIZE,
+                              flush_interval=DEFAULT_FLUSH_INTERVAL,
+                              stop_on_rejected=False ):
+    '''
+    Opens a CSV file with status data and adds it to an existing
+    instance of UserStatusCollection in chunks.
+
+    A chunk is written when it holds batch_size rows or when
+    flush_interval seconds have passed since the last write. For each
+    chunk, ownership is checked against UserCache, existing status IDs
+    are resolved with one query, and the new statuses are written with
+    a single unordered bulk write.
+
+    Requirements:
+    - Statuses whose status_id already exists are skipped.
+    - Statuses for unknown users are skipped.
+    - Rows with empty fields are rejected. If stop_on_rejected is True,
+      the rows read so far are written and loading stops there.
+    - Returns a LoadSummary.
     '''
     logger.debug( "Entering function" )
+    logger.debug( "Param: filename: {}", filename )
 
-    num_status_added = 0
+    summary = LoadSummary()
+    pending = []
+    last_flush = time.monotonic()
     with open(filename, newline='', encoding="utf-8") as csvfile:
         reader = csv.DictReader(csvfile)
         #
@@ -126,29 +618,201 @@ def load_status_updates(filename, status_collection):
             #
             # Check for missing attributes
             #
-            for status_attr in row.values():
-                if not status_attr:
-                    return False
-            status_added = status_collection.add_status(
-                row['USER_ID'],
-                row['STATUS_ID'],
-                row['STATUS_TEXT']
-            )
-            if status_added:
-                num_status_added += 1
-            else:
-                logger.debug( f"Status, {row['STATUS_ID']}, not added" )
+            if not all( row.values() ) or None in row:
+                summary.rejected += 1
+                summary.malformed += 1
+                if stop_on_rejected:
+                    break
+                continue
 
-    logger.debug( f"Number of statuses added: {num_status_added}" )
-    return True
+            pending.append( row )
+            if ( len( pending ) >= batch_size or
+                 time.monotonic() - last_flush >= flush_interval ):
+                _write_status_batch( pending, status_collection, summary )
+                pending = []
+                last_flush = time.monotonic()
+
+    _write_status_batch( pending, status_collection, summary )
+
+    logger.debug( "Bulk status load: {}", summary )
+    return summary
 
-def save_status_updates(filename, status_collection):  # pylint:disable=unused-argument
+
+def load_users_parallel( filename, user_collection,
+                         workers=parallel_load.DEFAULT_WORKERS,
+                         chunk_size=parallel_load.DEFAULT_CHUNK_SIZE,
+                         batch_size=DEFAULT_BATCH_SIZE ):
     '''
-    This function is now a stub
+    Loads a CSV file of users like load_users_bulk, but with workers
+    processes parsing chunk_size byte ranges of the file and workers
+    processes writing, each writer owning the user IDs that hash to
+    it (see parallel_load).
+
+    Requirements:
+    - Users whose user_id already exists are skipped.
+    - Rows with empty fields are rejected, and loading continues.
+    - Returns a LoadSummary with seconds and rows_per_second set, or
+      None if the collection's backend cannot be shared between
+      processes or loading failed.
+    - The writers report the users they inserted, and these are added
+      to this process's user cache.
     '''
     logger.debug( "Entering function" )
-    logger.debug( "This function is now stub" )
-    return True
+    summary = parallel_load.parallel_load(
+        filename, user_collection, 'USER_ID', _write_user_batch,
+        functools.partial( LoadSummary, record_ids=True ),
+        workers=workers, chunk_size=chunk_size, batch_size=batch_size )
+    if summary is not None:
+        sn.UserCache.of( user_collection.backend ).store_many( summary.inserted_ids )
+    return summary
+
+
+async def _write_status_batch_async( batch, status_collection, writes, summary ):
+    '''
+    Coroutine version of _write_status_batch, going to the database
+    through writes (see StorageBackend.async_writes)
+    '''
+    candidates = {}
+    for row in batch:
+        if row['STATUS_ID'] in candidates:
+            summary.duplicates += 1
+        else:
+            candidates[ row['STATUS_ID'] ] = row
+
+    known_users = await sn.confirm_users_async(
+        { row['USER_ID'] for row in candidates.values() }, writes,
+        status_collection.backend )
+    owned = { status_id: row for status_id, row in candidates.items()
+              if row['USER_ID'] in known_users }
+    summary.unknown_user += len( candidates ) - len( owned )
+
+    existing = await status_collection.existing_status_ids_async( owned, writes )
+    if existing is None:
+        summary.rejected += len( owned )
+        return
+    summary.duplicates += len( existing )
+
+    new_statuses = [
+        sn.StatusTable.as_dict(
+            status_id = status_id,
+            user_id = row['USER_ID'],
+            status_text = row['STATUS_TEXT'],
+        )
+        for status_id, row in owned.items()
+        if status_id not in existing
+    ]
+    inserted, duplicates, failed = \
+        await status_collection.insert_statuses_async( new_statuses, writes )
+    summary.inserted += len( inserted )
+    summary.duplicates += len( duplicates )
+    summary.rejected += len( failed )
+
+
+async def load_status_updates_async(
+        filename, status_collection,
+        writers=async_load.DEFAULT_WRITERS,
+        batch_size=DEFAULT_BATCH_SIZE,
+        row_queue_size=async_load.DEFAULT_ROW_QUEUE_SIZE,
+        batch_queue_size=async_load.DEFAULT_BATCH_QUEUE_SIZE,
+        report_interval=None, on_progress=None ):
+    '''
+    Coroutine that loads a CSV file of statuses like
+    load_status_updates_bulk, but overlaps reading the file with
+    writing to the database: rows are parsed, validated and written
+    by writers concurrent tasks, connected by bounded queues (see
+    async_load). Under MongoDB the writes go through the async
+    driver; other backends run their writes on worker threads.
+
+    Every report_interval seconds, the per-stage throughput and queue
+    depths are logged and passed to on_progress.
+
+    Requirements:
+    - Statuses whose status_id already exists are skipped.
+    - Statuses for unknown users are skipped.
+    - Rows with empty fields are rejected, and loading continues.
+    - Returns a LoadSummary with seconds and rows_per_second set, and
+      the pipeline's final statistics as its stats attribute.
+    '''
+    logger.debug( "Entering function" )
+    logger.debug( "Param: filename: {}", filename )
+
+    writes = status_collection.backend.async_writes()
+
+    async def write_batch( batch, summary ):
+        await _write_status_batch_async( batch, status_collection, writes, summary )
+
+    pipeline = async_load.AsyncLoadPipeline(
+        filename, write_batch, LoadSummary(),
+        writers=writers,
+        batch_size=batch_size,
+        row_queue_size=row_queue_size,
+        batch_queue_size=batch_queue_size
+    )
+    try:
+        summary = await pipeline.run( report_interval=report_interval,
+                                      on_progress=on_progress )
+    finally:
+        await writes.close()
+
+    summary.stats = pipeline.stats()
+    return summary
+
+
+def load_status_updates_parallel( filename, status_collection,
+                                  workers=parallel_load.DEFAULT_WORKERS,
+                                  chunk_size=parallel_load.DEFAULT_CHUNK_SIZE,
+                                  batch_size=DEFAULT_BATCH_SIZE ):
+    '''
+    Loads a CSV file of statuses like load_status_updates_bulk, but
+    with workers processes parsing chunk_size byte ranges of the file
+    and workers processes writing, each writer owning the status IDs
+    that hash to it (see parallel_load).
+
+    Requirements:
+    - Statuses whose status_id already exists are skipped.
+    - Statuses for unknown users are skipped.
+    - Rows with empty fields are rejected, and loading continues.
+    - Returns a LoadSummary with seconds and rows_per_second set, or
+      None if the collection's backend cannot be shared between
+      processes or loading failed.
+    - The writers report the statuses they inserted: these are
+      dropped from this process's status cache, and an enabled
+      trigram index is rebuilt to include them.
+    '''
+    logger.debug( "Entering function" )
+    summary = parallel_load.parallel_load(
+        filename, status_collection, 'STATUS_ID', _write_status_batch,
+        functools.partial( LoadSummary, record_ids=True ),
+        workers=workers, chunk_size=chunk_size, batch_size=batch_size )
+    if summary is not None and summary.inserted_ids:
+        sn.StatusCache.of( status_collection.backend ).invalidate_many(
+            summary.inserted_ids )
+        if status_collection.trigram_index is not None:
+            status_collection.enable_trigram_index(
+                status_collection.build_trigram_index() )
+    return summary
+
+
+def save_status_updates( filename, status_collection,
+                         batch_size=sn.DEFAULT_EXPORT_BATCH_SIZE,
+                         compression=None, parts=1 ):
+    '''
+    Saves all statuses in status_collection into a CSV file, in the
+    format that load_status_updates reads.
+
+    batch_size, compression and parts work as for save_users.
+
+    Requirements:
+    - Returns False if there are any errors (such as the database or
+      the file being unavailable).
+    - Otherwise, it returns True.
+    '''
+    logger.debug( "Entering function" )
+    logger.debug( "Param: filename: {}", filename )
+
+    return _export( filename, status_collection.iter_statuses,
+                    status_collection.key_ranges, csv_export.STATUS_COLUMNS,
+                    batch_size, compression, parts )
 
 
 def add_user(user_id, email, user_name, user_last_name, user_collection):
@@ -163,14 +827,14 @@ def add_user(user_id, email, user_name, user_last_name, user_collection):
     - Otherwise, it returns True.
     '''
     logger.debug( "Entering function" )
-    if search_user( user_id, user_collection ) is None:
-        return user_collection.add_user(
-            user_id,
-            email,
-            user_name,
-            user_last_name
-        )
-    logger.error( "User already in database" )
+    #
+    # Duplicate user IDs are rejected by add_user itself
+    # (by the unique index on user_id), so there is no need
+    # to search first.
+    #
+    if user_collection.add_user( user_id, email, user_name, user_last_name ):
+        return True
+    logger.error( "User not added" )
     return False
 
 
@@ -183,17 +847,12 @@ def update_user(user_id, email, user_name, user_last_name, user_collection):
     - Otherwise, it returns True.
     '''
     logger.debug( "Entering function" )
-    if search_user( user_id, user_collection ) is not None:
-        user_collection.modify_user(
-            user_id,
-            email,
-            user_name,
-            user_last_name
-        )
-        return True
     #
-    # A user with that ID doesn't exist, so cannot update
+    # One conditional update; it matches nothing if the user doesn't
+    # exist, so there is no need to look the user up first
     #
+    if user_collection.modify_user( user_id, email, user_name, user_last_name ):
+        return True
     logger.error( "No user found with that ID" )
     return False
 
@@ -207,12 +866,14 @@ def delete_user(user_id, user_collection):
     - Otherwise, it returns True.
     '''
     logger.debug( "Entering function" )
-    user_to_delete = search_user( user_id, user_collection )
-    if user_to_delete is None:
-        logger.error( "No user found with that ID" )
-        return False
-    user_collection.delete_user( user_id )
-    return True
+    #
+    # The delete itself reports whether there was such a user; the
+    # user's statuses are reaped in the background
+    #
+    if user_collection.delete_user( user_id ):
+        return True
+    logger.error( "No user found with that ID" )
+    return False
 
 
 def search_user(user_id, user_collection):
@@ -225,17 +886,56 @@ def search_user(user_id, user_collection):
     - Otherwise, it returns None.
     '''
     logger.debug( "Entering function" )
-    logger.debug( "Param: user_id: " + user_id )
-    logger.debug( "Param: user_collection: " + str( type( user_collection ) ) )
+    logger.debug( "Param: user_id: {}", user_id )
+    logger.debug( "Param: user_collection: {}", type( user_collection ) )
     search_result = user_collection.search_user(user_id)
     if search_result is None:
         logger.debug( "Could not find user in database" )
         return None
-    logger.debug( "User found: " + search_result.user_id )
-    logger.debug( "Type found: " + str( type( search_result ) ) )
+    logger.debug( "User found: {}", search_result.user_id )
+    logger.debug( "Type found: {}", type( search_result ) )
     return search_result
 
 
+def add_users( users, user_collection ):
+    '''
+    Adds a batch of users (dictionaries, see sn.UsersTable.as_dict)
+    to user_collection.
+
+    Requirements:
+    - Returns a dictionary mapping each user_id to True if the user
+    was added, or False if not (such as when it already exists).
+    '''
+    logger.debug( "Entering function" )
+    return user_collection.add_users( users )
+
+
+def search_users( user_ids, user_collection ):
+    '''
+    Searches for a batch of users in user_collection.
+
+    Requirements:
+    - Returns a dictionary mapping each user_id to the corresponding
+    User instance, or to None if there is no such user.
+    - Returns None if the database fails.
+    '''
+    logger.debug( "Entering function" )
+    return user_collection.search_users( user_ids )
+
+
+def delete_users( user_ids, user_collection ):
+    '''
+    Deletes a batch of users from user_collection.
+
+    Requirements:
+    - Returns a dictionary mapping each user_id to True if the user
+    was deleted, or False if there was no such user.
+    - Returns None if the database fails.
+    '''
+    logger.debug( "Entering function" )
+    return user_collection.delete_users( user_ids )
+
+
 def add_status(user_id, status_id, status_text, status_collection):
     '''
     Creates a new instance of UserStatus and stores it in
@@ -248,9 +948,10 @@ def add_status(user_id, status_id, status_text, status_collection):
     - Otherwise, it returns True.
     '''
     logger.debug( "Entering function" )
-    if search_status( status_id, status_collection ) is None:
-        return status_collection.add_status( user_id, status_id, status_text )
-    return False
+    #
+    # Duplicate status IDs are rejected by add_status itself
+    #
+    return status_collection.add_status( user_id, status_id, status_text )
 
 
 def update_status(status_id, user_id, status_text, status_collection):
@@ -262,13 +963,10 @@ def update_status(status_id, user_id, status_text, status_collection):
     - Otherwise, it returns True.
     '''
     logger.debug( "Entering function" )
-    if search_status( status_id, status_collection ) is not None:
-        status_collection.modify_status( status_id, user_id, status_text )
-        return True
     #
-    # A status with that ID doesn't exist, so cannot update
+    # As for update_user: a status that doesn't exist is not matched
     #
-    return False
+    return status_collection.modify_status( status_id, user_id, status_text )
 
 
 def delete_status(status_id, status_collection):
@@ -303,6 +1001,33 @@ def search_status(status_id, status_collection):
     return search_result
 
 
+def search_statuses( status_ids, status_collection ):
+    '''
+    Searches for a batch of statuses in status_collection.
+
+    Requirements:
+    - Returns a dictionary mapping each status_id to the
+    corresponding UserStatus instance, or to None if there is no
+    such status.
+    - Returns None if the database fails.
+    '''
+    logger.debug( "Entering function" )
+    return status_collection.search_statuses( status_ids )
+
+
+def delete_statuses( status_ids, status_collection ):
+    '''
+    Deletes a batch of statuses from status_collection.
+
+    Requirements:
+    - Returns a dictionary mapping each status_id to True if the
+    status was deleted, or False if there was no such status.
+    - Returns None if the database fails.
+    '''
+    logger.debug( "Entering function" )
+    return status_collection.delete_statuses( status_ids )
+
+
 def search_all_status_updates( user_id, status_collection ):
     '''
     Returns all the status updates for a specified user.
@@ -319,9 +1044,50 @@ def search_all_status_updates( user_id, status_collection ):
     return search_result
 
 
-def filter_status_by_string( target_string, status_collection ):
+def page_status_updates( user_id, status_collection,
+                         page_size=sn.DEFAULT_STATUS_PAGE_SIZE, resume_token=None ):
     '''
-    Returns all the status updates for a specified user.
+    Returns one page of a user's status updates and the token for the
+    next page (see UserStatusCollection.page_status_updates).
+
+    Requirements:
+    - Returns ( statuses, resume_token ); resume_token is None after
+      the last page.
+    - If the database fails, returns ( None, None ).
+    '''
+    logger.debug( "Entering function" )
+    return status_collection.page_status_updates( user_id, page_size, resume_token )
+
+
+def iter_status_updates( user_id, status_collection,
+                         page_size=sn.DEFAULT_STATUS_PAGE_SIZE ):
+    '''
+    Returns an iterator over a user's status texts that fetches them
+    from the database a page at a time, as it is consumed.
+    '''
+    logger.debug( "Entering function" )
+    return status_collection.iter_status_updates( user_id, page_size )
+
+
+def count_status_updates( user_id, status_collection ):
+    '''
+    Returns the number of status updates for a user, or None if the
+    database fails.
+    '''
+    logger.debug( "Entering function" )
+    return status_collection.count_status_updates( user_id )
+
+
+def filter_status_by_string( target_string, status_collection,
+                             mode=sn.FILTER_REGEX, limit=0,
+                             by_relevance=False, fields=None, lazy=False ):
+    '''
+    Returns all the status updates that match a string.
+
+    mode is sn.FILTER_REGEX for substring matches, sn.FILTER_TEXT for
+    indexed word matches or sn.FILTER_TRIGRAM for indexed substring
+    matches. fields and lazy limit what is read and decoded (see
+    UserStatusCollection.filter_status_by_string).
 
     Requirements:
     - Returns an iterator to all status updates that contain the
@@ -329,13 +1095,26 @@ def filter_status_by_string( target_string, status_collection ):
       updates . . . :-O
     '''
     logger.debug( "Entering method" )
-    logger.debug( "Param: target_string: " + target_string )
+    logger.debug( "Param: target_string: {}", target_string )
 
-    status_iterator = status_collection.filter_status_by_string( target_string )
+    status_iterator = status_collection.filter_status_by_string(
+        target_string,
+        mode=mode,
+        limit=limit,
+        by_relevance=by_relevance,
+        fields=fields,
+        lazy=lazy
+    )
     if status_iterator is None:
         return None
     return status_iterator
 
 
+#
+# Time and count every call of the functions above (see metrics)
+#
+metrics.instrument_functions( globals(), "main" )
+
+
 # --- END --- #
 
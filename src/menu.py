@@ -4,15 +4,23 @@ Provides a basic frontend
 
 # pylint: disable=C0301
 
+import os
 import sys
 
 from loguru import logger
 
+import log_config
 import main
+import socialnetwork_model as sn
 
-logger.remove()
-logger.add( sys.stderr, format="STDERR: {time:YYYY-MM-DD @ HH:mm:ss} | {level} | {file} : {function} : {line} : {message}", level="DEBUG" )
-logger.add( "log_{time:YYYY-MM-DD}.log", format="LOGFILE: {time:YYYY-MM-DD @ HH:mm:ss} | {level} | {file} : {function} : {line} : {message}", level="DEBUG" )
+log_config.setup()
+
+TRIGRAM_INDEX_FILE = "status_trigrams.idx"
+
+#
+# The only status fields that the filter menus show or use
+#
+REVIEW_FIELDS = ( "status_id", "status_text" )
 
 
 def load_users():
@@ -21,7 +29,10 @@ def load_users():
     '''
     logger.debug( "Entering function" )
     filename = input('Enter filename of user file: ')
-    main.load_users(filename, user_collection)
+    summary = main.load_users_bulk(filename, user_collection)
+    print(f"Users added: {summary.inserted}")
+    print(f"Users already present: {summary.duplicates}")
+    print(f"Rows rejected: {summary.rejected}")
 
 
 def load_status_updates():
@@ -30,7 +41,11 @@ def load_status_updates():
     '''
     logger.debug( "Entering function" )
     filename = input('Enter filename for status file: ')
-    main.load_status_updates(filename, status_collection)
+    summary = main.load_status_updates_bulk(filename, status_collection)
+    print(f"Statuses added: {summary.inserted}")
+    print(f"Statuses already present: {summary.duplicates}")
+    print(f"Statuses for unknown users: {summary.unknown_user}")
+    print(f"Rows rejected: {summary.rejected}")
 
 
 def add_user():
@@ -106,8 +121,11 @@ def save_users():
     Saves user database into a file
     '''
     logger.debug( "Entering function" )
-    filename = input('Enter filename for users file: ')
-    main.save_users(filename, user_collection)
+    filename = input('Enter filename for users file (.gz/.zst to compress): ')
+    if not main.save_users(filename, user_collection):
+        print("An error occurred while trying to save users")
+    else:
+        print("Users were successfully saved")
 
 
 def add_status():
@@ -171,37 +189,45 @@ def save_status():
     Saves status database into a file
     '''
     logger.debug( "Entering function" )
-    filename = input('Enter filename for status file: ')
-    main.save_status_updates(filename, status_collection)
+    filename = input('Enter filename for status file (.gz/.zst to compress): ')
+    if not main.save_status_updates(filename, status_collection):
+        print("An error occurred while trying to save statuses")
+    else:
+        print("Statuses were successfully saved")
+
 
-def status_generator( query_result_list ):
+def save_metrics():
     '''
-    Take a list and turn it into a generator
+    Saves the operation metrics into a file
     '''
     logger.debug( "Entering function" )
-    assert len( query_result_list )
+    filename = input('Enter filename for metrics file (.json): ')
+    reset = input('Reset the metrics afterwards? (Y/N): ').upper() == "Y"
+    if not main.save_metrics(filename, reset=reset):
+        print("An error occurred while trying to save metrics")
+    else:
+        print("Metrics were successfully saved")
 
-    for status in query_result_list:
-        yield status
 
 def search_all_status_updates():
     '''
-    Searches a status in the database
+    Pages through the status updates of a user, fetching them from the
+    database only as they are asked for
     '''
     logger.debug( "Entering function" )
     user_id = input('Enter user ID for statuses to retrieve: ')
-    query_result_list = main.search_all_status_updates(user_id, status_collection)
-    status_gen = status_generator( query_result_list )
+    total = main.count_status_updates( user_id, status_collection )
 
-    if not query_result_list:
+    if not total:
         print("ERROR: No statuses found" )
     else:
-        print( f"A total of {str( len( query_result_list ) )} status updates found for {user_id}" )
+        print( f"A total of {total} status updates found for {user_id}" )
+        status_iterator = main.iter_status_updates( user_id, status_collection )
         while True:
             user_response = input('Would you like to see the next update? (Y/N): ')
             if user_response.upper() == "Y":
                 try:
-                    print( next( status_gen ) )
+                    print( next( status_iterator ) )
 
                 except StopIteration:
                     print( "No more status updates . . . :-(" )
@@ -209,13 +235,40 @@ def search_all_status_updates():
             else:
                 break
 
+
+def choose_filter_mode():
+    '''
+    Asks whether to match substrings or whole words, or substrings
+    in the in-process trigram index. The index misses changes made by
+    other processes since it was built, so it is never the default,
+    and it is only loaded (or built) the first time it is chosen.
+    '''
+    mode = input('Match (S)ubstrings, whole (W)ords or (I)ndexed substrings? [S]: ')
+    if mode.upper() == "I":
+        if status_collection.trigram_index is None:
+            print( "Loading the trigram index . . ." )
+            if not main.enable_trigram_index( status_collection, TRIGRAM_INDEX_FILE ):
+                print( "ERROR: No trigram index; matching substrings instead" )
+                return { 'mode': sn.FILTER_REGEX }
+        return { 'mode': sn.FILTER_TRIGRAM }
+    if mode.upper() == "W":
+        return { 'mode': sn.FILTER_TEXT, 'by_relevance': True }
+    return { 'mode': sn.FILTER_REGEX }
+
+
 def filter_status_by_string():
     '''
     Searches a status in the database
     '''
     logger.debug( "Entering function" )
     target_text = input('Enter status text on which to filter: ')
-    status_iterator = main.filter_status_by_string( target_text, status_collection)
+    #
+    # Statuses are reviewed one at a time and the review often stops
+    # early, so leave each one undecoded until it is shown
+    #
+    status_iterator = main.filter_status_by_string( target_text, status_collection,
+                                                    fields=REVIEW_FIELDS, lazy=True,
+                                                    **choose_filter_mode() )
 
     if not status_iterator:
         print("ERROR: No iterator returned" )
@@ -236,13 +289,16 @@ def filter_status_by_string():
             else:
                 break
 
+
 def flagged_status_updates():
     '''
     Searches a status in the database
     '''
     logger.debug( "Entering function" )
     target_text = input('Enter status text for flagging: ')
-    status_iterator = main.filter_status_by_string( target_text, status_collection)
+    status_iterator = main.filter_status_by_string( target_text, status_collection,
+                                                    fields=REVIEW_FIELDS,
+                                                    **choose_filter_mode() )
 
     # pylint: disable=expression-not-assigned
     if not status_iterator:
@@ -251,18 +307,54 @@ def flagged_status_updates():
         [ print( str( statu.status_id ) + ": " + statu.status_text )
           for statu in status_iterator ]
 
+
+def verify_indexes():
+    '''
+    Reports missing or unused database indexes
+    '''
+    logger.debug( "Entering function" )
+    report = main.verify_indexes()
+    if report is None:
+        print("ERROR: Could not check indexes")
+    else:
+        print(f"Present: {', '.join(report['present']) or 'none'}")
+        print(f"Missing: {', '.join(report['missing']) or 'none'}")
+        print(f"Unused: {', '.join(report['unused']) or 'none'}")
+
+
+def toggle_tracing():
+    '''
+    Starts or stops tracing requests to a file
+    '''
+    logger.debug( "Entering function" )
+    if main.is_tracing():
+        print(f"Traces written: {main.stop_tracing()}")
+        return
+    filename = input('Enter filename for traces (.jsonl): ')
+    if not main.start_tracing(filename):
+        print("An error occurred while trying to start tracing")
+    else:
+        print("Tracing started")
+
+
 def quit_program():
     '''
     Quits program
     '''
     logger.debug( "Entering function" )
+    main.stop_tracing()
+    main.save_trigram_index( status_collection, TRIGRAM_INDEX_FILE )
     sys.exit()
 
 
 if __name__ == '__main__':
     logger.debug( "Program start" )
+    if os.environ.get( "SN_TRACE_FILE" ):
+        main.start_tracing( os.environ[ "SN_TRACE_FILE" ] )
     user_collection = main.init_user_collection()
     status_collection = main.init_status_collection()
+    main.enable_status_cache()
+    main.warm_user_cache( background=True, user_collection=user_collection )
     menu_options = {
         'A': load_users,
         'B': load_status_updates,
@@ -279,6 +371,9 @@ if __name__ == '__main__':
         'M': search_all_status_updates,
         'N': filter_status_by_string,
         'O': flagged_status_updates,
+        'P': save_metrics,
+        'T': toggle_tracing,
+        'V': verify_indexes,
         'Q': quit_program
     }
     while True:
@@ -298,6 +393,9 @@ if __name__ == '__main__':
                             M: Search all status updates
                             N: Filter status updates by string
                             O: Show all flagged status updates
+                            P: Save operation metrics to file
+                            T: Start or stop request tracing
+                            V: Verify database indexes
                             Q: Quit
 
                             Please enter your choice: """)
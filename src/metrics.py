@@ -0,0 +1,388 @@
+'''
+Per-operation call counts, error counts and latency histograms
+
+instrument() wraps every public method of a class, and
+instrument_functions() every public function of a module, so that
+each call is timed and counted under a name such as
+"UserCollection.add_user" or "main.add_user". A call is an error if
+it raises or returns False (the failure value of the add, modify and
+delete methods).
+
+Latencies go into a log-linear histogram in the style of
+HdrHistogram: SUB_BUCKETS buckets for each power of two of
+nanoseconds, so that every recorded value is within about 3% of the
+true one, in a fixed list of counters. Recording a call costs a few
+hundred nanoseconds.
+
+snapshot() returns everything recorded since the last reset();
+dump() writes a snapshot to a JSON file and serve() answers
+GET /metrics with one over HTTP (POST /metrics/reset resets).
+Generator functions are not instrumented, since calling one only
+creates the generator. Coroutine functions get an async wrapper,
+which times the call until the coroutine finishes. While tracing is
+on, tracer (see tracing) also makes a span of each call.
+'''
+
+import datetime
+import functools
+import inspect
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from loguru import logger
+
+#
+# Buckets per power of two of nanoseconds: 2 ** SUB_BUCKET_BITS
+#
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+#
+# Latencies above about 2 ** MAX_BITS nanoseconds (18 minutes) are
+# counted in the last bucket
+#
+MAX_BITS = 40
+BUCKET_COUNT = ( MAX_BITS - SUB_BUCKET_BITS + 1 ) << SUB_BUCKET_BITS
+
+#
+# Percentiles in each snapshot
+#
+PERCENTILES = ( 50, 90, 99, 99.9 )
+
+DEFAULT_METRICS_HOST = "127.0.0.1"
+DEFAULT_METRICS_PORT = 9464
+
+
+def bucket_index( nanoseconds ):
+    '''
+    The histogram bucket of a latency
+    '''
+    shift = nanoseconds.bit_length() - SUB_BUCKET_BITS - 1
+    if shift <= 0:
+        return nanoseconds if nanoseconds > 0 else 0
+    return min( ( shift << SUB_BUCKET_BITS ) + ( nanoseconds >> shift ),
+                BUCKET_COUNT - 1 )
+
+
+def bucket_bounds( index ):
+    '''
+    The lowest latency in a bucket, and the lowest in the next one
+    '''
+    if index < 2 * SUB_BUCKETS:
+        return index, index + 1
+    shift = ( index >> SUB_BUCKET_BITS ) - 1
+    lowest = ( index - ( shift << SUB_BUCKET_BITS ) ) << shift
+    return lowest, lowest + ( 1 << shift )
+
+
+def value_at( percent, counts, calls, maximum ):
+    '''
+    The latency in nanoseconds that percent of calls took at most
+    (the middle of its bucket), from a histogram's bucket counts
+    '''
+    if not calls:
+        return 0
+    wanted = max( 1, -( -percent * calls // 100 ) )
+    seen = 0
+    for index, count in enumerate( counts ):
+        seen += count
+        if seen >= wanted:
+            lowest, highest = bucket_bounds( index )
+            return min( ( lowest + highest ) // 2, maximum )
+    return maximum
+
+
+class OperationStats():
+    '''
+    Calls, errors and the latency histogram of one operation.
+
+    record() takes no lock, which would cost more than the rest of it
+    put together: the GIL keeps the counters consistent, though a
+    count can very occasionally be lost when two threads record the
+    same operation at the same moment.
+    '''
+    def __init__( self, name ):
+        self.name = name
+        self.reset()
+
+    def reset( self ):
+        '''
+        Forget everything recorded
+        '''
+        self.calls = 0
+        self.errors = 0
+        self.total = 0
+        self.maximum = 0
+        self.counts = [ 0 ] * BUCKET_COUNT
+
+    def record( self, nanoseconds, error=False ):
+        '''
+        Count a call that took nanoseconds
+        '''
+        # bucket_index, inlined
+        shift = nanoseconds.bit_length() - SUB_BUCKET_BITS - 1
+        if shift <= 0:
+            index = nanoseconds if nanoseconds > 0 else 0
+        else:
+            index = ( shift << SUB_BUCKET_BITS ) + ( nanoseconds >> shift )
+            if index >= BUCKET_COUNT:
+                index = BUCKET_COUNT - 1
+        self.calls += 1
+        self.total += nanoseconds
+        self.counts[ index ] += 1
+        if error:
+            self.errors += 1
+        if nanoseconds > self.maximum:
+            self.maximum = nanoseconds
+
+    def value_at( self, percent ):
+        '''
+        The latency in nanoseconds that percent of the calls took at
+        most
+        '''
+        return value_at( percent, self.counts, self.calls, self.maximum )
+
+    def snapshot( self ):
+        '''
+        A dictionary of the counts, latencies in microseconds, and the
+        non-empty buckets as [ lowest nanoseconds, count ] pairs
+        '''
+        calls, errors, total = self.calls, self.errors, self.total
+        maximum, counts = self.maximum, list( self.counts )
+        result = {
+            'calls': calls,
+            'errors': errors,
+            'mean_us': total / calls / 1e3 if calls else 0.0,
+            'max_us': maximum / 1e3,
+        }
+        for percent in PERCENTILES:
+            result[ f"p{percent:g}_us" ] = \
+                value_at( percent, counts, calls, maximum ) / 1e3
+        result[ 'buckets' ] = [ [ bucket_bounds( index )[ 0 ], count ]
+                                for index, count in enumerate( counts ) if count ]
+        return result
+
+
+#
+# OperationStats by operation name, and when they were last reset
+#
+operations = {}
+operations_lock = threading.Lock()
+started = datetime.datetime.now( datetime.timezone.utc )
+
+#
+# The running tracing.Tracer, if any
+#
+tracer = None
+
+
+def stats_for( name ):
+    '''
+    The OperationStats of the named operation, made on first use
+    '''
+    with operations_lock:
+        stats = operations.get( name )
+        if stats is None:
+            stats = operations[ name ] = OperationStats( name )
+        return stats
+
+
+def call_timed( function, args, kwargs, record ):
+    '''
+    Returns function( *args, **kwargs ), passing its duration and
+    whether it failed to record
+    '''
+    start = time.perf_counter_ns()
+    try:
+        result = function( *args, **kwargs )
+    except BaseException:
+        record( time.perf_counter_ns() - start, True )
+        raise
+    record( time.perf_counter_ns() - start, result is False )
+    return result
+
+
+async def call_timed_async( function, args, kwargs, record ):
+    '''
+    Returns await function( *args, **kwargs ), passing its duration
+    and whether it failed to record
+    '''
+    start = time.perf_counter_ns()
+    try:
+        result = await function( *args, **kwargs )
+    except BaseException:
+        record( time.perf_counter_ns() - start, True )
+        raise
+    record( time.perf_counter_ns() - start, result is False )
+    return result
+
+
+def timed( name, function ):
+    '''
+    function, wrapped so that its calls are recorded under name
+    '''
+    record = stats_for( name ).record
+    clock = time.perf_counter_ns
+
+    if inspect.iscoroutinefunction( function ):
+        @functools.wraps( function )
+        async def async_wrapper( *args, **kwargs ):
+            if tracer is not None:
+                return await tracer.call_async( name, function, args, kwargs, record )
+            return await call_timed_async( function, args, kwargs, record )
+
+        async_wrapper._metrics_name = name
+        return async_wrapper
+
+    @functools.wraps( function )
+    def wrapper( *args, **kwargs ):
+        if tracer is not None:
+            return tracer.call( name, function, args, kwargs, record )
+        # call_timed, inlined
+        start = clock()
+        try:
+            result = function( *args, **kwargs )
+        except BaseException:
+            record( clock() - start, True )
+            raise
+        record( clock() - start, result is False )
+        return result
+
+    wrapper._metrics_name = name
+    return wrapper
+
+
+def _instrumentable( name, function ):
+    return ( not name.startswith( "_" ) and inspect.isfunction( function ) and
+             not inspect.isgeneratorfunction( function ) and
+             not inspect.isasyncgenfunction( function ) and
+             not hasattr( function, "_metrics_name" ) )
+
+
+def instrument( prefix=None ):
+    '''
+    Class decorator: time every public method (including class and
+    static methods) defined in the class, as "<prefix>.<method>";
+    prefix defaults to the class name
+    '''
+    def decorate( cls ):
+        label = prefix or cls.__name__
+        for name, attribute in list( vars( cls ).items() ):
+            if isinstance( attribute, ( classmethod, staticmethod ) ):
+                function = attribute.__func__
+                if _instrumentable( name, function ):
+                    setattr( cls, name,
+                             type( attribute )( timed( f"{label}.{name}", function ) ) )
+            elif _instrumentable( name, attribute ):
+                setattr( cls, name, timed( f"{label}.{name}", attribute ) )
+        return cls
+    return decorate
+
+
+def instrument_functions( namespace, prefix ):
+    '''
+    Time every public function defined in the module whose globals()
+    are namespace, as "<prefix>.<function>". Later calls through the
+    module, including ones between its own functions, are timed.
+    '''
+    module_name = namespace[ "__name__" ]
+    for name, function in list( namespace.items() ):
+        if _instrumentable( name, function ) and function.__module__ == module_name:
+            namespace[ name ] = timed( f"{prefix}.{name}", function )
+
+
+def snapshot():
+    '''
+    Everything recorded since the last reset, by operation name
+    '''
+    with operations_lock:
+        recorded = sorted( operations.items() )
+    return {
+        'started': started.isoformat(),
+        'taken': datetime.datetime.now( datetime.timezone.utc ).isoformat(),
+        'operations': { name: stats.snapshot() for name, stats in recorded
+                        if stats.calls },
+    }
+
+
+def reset():
+    '''
+    Start recording afresh
+    '''
+    global started  # pylint:disable=global-statement,invalid-name
+    with operations_lock:
+        recorded = list( operations.values() )
+        started = datetime.datetime.now( datetime.timezone.utc )
+    for stats in recorded:
+        stats.reset()
+
+
+def dump( path, reset_after=False ):
+    '''
+    Write a snapshot to path as JSON, and reset if reset_after.
+    Returns the snapshot.
+    '''
+    taken = snapshot()
+    if reset_after:
+        reset()
+    with open( path, "w", encoding="utf-8" ) as metrics_file:
+        json.dump( taken, metrics_file, indent=2 )
+        metrics_file.write( "\n" )
+    logger.info( f"Metrics for {len( taken[ 'operations' ] )} operations "
+                 f"written to {path}" )
+    return taken
+
+
+class MetricsHandler( BaseHTTPRequestHandler ):
+    '''
+    GET /metrics: the snapshot as JSON; POST /metrics/reset: reset
+    '''
+    def do_GET( self ):  # pylint:disable=invalid-name
+        '''
+        Answer with a snapshot
+        '''
+        if self.path.rstrip( "/" ) != "/metrics":
+            self.send_error( 404 )
+            return
+        self._send_json( snapshot() )
+
+    def do_POST( self ):  # pylint:disable=invalid-name
+        '''
+        Reset, answering with the snapshot taken just before
+        '''
+        if self.path.rstrip( "/" ) != "/metrics/reset":
+            self.send_error( 404 )
+            return
+        taken = snapshot()
+        reset()
+        self._send_json( taken )
+
+    def _send_json( self, document ):
+        body = json.dumps( document ).encode( "utf-8" )
+        self.send_response( 200 )
+        self.send_header( "Content-Type", "application/json" )
+        self.send_header( "Content-Length", str( len( body ) ) )
+        self.end_headers()
+        self.wfile.write( body )
+
+    def log_message( self, format, *args ):  # pylint:disable=redefined-builtin
+        logger.debug( "Metrics request: {}", format % args )
+
+
+def serve( port=DEFAULT_METRICS_PORT, host=DEFAULT_METRICS_HOST ):
+    '''
+    Serve snapshots on host:port from a daemon thread (port 0 picks
+    a free port). Returns the server; call shutdown() to stop it.
+    '''
+    server = ThreadingHTTPServer( ( host, port ), MetricsHandler )
+    server.daemon_threads = True
+    threading.Thread( target=server.serve_forever, name="metrics-server",
+                      daemon=True ).start()
+    logger.info( f"Serving metrics on "
+                 f"http://{host}:{server.server_address[ 1 ]}/metrics" )
+    return server
+
+
+# --- END --- #
@@ -0,0 +1,250 @@
+'''
+Multi-process CSV ingestion
+
+The input file is cut into byte ranges that start and end on line
+boundaries. Parser processes take ranges from a queue, read and
+validate their rows, and route each row by a hash of its key
+(user_id or status_id) to one of the writer processes. Every row with
+a given key therefore reaches the same writer, so duplicates are
+caught by that writer's own database lookups without any coordination
+between writers. Each writer has its own connection pool.
+
+Processes are started with fork, so that writers inherit the
+collection they write to; the storage backends drop any inherited
+connections in the child and open their own.
+'''
+
+import csv
+import multiprocessing
+import os
+import queue
+import time
+import zlib
+
+from loguru import logger
+
+#
+# Bytes of input per range handed to a parser
+#
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+#
+# Number of parser and of writer processes
+#
+DEFAULT_WORKERS = max( 1, ( os.cpu_count() or 2 ) // 2 )
+
+#
+# Batches waiting for each writer before parsers have to wait
+#
+QUEUE_DEPTH = 8
+
+#
+# Seconds between checks that no process has died
+#
+POLL_INTERVAL = 0.5
+
+
+def byte_ranges( path, chunk_size=DEFAULT_CHUNK_SIZE ):
+    '''
+    Returns the header line of a CSV file and a list of
+    ( start, end ) byte offsets covering the rest of it, each about
+    chunk_size bytes and each starting at the beginning of a line.
+
+    Records must not contain line breaks inside quoted fields.
+    '''
+    with open( path, "rb" ) as csv_file:
+        header = csv_file.readline()
+        start = csv_file.tell()
+        size = os.fstat( csv_file.fileno() ).st_size
+        ranges = []
+        while start < size:
+            csv_file.seek( min( start + chunk_size, size ) )
+            if csv_file.tell() < size:
+                csv_file.readline()
+            end = csv_file.tell()
+            ranges.append( ( start, end ) )
+            start = end
+    return header.decode( "utf-8-sig" ), ranges
+
+
+def partition_of( key, partitions ):
+    '''
+    The writer that owns key. Uses CRC-32 rather than hash(), which
+    differs between processes.
+    '''
+    return zlib.crc32( key.encode( "utf-8" ) ) % partitions
+
+
+def read_range( path, start, end ):
+    '''
+    Yields the lines of path between byte offsets start and end
+    '''
+    with open( path, "rb" ) as csv_file:
+        csv_file.seek( start )
+        while csv_file.tell() < end:
+            line = csv_file.readline()
+            if not line:
+                break
+            yield line.decode( "utf-8" )
+
+
+def parse_ranges( path, fieldnames, key_index, range_queue,
+                  partition_queues, result_queue, batch_size ):
+    '''
+    Parser process: reads ranges from range_queue until it gets
+    None, and sends batches of valid rows to the writer queue that
+    owns each row's key. Reports the number of rejected rows.
+    '''
+    partitions = len( partition_queues )
+    pending = [ [] for _ in range( partitions ) ]
+    rejected = 0
+    rows = 0
+    while True:
+        byte_range = range_queue.get()
+        if byte_range is None:
+            break
+        for row in csv.reader( read_range( path, *byte_range ) ):
+            rows += 1
+            if len( row ) != len( fieldnames ) or not all( row ):
+                rejected += 1
+                continue
+            partition = partition_of( row[ key_index ], partitions )
+            pending[ partition ].append( row )
+            if len( pending[ partition ] ) >= batch_size:
+                partition_queues[ partition ].put( pending[ partition ] )
+                pending[ partition ] = []
+
+    for partition, batch in enumerate( pending ):
+        if batch:
+            partition_queues[ partition ].put( batch )
+    #
+    # Make sure every batch is in the writers' pipes before saying we
+    # are done, since the parent then tells the writers to stop.
+    #
+    for partition_queue in partition_queues:
+        partition_queue.close()
+        partition_queue.join_thread()
+    result_queue.put( ( "parsed", rows, rejected ) )
+
+
+def write_partition( fieldnames, write_batch, collection, partition_queue,
+                     result_queue, new_summary ):
+    '''
+    Writer process: writes batches from partition_queue with
+    write_batch( rows, collection, summary ) until it gets None, then
+    reports its summary.
+    '''
+    summary = new_summary()
+    while True:
+        batch = partition_queue.get()
+        if batch is None:
+            break
+        write_batch( [ dict( zip( fieldnames, row ) ) for row in batch ],
+                     collection, summary )
+    result_queue.put( ( "written", summary ) )
+
+
+def parallel_load( filename, collection, key_field, write_batch, new_summary,
+                   workers=DEFAULT_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE,
+                   batch_size=1000 ):
+    '''
+    Load a CSV file into collection with workers parser processes
+    and workers writer processes.
+
+    Rows are routed to writers by key_field. Each writer builds its
+    own summary with new_summary() and passes it, with each batch of
+    row dictionaries, to write_batch. Rows with missing fields are
+    added to the summary's rejected and malformed counts.
+
+    Returns the combined summary, with seconds and rows_per_second
+    set, or None if collection's backend cannot be shared between
+    processes or a worker died.
+    '''
+    logger.debug( "Entering function" )
+    logger.debug( "Param: filename: {}", filename )
+
+    if not collection.backend.shared_between_processes:
+        logger.error( f"The {collection.backend.name} backend cannot be "
+                      "loaded from several processes" )
+        return None
+
+    start_time = time.perf_counter()
+    header, ranges = byte_ranges( filename, chunk_size )
+    fieldnames = next( csv.reader( [ header ] ) )
+    if key_field not in fieldnames:
+        logger.error( f"{filename} has no {key_field} column" )
+        return None
+
+    context = multiprocessing.get_context( "fork" )
+    range_queue = context.Queue()
+    for byte_range in ranges:
+        range_queue.put( byte_range )
+    for _ in range( workers ):
+        range_queue.put( None )
+    partition_queues = [ context.Queue( QUEUE_DEPTH ) for _ in range( workers ) ]
+    result_queue = context.Queue()
+
+    parsers = [
+        context.Process(
+            target=parse_ranges,
+            args=( filename, fieldnames, fieldnames.index( key_field ), range_queue,
+                   partition_queues, result_queue, batch_size ),
+            name=f"csv-parser-{number}" )
+        for number in range( workers )
+    ]
+    writers = [
+        context.Process(
+            target=write_partition,
+            args=( fieldnames, write_batch, collection, partition_queue,
+                   result_queue, new_summary ),
+            name=f"csv-writer-{number}" )
+        for number, partition_queue in enumerate( partition_queues )
+    ]
+    for process in parsers + writers:
+        process.start()
+
+    summary = new_summary()
+    rows = 0
+    parsers_left = len( parsers )
+    writers_left = len( writers )
+    try:
+        while parsers_left or writers_left:
+            try:
+                result = result_queue.get( timeout=POLL_INTERVAL )
+            except queue.Empty:
+                if any( process.exitcode not in ( None, 0 )
+                        for process in parsers + writers ):
+                    logger.error( f"A worker died while loading {filename}" )
+                    return None
+                continue
+
+            if result[ 0 ] == "parsed":
+                _, parsed_rows, rejected = result
+                rows += parsed_rows
+                summary.rejected += rejected
+                summary.malformed += rejected
+                parsers_left -= 1
+                if not parsers_left:
+                    #
+                    # Every row has been routed; let the writers finish
+                    #
+                    for partition_queue in partition_queues:
+                        partition_queue.put( None )
+            else:
+                summary.merge( result[ 1 ] )
+                writers_left -= 1
+
+    finally:
+        for process in parsers + writers:
+            if process.exitcode is None and ( parsers_left or writers_left ):
+                process.terminate()
+            process.join()
+
+    summary.seconds = time.perf_counter() - start_time
+    summary.rows_per_second = rows / summary.seconds if summary.seconds else 0.0
+    logger.info( f"Loaded {rows} rows from {filename} with {workers} workers "
+                 f"in {summary.seconds:.3f}s ({summary.rows_per_second:.0f} rows/s)" )
+    return summary
+
+
+# --- END --- #
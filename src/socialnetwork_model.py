@@ -2,12 +2,12 @@
 Provide an SQL infrastructure for social network
 '''
 
-import sys
+import os
+import threading
+import time
+import weakref
 import typing  # type: ignore  # noqa:F401  pylint:disable=unused-import
-
-from pymongo import MongoClient
-from pymongo.collection import ReturnDocument
-from pymongo.errors import PyMongoError
+from collections import OrderedDict
 
 #
 # When specifying both flake8 and pylint directives
@@ -17,34 +17,95 @@ from pymongo.errors import PyMongoError
 import pysnooper  # type: ignore  # noqa:F401  pylint:disable=unused-import
 from loguru import logger
 
+import log_config
+import metrics
+from storage_backends import (  # noqa:F401  pylint:disable=unused-import
+    DEFAULT_MAX_IDLE_TIME_MS,
+    DEFAULT_MAX_POOL_SIZE,
+    DEFAULT_WAIT_QUEUE_TIMEOUT_MS,
+    EXPECTED_INDEXES,
+    FILTER_REGEX,
+    FILTER_TEXT,
+    FILTER_TRIGRAM,
+    DuplicateKey,
+    MemoryBackend,
+    MongoBackend,
+    MongoDBConnection,
+    PoolMonitor,
+    StorageBackend,
+    StorageError,
+    mongo,
+)
+from sqlite_backend import DEFAULT_SQLITE_PATH, SQLiteBackend  # noqa:F401
+from status_reaper import reaper_for
+from trigram_index import TrigramIndex
+
+#
+# Logging config (see log_config)
+#
+log_config.setup()
+
+#
+# Cursor batch size used when warming UserCache from the database
+#
+DEFAULT_WARM_BATCH_SIZE = 10000
+
 #
-# Logging config
+# Cursor batch size used when exporting users and statuses
 #
-logger.remove()
+DEFAULT_EXPORT_BATCH_SIZE = 5000
 
-LOG_FORMAT = "{time:YYYY-MM-DD @ HH:mm:ss} | {level} | " + \
-             "{file} : {function} : {line} : {message}"
+#
+# Statuses per page when listing a user's status updates, and the
+# fields fetched for each
+#
+DEFAULT_STATUS_PAGE_SIZE = 20
+DEFAULT_STATUS_PAGE_FIELDS = ( "status_text", )
+
+#
+# UserCache sizing: maximum number of user IDs held, and how many
+# seconds a "user does not exist" entry is trusted for
+#
+DEFAULT_USER_CACHE_CAPACITY = 1000000
+DEFAULT_NEGATIVE_TTL = 60
 
-logger.add( sys.stderr,
-            format=LOG_FORMAT,
-            level="DEBUG" )
+#
+# StatusCache sizing once it is enabled: number of statuses held, and
+# how many seconds a "status does not exist" entry is trusted for
+#
+DEFAULT_STATUS_CACHE_CAPACITY = 10000
+DEFAULT_STATUS_NEGATIVE_TTL = 5
 
-logger.add( "log_{time:YYYY-MM-DD}.log",
-            format=LOG_FORMAT,
-            level="DEBUG" )
 
 class UsersTable():
     '''
     Instances of this class correspond to rows in the table,
     where a row is an individual user.
+
+    Records are built in bulk when reading, so they use __slots__
+    (no per-instance __dict__) and their constructor does not log.
     '''
+    __slots__ = ( 'user_id', 'user_name', 'user_last_name', 'email' )
+
     def __init__(self, user_id, user_name, user_last_name, email ):
-        logger.debug( "UsersTable" )
         self.user_id   = user_id
         self.user_name = user_name
         self.user_last_name = user_last_name
         self.email     = email
 
+    @classmethod
+    def from_document( cls, document ):
+        '''
+        Build a record from a user document or dictionary. Fills the
+        slots directly, which saves the call of __init__.
+        '''
+        record = object.__new__( cls )
+        record.user_id = document[ 'user_id' ]
+        record.user_name = document[ 'user_name' ]
+        record.user_last_name = document[ 'user_last_name' ]
+        record.email = document[ 'email' ]
+        return record
+
     @staticmethod
     def as_dict( user_id, user_name, user_last_name, email ):
         '''
@@ -61,47 +122,411 @@ class UsersTable():
         return new_user
 
 
+class BoundedCache():
+    '''
+    Thread-safe mapping with a fixed capacity, least-recently-used
+    eviction and an optional time-to-live per entry.
+
+    Keys can also be stored as known to be absent (ABSENT), with
+    their own time-to-live, so that repeated lookups for something
+    that does not exist can be answered without a round trip.
+    '''
+    ABSENT = object()
+
+    def __init__( self, capacity, ttl=None, negative_ttl=None,
+                  on_drop=None ):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.on_drop = on_drop
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _expires_at( self, value ):
+        ttl = self.negative_ttl if value is self.ABSENT else self.ttl
+        return time.monotonic() + ttl if ttl else None
+
+    def _drop( self, value ):
+        if self.on_drop is not None and value is not self.ABSENT:
+            self.on_drop( value )
+
+    def _get( self, key, now ):
+        # Caller holds the lock
+        entry = self._entries.get( key )
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= now:
+            del self._entries[ key ]
+            self.expirations += 1
+            self.misses += 1
+            self._drop( value )
+            return None
+        self._entries.move_to_end( key )
+        if value is self.ABSENT:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def _put( self, key, value ):
+        # Caller holds the lock
+        self._entries[ key ] = ( value, self._expires_at( value ) )
+        self._entries.move_to_end( key )
+        while len( self._entries ) > self.capacity:
+            _, ( evicted, _ ) = self._entries.popitem( last=False )
+            self.evictions += 1
+            self._drop( evicted )
+
+    def get( self, key, default=None ):
+        '''
+        Return the value stored for key, ABSENT for a negative entry,
+        or default on a miss
+        '''
+        with self._lock:
+            entry = self._get( key, time.monotonic() )
+        return default if entry is None else entry[ 0 ]
+
+    def get_many( self, keys ):
+        '''
+        Return a dictionary of the values (including ABSENT) stored
+        for those keys that are in the cache
+        '''
+        found = {}
+        with self._lock:
+            now = time.monotonic()
+            for key in keys:
+                entry = self._get( key, now )
+                if entry is not None:
+                    found[ key ] = entry[ 0 ]
+        return found
+
+    def put( self, key, value ):
+        '''
+        Store value for key, evicting the least recently used
+        entry if the cache is full
+        '''
+        with self._lock:
+            self._put( key, value )
+
+    def put_many( self, keys, value ):
+        '''
+        Store the same value for every key
+        '''
+        with self._lock:
+            for key in keys:
+                self._put( key, value )
+
+    def pop( self, key, default=None ):
+        '''
+        Remove key and return its value, or default if not cached
+        '''
+        with self._lock:
+            entry = self._entries.pop( key, None )
+        return default if entry is None else entry[ 0 ]
+
+    def discard_if( self, predicate ):
+        '''
+        Remove every entry whose value satisfies predicate
+        '''
+        with self._lock:
+            doomed = [ key for key, ( value, _ ) in self._entries.items()
+                       if value is not self.ABSENT and predicate( value ) ]
+            for key in doomed:
+                del self._entries[ key ]
+
+    def clear( self ):
+        '''
+        Remove every entry
+        '''
+        with self._lock:
+            self._entries.clear()
+
+    def __len__( self ):
+        return len( self._entries )
+
+    def stats( self ):
+        '''
+        Return the size of the cache and its hit, miss and eviction
+        counters
+        '''
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                'size': len( self._entries ),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': (
+                    ( self.hits + self.negative_hits ) / lookups
+                    if lookups else 0.0
+                ),
+            }
+
+
 class UserCache():
-    cache = {}
+    '''
+    In-memory record of the user IDs that have an account, and of
+    recently checked IDs that do not.
+
+    Each backend has a UserCache of its own (see UserCache.of), sized
+    by the settings last passed to configure(). It starts out cold.
+    Once warm() has loaded every user ID from the backend, it is
+    complete. If, besides, no other process writes to the backend, it
+    is authoritative: from then on a miss means that the user does not
+    exist. Otherwise, or once an entry has been evicted or has expired,
+    callers should confirm misses against the database (see
+    confirm_users).
+    '''
+    capacity = DEFAULT_USER_CACHE_CAPACITY
+    ttl = None
+    negative_ttl = DEFAULT_NEGATIVE_TTL
+
+    def __init__( self, backend ):
+        self._backend = weakref.ref( backend )
+        self.warm_report = None
+        self._warming = False
+        self._erased_while_warming = set()
+        self.reset()
 
     @classmethod
-    def store( self, userID ):
-        logger.debug( f"userID: {userID}" )
-        if userID not in self.cache:
-            self.cache[ userID ] = 1
-            return True
-        logger.warning( f"userID: {userID} already in cache" )
-        return False
+    def of( cls, backend=None ):
+        '''
+        Returns the UserCache of backend, or of the default backend
+        if None
+        '''
+        return backend_state( backend ).user_cache
 
     @classmethod
+    def configure( cls, capacity=DEFAULT_USER_CACHE_CAPACITY, ttl=None,
+                   negative_ttl=DEFAULT_NEGATIVE_TTL ):
+        '''
+        Give every backend an empty cache with the given capacity and
+        time-to-live (in seconds) for present and absent users
+        '''
+        cls.capacity = capacity
+        cls.ttl = ttl
+        cls.negative_ttl = negative_ttl
+        for state in backend_states():
+            state.user_cache.reset()
+
+    def reset( self ):
+        '''
+        Replace the cache with an empty, cold one
+        '''
+        self.cache = BoundedCache( self.capacity, ttl=self.ttl,
+                                   negative_ttl=self.negative_ttl,
+                                   on_drop=self._on_drop )
+        self.complete = False
+        self._dropped = False
+
+    @property
+    def authoritative( self ):
+        '''
+        Whether a miss means that the user does not exist: the cache
+        is complete, and users written by other processes cannot have
+        been missed
+        '''
+        backend = self._backend()
+        return ( self.complete and backend is not None and
+                 not backend.shared_between_processes )
+
+    def _on_drop( self, value ):
+        # pylint:disable=unused-argument
+        #
+        # Once a present user has been evicted or has expired, a miss
+        # no longer proves that the user does not exist.
+        #
+        self._dropped = True
+        self.complete = False
+
+    def store( self, userID ):
+        logger.debug( "userID: {}", userID )
+        if self.cache.get( userID ) is True:
+            return False
+        self.cache.put( userID, True )
+        return True
+
+    def store_many( self, userIDs ):
+        logger.debug( "Entering method" )
+        self.cache.put_many( userIDs, True )
+
+    def store_absent( self, userID ):
+        '''
+        Record that userID is known not to have an account
+        '''
+        self.cache.put( userID, BoundedCache.ABSENT )
+
+    def store_absent_many( self, userIDs ):
+        '''
+        Record that none of userIDs have an account
+        '''
+        self.cache.put_many( userIDs, BoundedCache.ABSENT )
+
     def read( self, userID ):
-        logger.debug( f"userID: {userID}" )
-        if userID in self.cache:
-            return True
-        logger.warning( f"userID: {userID} not in cache" )
-        return False
+        logger.debug( "userID: {}", userID )
+        return self.cache.get( userID ) is True
+
+    def read_many( self, userIDs ):
+        logger.debug( "Entering method" )
+        return { userID for userID, value in self.cache.get_many( userIDs ).items()
+                 if value is True }
+
+    def lookup_many( self, userIDs ):
+        '''
+        Returns two sets: the IDs known to exist and the IDs known
+        not to exist. IDs in neither set are not cached.
+        '''
+        present = set()
+        absent = set()
+        for userID, value in self.cache.get_many( userIDs ).items():
+            if value is True:
+                present.add( userID )
+            else:
+                absent.add( userID )
+        return present, absent
 
-    @classmethod
     def erase( self, userID ):
-        logger.debug( f"userID: {userID}" )
-        if userID in self.cache:
-            del self.cache[ userID ]
-            return True
-        logger.warning( f"userID: {userID} not in cache" )
-        return False
+        logger.debug( "userID: {}", userID )
+        if self._warming:
+            self._erased_while_warming.add( userID )
+        return self.cache.pop( userID ) is True
+
+    def erase_many( self, userIDs ):
+        '''
+        erase() for each of userIDs
+        '''
+        logger.debug( "Entering method" )
+        for userID in userIDs:
+            self.erase( userID )
+
+    def stats( self ):
+        '''
+        Returns the cache size and hit, miss and eviction counters
+        '''
+        return self.cache.stats()
+
+    def warm( self, batch_size=DEFAULT_WARM_BATCH_SIZE ):
+        '''
+        Load every user ID from the backend into the cache,
+        streaming only the user_id field.
+
+        Returns a report dictionary with the number of entries and
+        the time taken, or None if the database could not be read.
+        '''
+        logger.debug( "Entering method" )
+
+        backend = self._backend()
+        if backend is None:
+            return None
+        self._warming = True
+        self._dropped = False
+        self._erased_while_warming = set()
+        start_time = time.perf_counter()
+        loaded = 0
+        try:
+            user_ids = []
+            for userID in backend.iter_user_ids( batch_size ):
+                user_ids.append( userID )
+                if len( user_ids ) >= batch_size:
+                    self.cache.put_many( user_ids, True )
+                    loaded += len( user_ids )
+                    user_ids = []
+            self.cache.put_many( user_ids, True )
+            loaded += len( user_ids )
+
+        except ( StorageError ) as db_exception:
+            logger.error( 'Error warming user cache' )
+            logger.error(db_exception)
+            return None
+
+        else:
+            #
+            # Users deleted while we were streaming may have been
+            # loaded back in; take them out again.
+            #
+            for userID in self._erased_while_warming:
+                self.cache.pop( userID )
+            #
+            # If the cache is too small to hold every user, it cannot
+            # be treated as complete.
+            #
+            self.complete = not self._dropped
+            self.warm_report = {
+                'entries': len( self.cache ),
+                'loaded': loaded,
+                'seconds': time.perf_counter() - start_time,
+            }
+            logger.info(
+                f"User cache warmed: {self.warm_report['entries']} entries "
+                f"in {self.warm_report['seconds']:.3f}s" )
+            return self.warm_report
+
+        finally:
+            self._warming = False
+
+    def warm_in_background( self, batch_size=DEFAULT_WARM_BATCH_SIZE ):
+        '''
+        Run warm() on a daemon thread and return the thread, so that
+        the caller can start serving requests straight away.
+        '''
+        logger.debug( "Entering method" )
+        warm_thread = threading.Thread(
+            target=self.warm,
+            kwargs={ 'batch_size': batch_size },
+            name="user-cache-warmup",
+            daemon=True
+        )
+        warm_thread.start()
+        return warm_thread
 
 
 class StatusTable():
     '''
     Instances of this class correspond to rows in the table,
     where a row is an individual status.
+
+    Like UsersTable, records use __slots__ and are built without
+    logging.
     '''
+    __slots__ = ( 'status_id', 'user_id', 'status_text' )
+
     def __init__(self, status_id, user_id, status_text ):
-        logger.debug( "StatusTable" )
         self.status_id   = status_id
         self.user_id     = user_id
         self.status_text = status_text
 
+    @classmethod
+    def from_document( cls, document ):
+        '''
+        Build a record from a status document or dictionary, filling
+        the slots directly as UsersTable.from_document does
+        '''
+        record = object.__new__( cls )
+        record.status_id = document[ 'status_id' ]
+        record.user_id = document[ 'user_id' ]
+        record.status_text = document[ 'status_text' ]
+        return record
+
+    def copy( self ):
+        '''
+        A new record with the same fields
+        '''
+        record = object.__new__( StatusTable )
+        record.status_id = self.status_id
+        record.user_id = self.user_id
+        record.status_text = self.status_text
+        return record
+
     @staticmethod
     def as_dict( status_id, user_id, status_text ):
         '''
@@ -117,6 +542,157 @@ class StatusTable():
 
         return new_status
 
+
+class StatusView():
+    '''
+    A status read with only some of its fields, or as an undecoded
+    document: it has the attributes of StatusTable, but each one is
+    looked up in the document only when it is read. Reading a field
+    that was not fetched raises AttributeError.
+    '''
+    __slots__ = ( '_document', )
+
+    def __init__( self, document ):
+        self._document = document
+
+    def __getattr__( self, name ):
+        if name not in StatusTable.__slots__:
+            raise AttributeError( name )
+        try:
+            return self._document[ name ]
+        except KeyError:
+            raise AttributeError( f"{name} was not fetched" ) from None
+
+
+class StatusCache():
+    '''
+    Optional read-through cache of StatusTable objects keyed by
+    status_id. Each backend has one of its own (see StatusCache.of),
+    shared by every UserStatusCollection on that backend so that
+    writes through any instance invalidate it. Lookups for status IDs
+    that do not exist are cached too.
+
+    Disabled until configure() is called with a non-zero capacity.
+    '''
+    capacity = 0
+    ttl = None
+
+    def __init__( self ):
+        self.reset()
+
+    @classmethod
+    def of( cls, backend=None ):
+        '''
+        Returns the StatusCache of backend, or of the default backend
+        if None
+        '''
+        return backend_state( backend ).status_cache
+
+    @classmethod
+    def configure( cls, capacity=DEFAULT_STATUS_CACHE_CAPACITY, ttl=None,
+                   negative_ttl=DEFAULT_STATUS_NEGATIVE_TTL ):
+        '''
+        Give every backend an empty cache holding up to capacity
+        statuses for up to ttl seconds, and missing status IDs for up
+        to negative_ttl seconds. A capacity of 0 disables them.
+        '''
+        cls.capacity = capacity
+        cls.ttl = ttl
+        cls.negative_ttl = negative_ttl
+        for state in backend_states():
+            state.status_cache.reset()
+
+    def reset( self ):
+        '''
+        Replace the cache with an empty one, or None if disabled
+        '''
+        if self.capacity:
+            self.cache = BoundedCache( self.capacity, ttl=self.ttl,
+                                       negative_ttl=self.negative_ttl )
+        else:
+            self.cache = None
+
+    def invalidate( self, status_id ):
+        '''
+        Forget whatever is cached for status_id
+        '''
+        if self.cache is not None:
+            self.cache.pop( status_id )
+
+    def invalidate_many( self, status_ids ):
+        '''
+        Forget whatever is cached for each of status_ids
+        '''
+        if self.cache is not None:
+            for status_id in status_ids:
+                self.cache.pop( status_id )
+
+    def invalidate_user( self, user_id ):
+        '''
+        Forget every cached status that belongs to user_id
+        '''
+        if self.cache is not None:
+            self.cache.discard_if( lambda status: status.user_id == user_id )
+
+    def invalidate_users( self, user_ids ):
+        '''
+        Forget every cached status that belongs to any of user_ids, in
+        one pass over the cache
+        '''
+        if self.cache is not None:
+            user_ids = set( user_ids )
+            self.cache.discard_if( lambda status: status.user_id in user_ids )
+
+    def stats( self ):
+        '''
+        Returns the cache size and hit-rate counters, or None if the
+        cache is disabled
+        '''
+        if self.cache is None:
+            return None
+        return self.cache.stats()
+
+
+class BackendState():
+    '''
+    The caches and the trigram index that describe the data in one
+    backend, shared by every collection on it
+    '''
+    def __init__( self, backend ):
+        self.user_cache = UserCache( backend )
+        self.status_cache = StatusCache()
+        self.trigram_index = None
+
+
+#
+# The BackendState of each backend (see backend_state)
+#
+states_by_backend = weakref.WeakKeyDictionary()
+states_lock = threading.Lock()
+
+
+def backend_state( backend=None ):
+    '''
+    Returns the BackendState of backend, or of the default backend if
+    None, made on first use
+    '''
+    if backend is None:
+        backend = get_default_backend()
+    with states_lock:
+        state = states_by_backend.get( backend )
+        if state is None:
+            state = states_by_backend[ backend ] = BackendState( backend )
+        return state
+
+
+def backend_states():
+    '''
+    Returns the BackendState of every backend in use
+    '''
+    with states_lock:
+        return list( states_by_backend.values() )
+
+
 def dict_to_status_gen( dict_iterator ):
     '''
     Create a generator of StatusTable objects
@@ -124,37 +700,134 @@ def dict_to_status_gen( dict_iterator ):
     '''
     logger.debug( "Enter function" )
 
+    from_document = StatusTable.from_document
     for status_dict in dict_iterator:
-        yield( StatusTable(
-                status_dict[ "status_id" ],
-                status_dict[ "user_id" ],
-                status_dict[ "status_text" ]
-            )
-        )
+        yield from_document( status_dict )
 
-class MongoDBConnection():
-    """MongoDB Connection"""
 
-    def __init__(self, host='127.0.0.1', port=27017):
-        """ be sure to use the ip address not name for local windows"""
-        self.host = host
-        self.port = port
-        self.connection = None
+def confirm_users( user_ids, backend=None ):
+    '''
+    Returns the subset of user_ids that have an account.
 
-    def __enter__(self):
-        self.connection = MongoClient(self.host, self.port)
-        return self
+    Answered from UserCache alone when it is authoritative. Otherwise,
+    the IDs that are not cached either way are looked up in the
+    database with one query, and the answers are added to the cache.
+    '''
+    user_ids = set( user_ids )
+    user_cache = UserCache.of( backend )
+    known, absent = user_cache.lookup_many( user_ids )
+    if user_cache.authoritative:
+        return known
+    unknown = user_ids - known - absent
+    if not unknown:
+        return known
+
+    found = UserCollection( backend ).existing_user_ids( unknown )
+    if found is None:
+        return known
+    user_cache.store_many( found )
+    user_cache.store_absent_many( unknown - found )
+    return known | found
+
+
+async def confirm_users_async( user_ids, writes, backend=None ):
+    '''
+    Coroutine version of confirm_users, looking up the users that
+    are not cached through writes (see StorageBackend.async_writes)
+    '''
+    user_ids = set( user_ids )
+    user_cache = UserCache.of( backend )
+    known, absent = user_cache.lookup_many( user_ids )
+    if user_cache.authoritative:
+        return known
+    unknown = user_ids - known - absent
+    if not unknown:
+        return known
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.connection.close()
+    try:
+        found = await writes.existing_user_ids( unknown )
 
+    except ( StorageError ) as db_exception:
+        logger.info( 'Error looking up existing user IDs' )
+        logger.info(db_exception)
+        return known
 
+    user_cache.store_many( found )
+    user_cache.store_absent_many( unknown - found )
+    return known | found
+
+
+class IndexManager():
+    '''
+    Creates and checks the indexes that the storage backend relies
+    on (for MongoDB, those listed in EXPECTED_INDEXES).
+
+    ensure() only does the work once per backend; calling it again is
+    a no-op. Creating an index that already exists is also a no-op on
+    the server, so running it against an existing database is safe.
+    '''
+    _lock = threading.Lock()
+
+    @classmethod
+    def ensure( cls, force=False, backend=None ):
+        '''
+        Create any missing indexes. Returns True if all of the
+        expected indexes are in place.
+        '''
+        logger.debug( "Entering method" )
+
+        backend = backend if backend is not None else get_default_backend()
+        with cls._lock:
+            if backend.unique_keys_enforced and not force:
+                return True
+
+            try:
+                backend.ensure_indexes()
+
+            except ( StorageError ) as db_exception:
+                logger.error( 'Error creating indexes' )
+                logger.error(db_exception)
+                return False
+
+            else:
+                logger.debug( "Indexes in place" )
+                return True
+
+    @classmethod
+    def verify( cls, backend=None ):
+        '''
+        Check the expected indexes against the database.
+
+        Returns a dictionary with the names of the indexes that are
+        present, missing, and present but never used since the
+        server started (according to $indexStats), each given as
+        "collection.index". Returns None if the database cannot be
+        reached.
+        '''
+        logger.debug( "Entering method" )
+
+        backend = backend if backend is not None else get_default_backend()
+        try:
+            report = backend.verify_indexes()
+
+        except ( StorageError ) as db_exception:
+            logger.error( 'Error verifying indexes' )
+            logger.error(db_exception)
+            return None
+
+        else:
+            return report
+
+
+@metrics.instrument()
 class UserCollection():
     '''
     Class to organize methods that operate on users.
     '''
-    def __init__(self):
+    def __init__(self, backend=None):
         logger.debug( "UserCollection" )
+        self.backend = backend if backend is not None else get_default_backend()
+        self.state = backend_state( self.backend )
 
     def add_user( self, new_user_id, new_email,
                   new_user_name, new_user_last_name ):
@@ -162,76 +835,122 @@ class UserCollection():
         Adds a new user to the collection
         '''
         logger.debug( "Entering method" )
-        logger.debug( "Param: user_id: " + new_user_id )
+        logger.debug( "Param: user_id: {}", new_user_id )
 
-        if UserCache().read( new_user_id ):
+        if self.state.user_cache.read( new_user_id ):
             logger.debug( "User already in database" )
             return False
 
         try:
-            with mongo:
-                d_b = mongo.connection.media
-                users_collection = d_b["users"]
-                new_user = UsersTable.as_dict(
-                    user_id = new_user_id,
-                    user_name = new_user_name,
-                    user_last_name = new_user_last_name,
-                    email = new_email
-                )
-                users_collection.insert_one( new_user )
-
-        except ( PyMongoError ) as db_exception:
+            new_user = UsersTable.as_dict(
+                user_id = new_user_id,
+                user_name = new_user_name,
+                user_last_name = new_user_last_name,
+                email = new_email
+            )
+            self._finish_deletes( ( new_user_id, ) )
+            self.backend.insert_user( new_user )
+
+        except ( DuplicateKey ):
+            logger.debug( "User already in database" )
+            self.state.user_cache.store( new_user_id )
+            return False
+
+        except ( StorageError ) as db_exception:
             logger.info(f'Error creating user = {new_user_id}')
             logger.info(db_exception)
             return False
 
         else:
-            UserCache().store( new_user_id )
+            self.state.user_cache.store( new_user_id )
             logger.debug( "User added" )
             return True
 
-    def modify_user( self, mod_user_id, mod_email,
-                     mod_user_name, mod_user_last_name):
+    def existing_user_ids( self, user_ids ):
         '''
-        Modifies an existing user
+        Returns the subset of user_ids that are already in the
+        database, using a single query.
         '''
         logger.debug( "Entering method" )
-        logger.debug( "Param: mod_user_id: " + mod_user_id )
-        logger.debug( "Param: mod_user_name: " + mod_user_name )
 
-        user_to_mod = self.search_user( mod_user_id )
+        try:
+            found = self.backend.existing_user_ids( user_ids )
 
-        if user_to_mod is None:
-            logger.debug( "User not in database" )
-            return False
+        except ( StorageError ) as db_exception:
+            logger.info( 'Error looking up existing user IDs' )
+            logger.info(db_exception)
+            return None
+
+        else:
+            return found
+
+    def insert_users( self, new_users ):
+        '''
+        Writes a batch of user dictionaries (see UsersTable.as_dict)
+        with a single unordered insert_many.
+
+        Returns three lists of user IDs: inserted, already present
+        and failed. UserCache is updated with the inserted IDs.
+        '''
+        logger.debug( "Entering method" )
+
+        if not new_users:
+            return [], [], []
 
         try:
-            with mongo:
-                d_b = mongo.connection.media
-                users_collection = d_b["users"]
-
-                query_json  = { 'user_id': mod_user_id }
-                update_json = { '$set': {
-                        'user_name': mod_user_name,
-                        'user_last_name': mod_user_last_name,
-                        'email': mod_email,
-                    }
-                }
+            self._finish_deletes( user[ "user_id" ] for user in new_users )
+            written, duplicates, failed = self.backend.insert_users( new_users )
+
+        except ( StorageError ) as db_exception:
+            logger.info( 'Error inserting batch of users' )
+            logger.info(db_exception)
+            return [], [], [ user[ "user_id" ] for user in new_users ]
+
+        if failed:
+            logger.info( f'Error inserting {len( failed )} users' )
+        inserted_ids = [ new_users[ i ][ "user_id" ] for i in written ]
+        self.state.user_cache.store_many( inserted_ids )
+        logger.debug( "{} users added", len( inserted_ids ) )
+        return (
+            inserted_ids,
+            [ new_users[ i ][ "user_id" ] for i in duplicates ],
+            [ new_users[ i ][ "user_id" ] for i in failed ],
+        )
+
+    def modify_user( self, mod_user_id, mod_email,
+                     mod_user_name, mod_user_last_name):
+        '''
+        Modifies an existing user, with a single conditional update.
+
+        Requirements:
+        - Returns False if the user is not in the database or there
+          is an error.
+        - Otherwise, it returns True.
+        '''
+        logger.debug( "Entering method" )
+        logger.debug( "Param: mod_user_id: {}", mod_user_id )
+        logger.debug( "Param: mod_user_name: {}", mod_user_name )
 
-                updated_user = users_collection.find_one_and_update(
-                        query_json,
-                        update_json,
-                        return_document=ReturnDocument.AFTER
-                )
+        try:
+            matched = self.backend.update_user(
+                mod_user_id,
+                {
+                    'user_name': mod_user_name,
+                    'user_last_name': mod_user_last_name,
+                    'email': mod_email,
+                }
+            )
 
-        except ( PyMongoError ) as db_exception:
+        except ( StorageError ) as db_exception:
             logger.info(f'Error modifying user = {mod_user_id}')
             logger.info(db_exception)
+            return False
 
-        if updated_user[ "email" ] == mod_email:
-            logger.debug( "User updated" )
-            return True
-        return False
+        if not matched:
+            logger.debug( "User not in database" )
+            return False
+        logger.debug( "User updated" )
+        return True
 
     def delete_user( self, delete_user_id ):
         '''
@@ -240,81 +959,271 @@ class UserCollection():
         Requirements:
         - Returns False if there are any errors (such as user_id not found)
         - Otherwise, it returns True.
+        - The user's statuses are hidden at once. On backends with a
+          deferred cascade they are deleted afterwards, in the
+          background, by the backend's StatusReaper.
         '''
         logger.debug( "Entering function" )
-        logger.debug( f"delete_user_id: {delete_user_id}" )
-
-        user_to_del = UserCache().read( delete_user_id )
-
-        if not user_to_del:
-            logger.debug( "User not in database" )
-            return False
-        logger.debug( f"delete_user_id: {delete_user_id}" )
+        logger.debug( "delete_user_id: {}", delete_user_id )
 
         try:
-            with mongo:
-                d_b = mongo.connection.media
-                users_collection = d_b["users"]
-
-                query = { 'user_id': delete_user_id }
-                users_collection.delete_one( query )
+            deleted = self.backend.tombstone_user( delete_user_id )
 
-                #
-                # Remove any statuses associated with this user
-                #
-                UserStatusCollection().delete_status_by_user( delete_user_id )
-
-        except ( PyMongoError ) as db_exception:
+        except ( StorageError ) as db_exception:
             logger.info(f'Error modifying user = {delete_user_id}')
             logger.info(db_exception)
             return False
 
-        else:
-            logger.debug( "User deleted" )
-            return True
+        if not deleted:
+            logger.debug( "User not in database" )
+            return False
+
+        self.state.user_cache.erase( delete_user_id )
+        self.state.user_cache.store_absent( delete_user_id )
+        self.state.status_cache.invalidate_user( delete_user_id )
+        if self.state.trigram_index is not None:
+            self.state.trigram_index.remove_user( delete_user_id )
+        if self.backend.deferred_cascade:
+            reaper_for( self.backend ).wake()
+        logger.debug( "User deleted" )
+        return True
+
+    def _finish_deletes( self, user_ids ):
+        '''
+        Reap now any of user_ids that were deleted and whose statuses
+        are still waiting for the reaper, so that they do not reappear
+        (or get reaped) once the ID is taken again
+        '''
+        if self.backend.deferred_cascade:
+            tombstoned = self.backend.tombstoned_user_ids()
+            for user_id in tombstoned.intersection( user_ids ):
+                reaper_for( self.backend ).finish_user( user_id )
 
     def search_user( self, user_id ):
         '''
         Searches for user data
         '''
         logger.debug( "Entering method" )
-        logger.debug( "Param: user_id: " + user_id )
+        logger.debug( "Param: user_id: {}", user_id )
 
 
         try:
-            with mongo:
-                d_b = mongo.connection.media
-                users_collection = d_b["users"]
-                query = { 'user_id': user_id }
-                user = users_collection.find_one( query )
+            user = self.backend.find_user( user_id )
 
-        except ( PyMongoError ) as db_exception:
+        except ( StorageError ) as db_exception:
             logger.info(f'Error searching for user = {user_id}')
             logger.info(db_exception)
+            return None
 
         else:
             if user:
                 logger.debug( "User ID found" )
-                logger.debug( f"User type: { type( user ) }" )
-                return UsersTable( user["user_id"], user["user_name"],
-                                   user["user_last_name"], user["email"] )
+                logger.debug( "User type: {}", type( user ) )
+                return UsersTable.from_document( user )
             logger.debug( "User ID not in database" )
             return None
 
+    def add_users( self, new_users ):
+        '''
+        Adds a batch of users (dictionaries, see UsersTable.as_dict).
+
+        Requirements:
+        - Returns a dictionary mapping each user_id to True if that
+          user was added, or False if it already existed or could not
+          be written.
+        - IDs that UserCache knows to exist are not sent to the
+          database; the rest go in a single insert_many.
+        '''
+        logger.debug( "Entering method" )
+
+        new_users = list( new_users )
+        results = dict.fromkeys( ( user[ "user_id" ] for user in new_users ), False )
+        known = self.state.user_cache.read_many( results )
+        inserted, duplicates, _ = self.insert_users(
+            [ user for user in new_users if user[ "user_id" ] not in known ] )
+        self.state.user_cache.store_many( duplicates )
+        results.update( dict.fromkeys( inserted, True ) )
+        logger.debug( "{} of {} users added", len( inserted ), len( results ) )
+        return results
+
+    def search_users( self, user_ids ):
+        '''
+        Searches for a batch of users with a single query.
+
+        Requirements:
+        - Returns a dictionary mapping each user_id to its UsersTable,
+          or to None if there is no such user.
+        - If the database fails, returns None.
+        '''
+        logger.debug( "Entering method" )
+
+        results = dict.fromkeys( user_ids )
+        try:
+            found = self.backend.find_users( results )
+
+        except ( StorageError ) as db_exception:
+            logger.info( 'Error searching for a batch of users' )
+            logger.info(db_exception)
+            return None
+
+        for user in found:
+            results[ user[ "user_id" ] ] = UsersTable.from_document( user )
+        self.state.user_cache.store_many( [ user[ "user_id" ] for user in found ] )
+        self.state.user_cache.store_absent_many(
+            [ user_id for user_id, user in results.items() if user is None ] )
+        return results
+
+    def delete_users( self, delete_user_ids ):
+        '''
+        Deletes a batch of users, as delete_user does one.
+
+        Requirements:
+        - Returns a dictionary mapping each user_id to True if that
+          user was deleted, or False if there was no such user.
+        - If the database fails, returns None.
+        '''
+        logger.debug( "Entering method" )
+
+        results = dict.fromkeys( delete_user_ids, False )
+        try:
+            deleted = self.backend.tombstone_users( results )
+
+        except ( StorageError ) as db_exception:
+            logger.info( 'Error deleting a batch of users' )
+            logger.info(db_exception)
+            return None
+
+        results.update( dict.fromkeys( deleted, True ) )
+        self.state.user_cache.erase_many( results )
+        self.state.user_cache.store_absent_many( results )
+        self.state.status_cache.invalidate_users( deleted )
+        if self.state.trigram_index is not None:
+            for user_id in deleted:
+                self.state.trigram_index.remove_user( user_id )
+        if deleted and self.backend.deferred_cascade:
+            reaper_for( self.backend ).wake()
+        logger.debug( "{} of {} users deleted", len( deleted ), len( results ) )
+        return results
+
+    def iter_users( self, batch_size=DEFAULT_EXPORT_BATCH_SIZE, key_range=None ):
+        '''
+        Yields every user as a dictionary (see UsersTable.as_dict),
+        fetching batch_size at a time, or only those in key_range
+        (see key_ranges).
+
+        Raises StorageError if the database cannot be read.
+        '''
+        logger.debug( "Entering method" )
+        return self.backend.iter_users( batch_size, key_range )
+
+    def key_ranges( self, parts ):
+        '''
+        Split the users into at most parts ranges that iter_users can
+        read independently
+        '''
+        logger.debug( "Entering method" )
+        return self.backend.key_ranges( "users", parts )
+
+
+@metrics.instrument()
 class UserStatusCollection():
     '''
     Class to organize methods that operate on statuses.
     '''
 
-    def __init__(self):
+    def __init__(self, backend=None):
         logger.debug( "Initialize UserStatusCollection" )
+        self.backend = backend if backend is not None else get_default_backend()
+        self.state = backend_state( self.backend )
+
+    @property
+    def trigram_index( self ):
+        '''
+        The optional in-process substring index of this collection's
+        backend, shared by every collection on it and kept up to date
+        by the methods below; None when off
+        '''
+        return self.state.trigram_index
+
+    def enable_trigram_index( self, index ):
+        '''
+        Start maintaining index (a TrigramIndex) on every write to
+        this collection's backend and allow FILTER_TRIGRAM searches.
+        Passing None turns it off.
+        '''
+        self.state.trigram_index = index
+
+    def build_trigram_index( self, batch_size=DEFAULT_WARM_BATCH_SIZE ):
+        '''
+        Returns a new TrigramIndex of every status in the database,
+        or None if the database could not be read.
+        '''
+        logger.debug( "Entering method" )
+
+        index = TrigramIndex()
+        try:
+            for status in self.backend.iter_statuses( batch_size ):
+                index.add( status[ "status_id" ], status[ "user_id" ],
+                           status[ "status_text" ] )
+
+        except ( StorageError ) as db_exception:
+            logger.error( 'Error building trigram index' )
+            logger.error(db_exception)
+            return None
+
+        else:
+            logger.info( f"Trigram index built for {len( index )} statuses" )
+            return index
+
+    def trigram_index_current( self, index ):
+        '''
+        Whether index (a TrigramIndex, such as one loaded from a file)
+        holds as many statuses as the database, up to the same
+        greatest status_id. Changes that keep both the same, such as
+        a status edited by another process, go unnoticed.
+        '''
+        logger.debug( "Entering method" )
+        try:
+            current = tuple( self.backend.status_fingerprint() )
+
+        except ( StorageError ) as db_exception:
+            logger.error( 'Error checking trigram index' )
+            logger.error(db_exception)
+            return False
+
+        return index.fingerprint() == current
+
+    def iter_statuses( self, batch_size=DEFAULT_EXPORT_BATCH_SIZE, key_range=None,
+                       fields=None, raw=False ):
+        '''
+        Yields every status as a dictionary (see StatusTable.as_dict),
+        fetching batch_size at a time, or only those in key_range
+        (see key_ranges).
+
+        With fields, only those fields are read; with raw, statuses
+        may come as read-only mappings that are decoded on first
+        lookup (see StorageBackend.match_statuses).
+
+        Raises StorageError if the database cannot be read.
+        '''
+        logger.debug( "Entering method" )
+        return self.backend.iter_statuses( batch_size, key_range,
+                                           fields=fields, raw=raw )
+
+    def key_ranges( self, parts ):
+        '''
+        Split the statuses into at most parts ranges that
+        iter_statuses can read independently
+        '''
+        logger.debug( "Entering method" )
+        return self.backend.key_ranges( "status", parts )
 
     def add_status( self, new_status_user_id, new_status_id, new_status_text ):
         '''
         add a new status message to the collection
         '''
         logger.debug( "Entering method" )
-        logger.debug( "Param: new_status_id: " + new_status_id )
+        logger.debug( "Param: new_status_id: {}", new_status_id )
 
         #
         # Before we add the status, need to verify that
@@ -323,73 +1232,189 @@ class UserStatusCollection():
         # (Normally handled by SQL constraints, but under
         # MongoDB need to do it ourselves.)
         #
-        if UserCache().read( new_status_user_id ):
-            logger.debug( f"Verified that {new_status_user_id} has an account" )
+        if confirm_users( [ new_status_user_id ], self.backend ):
+            logger.debug( "Verified that {} has an account", new_status_user_id )
         else:
-            logger.debug( f"No account found for {new_status_user_id}" )
+            logger.debug( "No account found for {}", new_status_user_id )
             return False
 
-        if self.search_status( new_status_id ):
+        #
+        # With the unique index on status_id in place, the server
+        # rejects duplicates for us; without it, look first.
+        #
+        if not self.backend.unique_keys_enforced and \
+                self.search_status( new_status_id ):
             logger.debug( "Status already in database" )
             return False
 
         try:
-            with mongo:
-                d_b = mongo.connection.media
-                status_collection = d_b["status"]
-                new_status = StatusTable.as_dict(
-                    status_id = new_status_id,
-                    user_id = new_status_user_id,
-                    status_text = new_status_text,
-                )
-                status_collection.insert_one( new_status )
-
-        except ( PyMongoError ) as db_exception:
+            new_status = StatusTable.as_dict(
+                status_id = new_status_id,
+                user_id = new_status_user_id,
+                status_text = new_status_text,
+            )
+            self.backend.insert_status( new_status )
+
+        except ( DuplicateKey ):
+            logger.debug( "Status already in database" )
+            return False
+
+        except ( StorageError ) as db_exception:
             logger.info(f'Error creating status = {new_status_id}')
             logger.info(db_exception)
             return False
 
         else:
+            self.state.status_cache.invalidate( new_status_id )
+            if self.trigram_index is not None:
+                self.trigram_index.add( new_status_id, new_status_user_id,
+                                        new_status_text )
             logger.debug( "Status added" )
             return True
 
-    def modify_status( self, mod_status_id, user_id, mod_status_text ):
+    def existing_status_ids( self, status_ids ):
         '''
-        Modifies an existing status
+        Returns the subset of status_ids that are already in the
+        database, using a single query.
         '''
-        # pylint:disable=unused-argument
         logger.debug( "Entering method" )
-        logger.debug( "Param: mod_status_id: " + mod_status_id )
-        logger.debug( "Param: mod_status_text: " + mod_status_text )
 
-        status_to_mod = self.search_status( mod_status_id )
+        try:
+            found = self.backend.existing_status_ids( status_ids )
 
-        if status_to_mod is None:
-            logger.debug( "Status not in database" )
-            return False
+        except ( StorageError ) as db_exception:
+            logger.info( 'Error looking up existing status IDs' )
+            logger.info(db_exception)
+            return None
+
+        else:
+            return found
+
+    async def existing_status_ids_async( self, status_ids, writes ):
+        '''
+        Coroutine version of existing_status_ids, reading through
+        writes (see StorageBackend.async_writes)
+        '''
+        logger.debug( "Entering method" )
+
+        try:
+            found = await writes.existing_status_ids( status_ids )
+
+        except ( StorageError ) as db_exception:
+            logger.info( 'Error looking up existing status IDs' )
+            logger.info(db_exception)
+            return None
+
+        else:
+            return found
+
+    def insert_statuses( self, new_statuses ):
+        '''
+        Writes a batch of status dictionaries (see StatusTable.as_dict)
+        with a single unordered bulk write.
+
+        The caller is responsible for checking that the owning users
+        exist. Returns three lists of status IDs: inserted, already
+        present and failed.
+        '''
+        logger.debug( "Entering method" )
+
+        if not new_statuses:
+            return [], [], []
+
+        try:
+            written, duplicates, failed = \
+                self.backend.insert_statuses( new_statuses )
+
+        except ( StorageError ) as db_exception:
+            logger.info( 'Error inserting batch of statuses' )
+            logger.info(db_exception)
+            return [], [], [ status[ "status_id" ] for status in new_statuses ]
+
+        return self._statuses_inserted( new_statuses, written, duplicates, failed )
+
+    async def insert_statuses_async( self, new_statuses, writes ):
+        '''
+        Coroutine version of insert_statuses, writing through writes
+        (see StorageBackend.async_writes)
+        '''
+        logger.debug( "Entering method" )
+
+        if not new_statuses:
+            return [], [], []
 
         try:
-            with mongo:
-                d_b = mongo.connection.media
-                status_collection = d_b["status"]
+            written, duplicates, failed = \
+                await writes.insert_statuses( new_statuses )
+
+        except ( StorageError ) as db_exception:
+            logger.info( 'Error inserting batch of statuses' )
+            logger.info(db_exception)
+            return [], [], [ status[ "status_id" ] for status in new_statuses ]
 
-                query_json  = { 'status_id': mod_status_id }
-                update_json = { '$set': { 'status_text': mod_status_text } }
+        return self._statuses_inserted( new_statuses, written, duplicates, failed )
+
+    def _statuses_inserted( self, new_statuses, written, duplicates, failed ):
+        '''
+        Update the caches for a bulk write, and turn its indexes
+        into the lists of status IDs that insert_statuses returns
+        '''
+        if failed:
+            logger.info( f'Error inserting {len( failed )} statuses' )
+        self.state.status_cache.invalidate_many(
+            new_statuses[ i ][ "status_id" ] for i in written )
+        self._index_statuses( new_statuses[ i ] for i in written )
+        logger.debug( "{} statuses added", len( written ) )
+        return (
+            [ new_statuses[ i ][ "status_id" ] for i in written ],
+            [ new_statuses[ i ][ "status_id" ] for i in duplicates ],
+            [ new_statuses[ i ][ "status_id" ] for i in failed ],
+        )
+
+    def _index_statuses( self, statuses ):
+        '''
+        Add status dictionaries to the trigram index, if there is one
+        '''
+        if self.trigram_index is not None:
+            for status in statuses:
+                self.trigram_index.add( status[ "status_id" ], status[ "user_id" ],
+                                        status[ "status_text" ] )
+
+    def modify_status( self, mod_status_id, user_id, mod_status_text ):
+        '''
+        Modifies an existing status, with a single conditional update.
+
+        Requirements:
+        - Returns False if the status is not in the database or there
+          is an error.
+        - Otherwise, it returns True.
+        '''
+        # pylint:disable=unused-argument
+        logger.debug( "Entering method" )
+        logger.debug( "Param: mod_status_id: {}", mod_status_id )
+        logger.debug( "Param: mod_status_text: {}", mod_status_text )
 
-                updated_doc = status_collection.find_one_and_update(
-                        query_json,
-                        update_json,
-                        return_document=ReturnDocument.AFTER
-                )
+        try:
+            matched = self.backend.update_status(
+                mod_status_id,
+                { 'status_text': mod_status_text }
+            )
 
-        except ( PyMongoError ) as db_exception:
+        except ( StorageError ) as db_exception:
             logger.info(f'Error modifying status = {mod_status_id}')
             logger.info(db_exception)
+            return False
 
-        if updated_doc[ "status_text" ] == mod_status_text:
-            logger.debug( "Status updated" )
-            return True
-        return False
+        finally:
+            self.state.status_cache.invalidate( mod_status_id )
+
+        if not matched:
+            logger.debug( "Status not in database" )
+            return False
+        if self.trigram_index is not None:
+            self.trigram_index.update( mod_status_id, mod_status_text )
+        logger.debug( "Status updated" )
+        return True
 
     def delete_status( self, delete_status_id ):
         '''
@@ -408,19 +1433,14 @@ class UserStatusCollection():
             return False
 
         logger.debug(
-            "status_to_del.status_text: ", status_to_del.status_text
+            "status_to_del.status_text: {}", status_to_del.status_text
         )
 
         try:
-            with mongo:
-                d_b = mongo.connection.media
-                status_collection = d_b["status"]
+            deleted_count = self.backend.delete_status( delete_status_id )
+            logger.debug( "{} status deleted", deleted_count )
 
-                query = { 'status_id': delete_status_id }
-                delete_result = status_collection.delete_one( query )
-                logger.debug( f"{ delete_result.deleted_count } status deleted" )
-
-        except ( PyMongoError ) as db_exception:
+        except ( StorageError ) as db_exception:
             logger.info(f'Error deleting status = {delete_status_id}')
             logger.info(db_exception)
             return False
@@ -429,6 +1449,41 @@ class UserStatusCollection():
             logger.debug( "Status deleted" )
             return True
 
+        finally:
+            self.state.status_cache.invalidate( delete_status_id )
+            if self.trigram_index is not None:
+                self.trigram_index.remove( delete_status_id )
+
+    def delete_statuses( self, delete_status_ids ):
+        '''
+        Deletes a batch of statuses with a single delete.
+
+        Requirements:
+        - Returns a dictionary mapping each status_id to True if that
+          status was deleted, or False if there was no such status.
+        - If the database fails, returns None.
+        '''
+        logger.debug( "Entering method" )
+
+        results = dict.fromkeys( delete_status_ids, False )
+        try:
+            deleted = self.backend.delete_statuses( results )
+
+        except ( StorageError ) as db_exception:
+            logger.info( 'Error deleting a batch of statuses' )
+            logger.info(db_exception)
+            return None
+
+        finally:
+            self.state.status_cache.invalidate_many( results )
+
+        results.update( dict.fromkeys( deleted, True ) )
+        if self.trigram_index is not None:
+            for status_id in deleted:
+                self.trigram_index.remove( status_id )
+        logger.debug( "{} of {} statuses deleted", len( deleted ), len( results ) )
+        return results
+
     def delete_status_by_user( self, delete_user_id ):
         '''
         Deletes all statuses for the specified user from status_collection.
@@ -440,62 +1495,107 @@ class UserStatusCollection():
         logger.debug( "Entering function" )
 
         try:
-            with mongo:
-                d_b = mongo.connection.media
-                status_collection = d_b["status"]
-
-                query = { 'user_id': delete_user_id }
-                status_count = status_collection.count_documents( query )
+            status_count = self.backend.delete_statuses_by_user( delete_user_id )
 
-                if status_count:
-                    logger.debug(
-                        f"Deleting { status_count } statuses "
-                      + f"found for { delete_user_id }"
-                    )
-                else:
-                    logger.debug( f"No statuses found for {delete_user_id}" )
-                    return False
-
-                status_collection.delete_many( query )
-
-        except ( PyMongoError ) as db_exception:
+        except ( StorageError ) as db_exception:
             logger.info(f'Error deleting status for {delete_user_id}')
             logger.info(db_exception)
             return False
 
         else:
-            logger.debug( "Status deleted" )
+            if not status_count:
+                logger.debug( "No statuses found for {}", delete_user_id )
+                return False
+            logger.debug(
+                "Deleted {} statuses found for {}",
+                status_count, delete_user_id
+            )
             return True
 
+        finally:
+            self.state.status_cache.invalidate_user( delete_user_id )
+            if self.trigram_index is not None:
+                self.trigram_index.remove_user( delete_user_id )
+
     def search_status( self, status_id ):
         '''
         Searches for status data
         '''
         logger.debug( "Entering method" )
-        logger.debug( "Param: status_id: " + status_id )
+        logger.debug( "Param: status_id: {}", status_id )
+
+        cache = self.state.status_cache.cache
+        if cache is not None:
+            cached_status = cache.get( status_id )
+            if cached_status is BoundedCache.ABSENT:
+                logger.debug( "Status ID not in database (cached)" )
+                return None
+            if cached_status is not None:
+                logger.debug( "Status ID found (cached)" )
+                return cached_status.copy()
 
         try:
-            with mongo:
-                d_b = mongo.connection.media
-                status_collection = d_b["status"]
-                query = { 'status_id': status_id }
-                status = status_collection.find_one( query )
+            status = self.backend.find_status( status_id )
 
-        except ( PyMongoError ) as db_exception:
+        except ( StorageError ) as db_exception:
             logger.info(f'Error searching for status = {status_id}')
             logger.info(db_exception)
+            return None
 
         else:
             if status:
                 logger.debug( "Status ID found" )
-                return StatusTable(
-                        status[ "status_id" ],
-                        status[ "user_id" ],
-                        status[ "status_text" ]
-                )
+                found_status = StatusTable.from_document( status )
+                if cache is not None:
+                    cache.put( status_id, found_status.copy() )
+                return found_status
             logger.debug( "Status ID not in database" )
+            if cache is not None:
+                cache.put( status_id, BoundedCache.ABSENT )
             return None
 
+    def search_statuses( self, status_ids ):
+        '''
+        Searches for a batch of statuses.
+
+        Requirements:
+        - Returns a dictionary mapping each status_id to its
+          StatusTable, or to None if there is no such status.
+        - Statuses held by StatusCache are not read again; the rest
+          are read with a single query.
+        - If the database fails, returns None.
+        '''
+        logger.debug( "Entering method" )
+
+        results = dict.fromkeys( status_ids )
+        cache = self.state.status_cache.cache
+        missing = list( results )
+        if cache is not None:
+            cached = cache.get_many( results )
+            for status_id, cached_status in cached.items():
+                if cached_status is not BoundedCache.ABSENT:
+                    results[ status_id ] = cached_status.copy()
+            missing = [ status_id for status_id in results if status_id not in cached ]
+        if not missing:
+            return results
+
+        try:
+            found = self.backend.find_statuses( missing )
+
+        except ( StorageError ) as db_exception:
+            logger.info( 'Error searching for a batch of statuses' )
+            logger.info(db_exception)
+            return None
+
+        for status in found:
+            results[ status[ "status_id" ] ] = StatusTable.from_document( status )
+        if cache is not None:
+            for status_id in missing:
+                found_status = results[ status_id ]
+                cache.put( status_id, found_status.copy() if found_status
+                           else BoundedCache.ABSENT )
+        return results
+
     def search_all_status_updates( self, user_id ):
         '''
         Returns all the status updates for a specified user.
@@ -506,30 +1606,110 @@ class UserStatusCollection():
         - Otherwise, it returns None.
         '''
         logger.debug( "Entering method" )
-        logger.debug( "Param: user_id: " + user_id )
+        logger.debug( "Param: user_id: {}", user_id )
 
         try:
-            with mongo:
-                d_b = mongo.connection.media
-                status_collection = d_b["status"]
-                query = { 'user_id': user_id }
-                status_list = status_collection.find( query )
+            status_list = [ status[ "status_text" ] for status
+                            in self.backend.find_statuses_by_user(
+                                user_id, fields=( "status_text", ) ) ]
 
-        except ( PyMongoError ) as db_exception:
+        except ( StorageError ) as db_exception:
             logger.info(f'Error searching for statuses for {user_id}')
             logger.info(db_exception)
+            return None
 
         else:
-            if status_list:
-                logger.debug( "Statuses for " + user_id + " found" )
-                # pylint: disable=not-an-iterable
-                return [ status[ "status_text" ] for status in status_list ]
-            logger.debug( "User ID: " + user_id + " not in database" )
+            logger.debug( "Statuses for {} found", user_id )
+            return status_list
+
+    def page_status_updates( self, user_id, page_size=DEFAULT_STATUS_PAGE_SIZE,
+                             resume_token=None, fields=DEFAULT_STATUS_PAGE_FIELDS ):
+        '''
+        Returns one page of a user's status updates, in status_id order.
+
+        Requirements:
+        - Returns ( statuses, resume_token ): up to page_size status
+          dictionaries holding status_id and the given fields, and the
+          token to pass back for the next page (None after the last).
+        - The page is read with a range query on the user's index
+          entries, so later pages cost no more than the first.
+        - If the database fails, returns ( None, None ).
+        '''
+        logger.debug( "Entering method" )
+        logger.debug( "Param: user_id: {}, resume_token: {}", user_id, resume_token )
+
+        try:
+            statuses = self.backend.page_statuses_by_user(
+                user_id, page_size, after=resume_token, fields=fields )
+
+        except ( StorageError ) as db_exception:
+            logger.info(f'Error paging statuses for {user_id}')
+            logger.info(db_exception)
+            return None, None
+
+        else:
+            next_token = statuses[ -1 ][ "status_id" ] \
+                if len( statuses ) == page_size else None
+            return statuses, next_token
+
+    def iter_status_updates( self, user_id, page_size=DEFAULT_STATUS_PAGE_SIZE ):
+        '''
+        Yields a user's status texts, fetching a page at a time only
+        when the previous one has been consumed.
+
+        Stops early if the database fails.
+        '''
+        resume_token = None
+        while True:
+            statuses, resume_token = self.page_status_updates(
+                user_id, page_size, resume_token )
+            if statuses is None:
+                return
+            for status in statuses:
+                yield status[ "status_text" ]
+            if resume_token is None:
+                return
+
+    def count_status_updates( self, user_id ):
+        '''
+        Returns the number of status updates for a user, counted from
+        the index without reading the statuses, or None if the
+        database fails.
+        '''
+        logger.debug( "Entering method" )
+        logger.debug( "Param: user_id: {}", user_id )
+
+        try:
+            return self.backend.count_statuses_by_user( user_id )
+
+        except ( StorageError ) as db_exception:
+            logger.info(f'Error counting statuses for {user_id}')
+            logger.info(db_exception)
             return None
 
-    def filter_status_by_string( self, target_string: str ):
+    def filter_status_by_string( self, target_string: str,
+                                 mode=FILTER_REGEX, limit=0,
+                                 by_relevance=False, fields=None, lazy=False ):
         '''
-        Returns all the status updates for a specified user.
+        Returns all the status updates that match a string.
+
+        mode selects how target_string is matched:
+        - FILTER_REGEX (the default) matches any substring, by
+          scanning every status.
+        - FILTER_TEXT matches whole words (with stemming) through the
+          text index. Put the string in double quotes to match a
+          phrase. With by_relevance, the best matches come first.
+        - FILTER_TRIGRAM matches any literal substring through the
+          in-process trigram index, without a database round trip.
+
+        A non-zero limit caps the number of statuses returned.
+
+        With fields (for example ( "status_id", "status_text" )), only
+        those fields are read from the database. With lazy, statuses
+        are kept as undecoded documents until one of their fields is
+        first read, which saves the work for statuses that the caller
+        never looks at. Either way the statuses come back as
+        StatusView objects rather than StatusTable ones.
 
         Requirements:
         - Returns an iterator to all status updates that contain the
@@ -537,40 +1717,92 @@ class UserStatusCollection():
           updates . . . :-O
         '''
         logger.debug( "Entering method" )
-        logger.debug( "Param: target_string: " + target_string )
+        logger.debug( "Param: target_string: {}", target_string )
+
+        if mode == FILTER_TRIGRAM:
+            if self.trigram_index is None:
+                logger.error( "Trigram index is not enabled" )
+                return None
+            return (
+                StatusTable( status_id, user_id, status_text )
+                for status_id, user_id, status_text
+                in self.trigram_index.search( target_string, limit=limit )
+            )
+
+        if mode not in ( FILTER_REGEX, FILTER_TEXT ):
+            logger.error( f"Unknown filter mode: {mode}" )
+            return None
 
         try:
-            with mongo:
-                d_b = mongo.connection.media
-                status_collection = d_b["status"]
-                #
-                # https://stackoverflow.com/a/10616781/1106930
-                #
-                query = { 'status_text': { '$regex' : target_string } }
-                status_iterator = status_collection.find( query )
-
-        except ( PyMongoError ) as db_exception:
+            status_iterator = self.backend.match_statuses(
+                target_string,
+                mode=mode,
+                limit=limit,
+                by_relevance=by_relevance,
+                fields=fields,
+                raw=lazy
+            )
+
+        except ( StorageError ) as db_exception:
             logger.info(f'Error searching for statuses {target_string}')
             logger.info(db_exception)
+            return None
 
         else:
-            if status_iterator:
-                logger.debug( "Iterator for " + target_string + " retrieved" )
-                status_gen = dict_to_status_gen( status_iterator )
-                return status_gen
-            logger.debug( "Could not retrieve iterator for {target_string}" )
-            return None
+            logger.debug( "Iterator for {} retrieved", target_string )
+            if fields or lazy:
+                return map( StatusView, status_iterator )
+            status_gen = dict_to_status_gen( status_iterator )
+            return status_gen
+
+
+#
+# Storage backend selection
+#
+BACKEND_FACTORIES = {
+    "mongo": MongoBackend,
+    "memory": MemoryBackend,
+    "sqlite": lambda: SQLiteBackend(
+        os.environ.get( "SN_SQLITE_PATH", DEFAULT_SQLITE_PATH ) ),
+}
+
+
+def make_backend( name ):
+    '''
+    Returns a new storage backend of the named kind
+    (see BACKEND_FACTORIES)
+    '''
+    if name not in BACKEND_FACTORIES:
+        raise ValueError( f"Unknown storage backend: {name}" )
+    return BACKEND_FACTORIES[ name ]()
+
+
+def get_default_backend():
+    '''
+    Returns the backend used by collections created without one
+    '''
+    return default_backend
+
+
+def set_default_backend( backend ):
+    '''
+    Make backend the one used by collections created without one.
+    Its caches and trigram index are its own (see backend_state), so
+    those of the previous default are left as they are.
+    '''
+    global default_backend  # pylint:disable=global-statement,invalid-name
+    logger.debug( "Switching storage backend to {}", backend.name )
+    default_backend = backend
 
 
 #
 # Set up database
 #
-logger.debug( "Initialize context manager for MongoDB" )
+logger.debug( "Initialize storage backend" )
 
-mongo = MongoDBConnection()
+default_backend = make_backend( os.environ.get( "SN_BACKEND", "mongo" ) )
 
 logger.debug( "Complete database setup" )
 
 
 # --- END --- #
-
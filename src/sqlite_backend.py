@@ -0,0 +1,628 @@
+'''
+Embedded SQLite storage engine for the social network
+
+Runs the whole application against a single database file, with no
+database server. The file is opened in WAL mode so that readers do
+not block the writer, statuses reference their user through a foreign
+key with ON DELETE CASCADE, and bulk loads are written with
+executemany inside one transaction.
+'''
+
+import functools
+import os
+import re
+import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+
+from loguru import logger
+
+from storage_backends import (
+    FILTER_REGEX,
+    FILTER_TEXT,
+    WORD_PATTERN,
+    DuplicateKey,
+    StorageBackend,
+    StorageError,
+)
+
+#
+# Database file used when SN_SQLITE_PATH is not set
+#
+DEFAULT_SQLITE_PATH = "socialnetwork.db"
+
+#
+# SQLite limits the number of bound parameters per statement, so
+# IN ( ... ) lookups are split into chunks of this many IDs
+#
+IN_CHUNK_SIZE = 500
+
+#
+# Number of prepared statements each connection keeps compiled
+#
+STATEMENT_CACHE_SIZE = 128
+
+USER_COLUMNS = ( "user_id", "email", "user_name", "user_last_name" )
+STATUS_COLUMNS = ( "status_id", "user_id", "status_text" )
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA busy_timeout = 5000",
+)
+
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS users (
+           user_id        TEXT PRIMARY KEY,
+           email          TEXT,
+           user_name      TEXT,
+           user_last_name TEXT
+       )''',
+    '''CREATE TABLE IF NOT EXISTS status (
+           status_id   TEXT PRIMARY KEY,
+           user_id     TEXT NOT NULL
+                       REFERENCES users ( user_id ) ON DELETE CASCADE,
+           status_text TEXT
+       )''',
+    #
+    # A user's statuses in status_id order, for paging through them
+    #
+    '''CREATE INDEX IF NOT EXISTS status_user_id ON status ( user_id, status_id )''',
+    #
+    # Full-text index for FILTER_TEXT, kept in step with the status
+    # table by triggers (an "external content" FTS5 table)
+    #
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS status_text_search USING fts5 (
+           status_text, content='status', tokenize='porter unicode61'
+       )''',
+    '''CREATE TRIGGER IF NOT EXISTS status_text_insert AFTER INSERT ON status
+       BEGIN
+           INSERT INTO status_text_search ( rowid, status_text )
+           VALUES ( new.rowid, new.status_text );
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS status_text_delete AFTER DELETE ON status
+       BEGIN
+           INSERT INTO status_text_search ( status_text_search, rowid, status_text )
+           VALUES ( 'delete', old.rowid, old.status_text );
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS status_text_update AFTER UPDATE ON status
+       BEGIN
+           INSERT INTO status_text_search ( status_text_search, rowid, status_text )
+           VALUES ( 'delete', old.rowid, old.status_text );
+           INSERT INTO status_text_search ( rowid, status_text )
+           VALUES ( new.rowid, new.status_text );
+       END''',
+)
+
+#
+# Indexes whose definition has changed, dropped so that SCHEMA builds
+# them again: SQL that finds an old definition -> SQL that drops it
+#
+STALE_INDEXES = {
+    "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'status_user_id' "
+    "AND NOT EXISTS ( SELECT 1 FROM pragma_index_info( 'status_user_id' ) "
+    "WHERE name = 'status_id' )":
+        "DROP INDEX status_user_id",
+}
+
+#
+# Indexes reported by verify_indexes(): name -> SQL that finds it
+#
+EXPECTED_SQLITE_INDEXES = {
+    "users.user_id_unique":
+        "SELECT 1 FROM pragma_index_list( 'users' ) WHERE origin = 'pk'",
+    "status.status_id_unique":
+        "SELECT 1 FROM pragma_index_list( 'status' ) WHERE origin = 'pk'",
+    "status.status_user_id":
+        "SELECT 1 FROM pragma_index_info( 'status_user_id' ) WHERE name = 'status_id'",
+    "status.status_text_search":
+        "SELECT 1 FROM sqlite_master "
+        "WHERE type = 'table' AND name = 'status_text_search'",
+}
+
+INSERT_USER = "INSERT INTO users ( user_id, email, user_name, user_last_name ) " \
+              "VALUES ( :user_id, :email, :user_name, :user_last_name )"
+INSERT_STATUS = "INSERT INTO status ( status_id, user_id, status_text ) " \
+                "VALUES ( :status_id, :user_id, :status_text )"
+SELECT_USER = "SELECT user_id, email, user_name, user_last_name " \
+              "FROM users WHERE user_id = ?"
+SELECT_STATUS = "SELECT status_id, user_id, status_text FROM status WHERE status_id = ?"
+SELECT_USER_IDS = "SELECT user_id FROM users"
+SELECT_USERS = "SELECT user_id, email, user_name, user_last_name FROM users"
+SELECT_STATUSES = "SELECT {columns} FROM status"
+SELECT_USER_STATUSES = "SELECT {columns} FROM status WHERE user_id = ?"
+PAGE_USER_STATUSES = "SELECT {columns} FROM status WHERE user_id = ?{after} " \
+                     "ORDER BY status_id LIMIT ?"
+COUNT_USER_STATUSES = "SELECT count( * ) FROM status WHERE user_id = ?"
+STATUS_FINGERPRINT = "SELECT count( * ), max( status_id ) FROM status"
+ROWID_RANGE = " WHERE rowid >= ? AND rowid < ?"
+DELETE_USER = "DELETE FROM users WHERE user_id = ?"
+DELETE_STATUS = "DELETE FROM status WHERE status_id = ?"
+DELETE_USER_STATUSES = "DELETE FROM status WHERE user_id = ?"
+MATCH_REGEX = "SELECT {columns} FROM status WHERE status_text REGEXP ?"
+MATCH_TEXT = "SELECT {columns} FROM status_text_search JOIN status " \
+             "ON status.rowid = status_text_search.rowid " \
+             "WHERE status_text_search MATCH ?"
+MATCH_TEXT_BY_RELEVANCE = MATCH_TEXT + " ORDER BY bm25( status_text_search )"
+
+
+#
+# Every SQLiteBackend, so that they can be reset in a forked child
+#
+open_backends = weakref.WeakSet()
+
+
+def reset_after_fork():
+    '''
+    Give each backend fresh connections in a forked child
+    '''
+    for backend in list( open_backends ):
+        backend._after_fork()  # pylint:disable=protected-access
+
+
+if hasattr( os, "register_at_fork" ):
+    os.register_at_fork( after_in_child=reset_after_fork )
+
+
+@functools.lru_cache( maxsize=64 )
+def compile_pattern( pattern ):
+    '''
+    Compiled regular expression for the REGEXP operator
+    '''
+    return re.compile( pattern )
+
+
+def regexp( pattern, text ):
+    '''
+    Implements "text REGEXP pattern", which SQLite leaves undefined
+    '''
+    return text is not None and compile_pattern( pattern ).search( text ) is not None
+
+
+def fts_query( target_string ):
+    '''
+    Translate a MongoDB $text search string into an FTS5 query.
+
+    As with $text, the words match if any of them is present, and
+    phrases in double quotes must all be present.
+    '''
+    phrases = re.findall( r'"([^"]*)"', target_string )
+    words = WORD_PATTERN.findall( re.sub( r'"[^"]*"', " ", target_string ) )
+    clauses = [ '"' + " ".join( WORD_PATTERN.findall( phrase ) ) + '"'
+                for phrase in phrases if WORD_PATTERN.search( phrase ) ]
+    if words:
+        clauses.append( "( " + " OR ".join( f'"{word}"' for word in words ) + " )" )
+    return " AND ".join( clauses )
+
+
+def chunked( values, size=IN_CHUNK_SIZE ):
+    '''
+    Yields lists of at most size values
+    '''
+    values = list( values )
+    for start in range( 0, len( values ), size ):
+        yield values[ start:start + size ]
+
+
+def status_columns( fields=None, table=None ):
+    '''
+    The column list for selecting fields (every status column if
+    None) from the status table, qualified with table if given.
+    Raises StorageError for a field that is not a status column.
+    '''
+    columns = tuple( dict.fromkeys( fields or STATUS_COLUMNS ) )
+    unknown = set( columns ) - set( STATUS_COLUMNS )
+    if unknown:
+        raise StorageError( f"Unknown status columns: {sorted( unknown )}" )
+    if table:
+        columns = tuple( f"{table}.{column}" for column in columns )
+    return ", ".join( columns )
+
+
+@contextmanager
+def sqlite_errors():
+    '''
+    Re-raise sqlite3 exceptions as StorageError
+    '''
+    try:
+        yield
+    except sqlite3.Error as db_exception:
+        raise StorageError( str( db_exception ) ) from db_exception
+
+
+class SQLiteBackend( StorageBackend ):
+    '''
+    Stores users and statuses in the "users" and "status" tables of
+    a SQLite database file.
+
+    Each thread gets its own connection, so that the user cache can
+    warm up in the background while requests are served. All SQL is
+    held in module constants with bound parameters, so every
+    statement is compiled once per connection and then reused from
+    its statement cache.
+
+    A path of ":memory:" gives a private in-memory database. It has
+    only the one connection, which every thread shares.
+    '''
+    name = "sqlite"
+
+    def __init__( self, path=DEFAULT_SQLITE_PATH ):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._inherited = []
+        #
+        # Opened here so that the schema exists before any thread
+        # uses it (and, for an in-memory database, to hold it).
+        #
+        self._anchor = self._connect()
+        self._create_schema( self._anchor )
+        open_backends.add( self )
+        logger.debug( "SQLite database ready: {}", self.path )
+
+    @property
+    def shared_between_processes( self ):
+        # A file is; an in-memory database is private to its process
+        return self.path != ":memory:"
+
+    def _after_fork( self ):
+        #
+        # SQLite connections must not be used, or even closed, in a
+        # child process; keep the inherited ones out of the way and
+        # open fresh ones on demand.
+        #
+        self._inherited.append( ( self._anchor, self._local ) )
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        if self.shared_between_processes:
+            self._anchor = self._connect()
+
+    def _connect( self ):
+        with sqlite_errors():
+            connection = sqlite3.connect(
+                self.path,
+                isolation_level=None,
+                check_same_thread=False,
+                cached_statements=STATEMENT_CACHE_SIZE
+            )
+            for pragma in PRAGMAS:
+                connection.execute( pragma )
+            connection.create_function( "REGEXP", 2, regexp, deterministic=True )
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    @property
+    def connection( self ):
+        '''
+        This thread's connection to the database
+        '''
+        if self.path == ":memory:":
+            return self._anchor
+        connection = getattr( self._local, "connection", None )
+        if connection is None:
+            connection = self._connect()
+            self._local.connection = connection
+        return connection
+
+    def close( self ):
+        '''
+        Close this thread's connection and the backend's own one
+        '''
+        connection = getattr( self._local, "connection", None )
+        if connection is not None and connection is not self._anchor:
+            connection.close()
+            self._local.connection = None
+        self._anchor.close()
+
+    @contextmanager
+    def _transaction( self ):
+        '''
+        Run the block in one write transaction, rolled back if it
+        raises
+        '''
+        connection = self.connection
+        with self._write_lock, sqlite_errors():
+            connection.execute( "BEGIN IMMEDIATE" )
+            try:
+                yield connection
+            except BaseException:
+                connection.execute( "ROLLBACK" )
+                raise
+            connection.execute( "COMMIT" )
+
+    @staticmethod
+    def _create_schema( connection ):
+        with sqlite_errors():
+            for stale, drop in STALE_INDEXES.items():
+                if connection.execute( stale ).fetchone():
+                    logger.info( f"Rebuilding index: {drop}" )
+                    connection.execute( drop )
+            for statement in SCHEMA:
+                connection.execute( statement )
+
+    def ensure_indexes( self ):
+        self._create_schema( self.connection )
+
+    def verify_indexes( self ):
+        report = { 'present': [], 'missing': [], 'unused': [] }
+        with sqlite_errors():
+            for index_name, query in EXPECTED_SQLITE_INDEXES.items():
+                if self.connection.execute( query ).fetchone():
+                    report[ 'present' ].append( index_name )
+                else:
+                    report[ 'missing' ].append( index_name )
+        return report
+
+    def _insert_one( self, statement, row ):
+        try:
+            with self._transaction() as connection:
+                connection.execute( statement, row )
+        except StorageError as db_exception:
+            if isinstance( db_exception.__cause__, sqlite3.IntegrityError ) and \
+                    "UNIQUE" in str( db_exception ):
+                raise DuplicateKey( str( db_exception ) ) from db_exception.__cause__
+            raise
+
+    def _insert_many( self, statement, table, key, rows ):
+        '''
+        Writes rows with one executemany in one transaction.
+
+        IDs that already exist (or repeat within rows) are reported as
+        duplicates rather than written. If the batch still fails (for
+        instance, a status whose user does not exist), the rows are
+        retried one at a time within the same transaction so that the
+        good ones are kept.
+        '''
+        written, duplicates, failed = [], [], []
+        with self._transaction() as connection:
+            existing = set()
+            for ids in chunked( row[ key ] for row in rows ):
+                placeholders = ", ".join( "?" * len( ids ) )
+                existing.update(
+                    found[ 0 ] for found in connection.execute(
+                        f"SELECT {key} FROM {table} WHERE {key} IN ( {placeholders} )",
+                        ids ) )
+            for position, row in enumerate( rows ):
+                if row[ key ] in existing:
+                    duplicates.append( position )
+                else:
+                    existing.add( row[ key ] )
+                    written.append( position )
+
+            connection.execute( "SAVEPOINT bulk_insert" )
+            try:
+                connection.executemany( statement, ( rows[ i ] for i in written ) )
+            except sqlite3.IntegrityError:
+                connection.execute( "ROLLBACK TO bulk_insert" )
+                kept = []
+                for position in written:
+                    try:
+                        connection.execute( statement, rows[ position ] )
+                    except sqlite3.IntegrityError:
+                        failed.append( position )
+                    else:
+                        kept.append( position )
+                written = kept
+            connection.execute( "RELEASE bulk_insert" )
+        return written, duplicates, failed
+
+    def _existing_ids( self, table, key, ids ):
+        found = set()
+        with sqlite_errors():
+            for chunk in chunked( ids ):
+                placeholders = ", ".join( "?" * len( chunk ) )
+                found.update(
+                    row[ 0 ] for row in self.connection.execute(
+                        f"SELECT {key} FROM {table} WHERE {key} IN ( {placeholders} )",
+                        chunk ) )
+        return found
+
+    def _find_many( self, table, key, columns, ids ):
+        found = []
+        with sqlite_errors():
+            for chunk in chunked( set( ids ) ):
+                placeholders = ", ".join( "?" * len( chunk ) )
+                found.extend( dict( row ) for row in self.connection.execute(
+                    f"SELECT {', '.join( columns )} FROM {table} "
+                    f"WHERE {key} IN ( {placeholders} )", chunk ) )
+        return found
+
+    def _delete_many( self, table, key, ids ):
+        deleted = set()
+        with self._transaction() as connection:
+            for chunk in chunked( set( ids ) ):
+                placeholders = ", ".join( "?" * len( chunk ) )
+                deleted.update( row[ 0 ] for row in connection.execute(
+                    f"DELETE FROM {table} WHERE {key} IN ( {placeholders} ) "
+                    f"RETURNING {key}", chunk ) )
+        return deleted
+
+    def _find_one( self, statement, value ):
+        with sqlite_errors():
+            row = self.connection.execute( statement, ( value, ) ).fetchone()
+        return dict( row ) if row is not None else None
+
+    def _update( self, table, key, columns, value, fields ):
+        unknown = set( fields ) - set( columns )
+        if unknown:
+            raise StorageError( f"Unknown {table} columns: {sorted( unknown )}" )
+        assignments = ", ".join( f"{column} = :{column}"
+                                 for column in sorted( fields ) )
+        with self._transaction() as connection:
+            return connection.execute(
+                f"UPDATE {table} SET {assignments} WHERE {key} = :_key",
+                { **fields, '_key': value } ).rowcount
+
+    def _delete( self, statement, value ):
+        with self._transaction() as connection:
+            return connection.execute( statement, ( value, ) ).rowcount
+
+    def _iter_rows( self, statement, parameters=(), batch_size=None ):
+        with sqlite_errors():
+            cursor = self.connection.execute( statement, parameters )
+            if batch_size:
+                cursor.arraysize = batch_size
+            while True:
+                rows = cursor.fetchmany()
+                if not rows:
+                    return
+                for row in rows:
+                    yield dict( row )
+
+    def insert_user( self, user ):
+        self._insert_one( INSERT_USER, user )
+
+    def insert_users( self, users ):
+        return self._insert_many( INSERT_USER, "users", "user_id", users )
+
+    def find_user( self, user_id ):
+        return self._find_one( SELECT_USER, user_id )
+
+    def existing_user_ids( self, user_ids ):
+        return self._existing_ids( "users", "user_id", user_ids )
+
+    def iter_user_ids( self, batch_size ):
+        for user in self._iter_rows( SELECT_USER_IDS, batch_size=batch_size ):
+            yield user[ "user_id" ]
+
+    def iter_users( self, batch_size, key_range=None ):
+        if key_range is None:
+            return self._iter_rows( SELECT_USERS, batch_size=batch_size )
+        return self._iter_rows( SELECT_USERS + ROWID_RANGE, key_range,
+                                batch_size=batch_size )
+
+    def key_ranges( self, collection_name, parts ):
+        #
+        # Ranges of rowids; rows are rarely deleted, so rowids are
+        # dense enough that equal spans hold similar numbers of rows
+        #
+        table = "users" if collection_name == "users" else "status"
+        with sqlite_errors():
+            lowest, highest = self.connection.execute(
+                f"SELECT min( rowid ), max( rowid ) FROM {table}" ).fetchone()
+        if lowest is None:
+            return [ ( None, None ) ]
+        span = highest + 1 - lowest
+        edges = sorted( { lowest + part * span // parts
+                          for part in range( parts + 1 ) } )
+        return list( zip( edges, edges[ 1: ] ) )
+
+    def update_user( self, user_id, fields ):
+        return self._update( "users", "user_id", USER_COLUMNS, user_id, fields )
+
+    def delete_user( self, user_id ):
+        #
+        # The foreign key removes the user's statuses as well
+        #
+        return self._delete( DELETE_USER, user_id )
+
+    def find_users( self, user_ids ):
+        return self._find_many( "users", "user_id", USER_COLUMNS, user_ids )
+
+    def tombstone_users( self, user_ids ):
+        # As tombstone_user: the statuses go in the same transaction
+        return self._delete_many( "users", "user_id", user_ids )
+
+    def tombstone_user( self, user_id ):
+        #
+        # The foreign key's ON DELETE CASCADE removes the statuses in
+        # the same local transaction, so nothing is left to reap
+        #
+        return self.delete_user( user_id )
+
+    def tombstoned_user_ids( self ):
+        return frozenset()
+
+    def reap_statuses( self, user_id, batch_size ):
+        # No user is ever tombstoned
+        return 0
+
+    def remove_tombstone( self, user_id ):
+        # tombstone_user leaves no tombstone
+        pass
+
+    def insert_status( self, status ):
+        self._insert_one( INSERT_STATUS, status )
+
+    def insert_statuses( self, statuses ):
+        return self._insert_many( INSERT_STATUS, "status", "status_id", statuses )
+
+    def find_status( self, status_id ):
+        return self._find_one( SELECT_STATUS, status_id )
+
+    def existing_status_ids( self, status_ids ):
+        return self._existing_ids( "status", "status_id", status_ids )
+
+    def update_status( self, status_id, fields ):
+        return self._update( "status", "status_id", STATUS_COLUMNS, status_id, fields )
+
+    def delete_status( self, status_id ):
+        return self._delete( DELETE_STATUS, status_id )
+
+    def delete_statuses_by_user( self, user_id ):
+        return self._delete( DELETE_USER_STATUSES, user_id )
+
+    def find_statuses( self, status_ids ):
+        return self._find_many( "status", "status_id", STATUS_COLUMNS, status_ids )
+
+    def delete_statuses( self, status_ids ):
+        return self._delete_many( "status", "status_id", status_ids )
+
+    def find_statuses_by_user( self, user_id, fields=None, raw=False ):
+        return self._iter_rows(
+            SELECT_USER_STATUSES.format( columns=status_columns( fields ) ),
+            ( user_id, ) )
+
+    def page_statuses_by_user( self, user_id, page_size, after=None, fields=None ):
+        parameters = [ user_id ]
+        if after is not None:
+            parameters.append( after )
+        parameters.append( page_size )
+        statement = PAGE_USER_STATUSES.format(
+            columns=status_columns(
+                ( "status_id", ) + tuple( fields or STATUS_COLUMNS ) ),
+            after=" AND status_id > ?" if after is not None else "" )
+        with sqlite_errors():
+            return [ dict( row ) for row in
+                     self.connection.execute( statement, parameters ).fetchall() ]
+
+    def count_statuses_by_user( self, user_id ):
+        with sqlite_errors():
+            return self.connection.execute(
+                COUNT_USER_STATUSES, ( user_id, ) ).fetchone()[ 0 ]
+
+    def status_fingerprint( self ):
+        with sqlite_errors():
+            return tuple( self.connection.execute( STATUS_FINGERPRINT ).fetchone() )
+
+    def iter_statuses( self, batch_size, key_range=None, fields=None, raw=False ):
+        statement = SELECT_STATUSES.format( columns=status_columns( fields ) )
+        if key_range is None:
+            return self._iter_rows( statement, batch_size=batch_size )
+        return self._iter_rows( statement + ROWID_RANGE, key_range,
+                                batch_size=batch_size )
+
+    def match_statuses( self, target_string, mode=FILTER_REGEX, limit=0,
+                        by_relevance=False, fields=None, raw=False ):
+        columns = status_columns( fields, table="status" )
+        if mode == FILTER_TEXT:
+            query = fts_query( target_string )
+            if not query:
+                return iter( [] )
+            statement = MATCH_TEXT_BY_RELEVANCE if by_relevance else MATCH_TEXT
+        else:
+            try:
+                compile_pattern( target_string )
+            except re.error as regex_error:
+                raise StorageError( str( regex_error ) ) from regex_error
+            query = target_string
+            statement = MATCH_REGEX
+        statement = statement.format( columns=columns )
+        if limit:
+            statement += f" LIMIT {int( limit )}"
+        return self._iter_rows( statement, ( query, ) )
+
+
+# --- END --- #
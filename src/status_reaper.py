@@ -0,0 +1,250 @@
+'''
+Background deletion of the statuses of deleted users
+
+UserCollection.delete_user only tombstones a user: the user is removed
+and its statuses are hidden from reads at once, but the statuses
+themselves stay until a StatusReaper deletes them, a bounded batch at
+a time and no faster than max_rate statuses a second. Deleting a
+prolific user therefore returns straight away, and the clean-up does
+not crowd out other work on the database.
+
+The reaper thread runs only while there is something to reap: it is
+started by wake(), works through every tombstoned user (including
+ones left by other processes) and stops when none are left. A user
+is reaped by one thread at a time, so finish_user waits for the
+thread if it is at work on the same user, and backends delete
+statuses only while their user is still tombstoned.
+'''
+
+import contextlib
+import threading
+import time
+import weakref
+
+from loguru import logger
+
+from storage_backends import StorageError
+
+#
+# Statuses deleted per round trip
+#
+DEFAULT_BATCH_SIZE = 1000
+
+#
+# Statuses deleted per second at most; 0 for no limit
+#
+DEFAULT_MAX_RATE = 10000
+
+#
+# The reaper of each backend (see reaper_for)
+#
+reapers = weakref.WeakKeyDictionary()
+reapers_lock = threading.Lock()
+
+
+class StatusReaper():
+    '''
+    Deletes the statuses of backend's tombstoned users on a thread of
+    its own, then removes their tombstones
+    '''
+    def __init__( self, backend, batch_size=DEFAULT_BATCH_SIZE,
+                  max_rate=DEFAULT_MAX_RATE ):
+        #
+        # Weak, so that the reaper in reapers does not keep its own
+        # key alive
+        #
+        self._backend = weakref.ref( backend )
+        self.batch_size = batch_size
+        self.max_rate = max_rate
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        #
+        # [ lock, threads holding or waiting for it ] by user ID, while
+        # any thread is reaping that user
+        #
+        self._user_locks = {}
+        self.current_user = None
+        self.statuses_deleted = 0
+        self.users_reaped = 0
+        self.batches = 0
+        self.errors = 0
+        self.last_error = None
+
+    @property
+    def backend( self ):
+        '''
+        The backend being reaped
+        '''
+        return self._backend()
+
+    def wake( self ):
+        '''
+        Make sure the reaper thread is running and looks for
+        tombstones again
+        '''
+        with self._lock:
+            self._stop.clear()
+            self._wake.set()
+            if self._thread is None or not self._thread.is_alive():
+                #
+                # Also the case in a forked child, which has no copy
+                # of the parent's thread
+                #
+                self._thread = threading.Thread(
+                    target=self._run, name="status-reaper", daemon=True )
+                self._thread.start()
+
+    def stop( self, timeout=None ):
+        '''
+        Ask the reaper thread to stop after its current batch, and
+        wait up to timeout seconds for it. Returns whether it stopped.
+        '''
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join( timeout )
+            return not thread.is_alive()
+        return True
+
+    def _run( self ):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self.run_once()
+            except StorageError as db_exception:
+                #
+                # Tombstones stay, so the next wake() tries again
+                #
+                self.errors += 1
+                self.last_error = str( db_exception )
+                logger.error( f"Status reaper failed: {db_exception}" )
+                break
+            with self._lock:
+                if not self._wake.is_set():
+                    self._thread = None
+                    return
+        with self._lock:
+            self._thread = None
+
+    def run_once( self ):
+        '''
+        Reap every user that is tombstoned now, on the calling thread.
+        Returns the number of statuses deleted.
+        '''
+        backend = self.backend
+        deleted = 0
+        if backend is None:
+            return deleted
+        for user_id in sorted( backend.tombstoned_user_ids() ):
+            if self._stop.is_set():
+                break
+            deleted += self._reap_user( backend, user_id, throttle=True )
+        return deleted
+
+    def finish_user( self, user_id ):
+        '''
+        Reap one user's statuses now, on the calling thread and
+        without rate limiting, after the reaper thread if it is at
+        work on the same user; used before a deleted user ID is added
+        again. Returns the number of statuses deleted.
+        '''
+        return self._reap_user( self.backend, user_id, throttle=False )
+
+    @contextlib.contextmanager
+    def _reaping( self, user_id ):
+        '''
+        Hold user_id's lock, and yield its entry in _user_locks
+        '''
+        with self._lock:
+            entry = self._user_locks.get( user_id )
+            if entry is None:
+                entry = self._user_locks[ user_id ] = [ threading.Lock(), 0 ]
+            entry[ 1 ] += 1
+        try:
+            with entry[ 0 ]:
+                yield entry
+        finally:
+            with self._lock:
+                entry[ 1 ] -= 1
+                if not entry[ 1 ]:
+                    del self._user_locks[ user_id ]
+
+    def _reap_user( self, backend, user_id, throttle ):
+        deleted = 0
+        with self._reaping( user_id ) as entry:
+            self.current_user = user_id
+            try:
+                while True:
+                    start = time.perf_counter()
+                    batch = backend.reap_statuses( user_id, self.batch_size )
+                    deleted += batch
+                    with self._lock:
+                        self.statuses_deleted += batch
+                        self.batches += 1
+                    if batch < self.batch_size:
+                        backend.remove_tombstone( user_id )
+                        with self._lock:
+                            self.users_reaped += 1
+                        logger.info(
+                            f"Reaped {deleted} statuses of deleted user {user_id}" )
+                        return deleted
+                    #
+                    # No throttling while finish_user waits for this user
+                    #
+                    if throttle and entry[ 1 ] == 1:
+                        if self._stop.is_set():
+                            return deleted
+                        self._throttle( batch, time.perf_counter() - start )
+            finally:
+                self.current_user = None
+
+    def _throttle( self, deleted, seconds ):
+        if self.max_rate:
+            delay = deleted / self.max_rate - seconds
+            if delay > 0:
+                self._stop.wait( delay )
+
+    @property
+    def running( self ):
+        '''
+        Whether the reaper thread is at work
+        '''
+        thread = self._thread
+        return thread is not None and thread.is_alive()
+
+    def stats( self ):
+        '''
+        Returns the reaper's progress so far, and its backlog: the
+        number of users whose statuses are still to be reaped
+        '''
+        try:
+            backlog = len( self.backend.tombstoned_user_ids() )
+        except ( AttributeError, StorageError ):
+            backlog = None
+        return {
+            'running': self.running,
+            'backlog_users': backlog,
+            'current_user': self.current_user,
+            'statuses_deleted': self.statuses_deleted,
+            'users_reaped': self.users_reaped,
+            'batches': self.batches,
+            'errors': self.errors,
+            'last_error': self.last_error,
+        }
+
+
+def reaper_for( backend ):
+    '''
+    The StatusReaper of backend, made on first use
+    '''
+    with reapers_lock:
+        reaper = reapers.get( backend )
+        if reaper is None:
+            reaper = StatusReaper( backend )
+            reapers[ backend ] = reaper
+        return reaper
+
+
+# --- END --- #
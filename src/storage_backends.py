@@ -0,0 +1,1520 @@
+'''
+Storage engines underneath UserCollection and UserStatusCollection
+
+Every engine implements StorageBackend. The collection classes talk
+only to that interface, so the same application code runs against
+MongoDB (MongoBackend) or entirely in memory (MemoryBackend).
+'''
+
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from itertools import islice
+
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo import (
+    ASCENDING,
+    DESCENDING,
+    TEXT,
+    InsertOne,
+    MongoClient,
+    UpdateOne,
+    monitoring,
+)
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+
+try:
+    from pymongo import AsyncMongoClient
+except ImportError:  # pragma: no cover
+    #
+    # pymongo before 4.9; async writes then run on threads
+    #
+    AsyncMongoClient = None  # pylint:disable=invalid-name
+
+from loguru import logger
+
+import tracing
+
+#
+# Connection pool defaults for the shared MongoClient
+#
+DEFAULT_MAX_POOL_SIZE = 100
+DEFAULT_MAX_IDLE_TIME_MS = 60000
+DEFAULT_WAIT_QUEUE_TIMEOUT_MS = 5000
+
+#
+# Server error code for a unique index violation
+#
+DUPLICATE_KEY_ERROR = 11000
+
+#
+# Indexes that the social network collections rely on:
+# collection -> [ ( index name, keys, options ) ]
+#
+# status_user_id leads with user_id for lookups by user, and carries
+# status_id so that a user's statuses come back in status_id order
+# straight from the index when they are read a page at a time.
+#
+EXPECTED_INDEXES = {
+    "users": [
+        ( "user_id_unique", [ ( "user_id", ASCENDING ) ], { "unique": True } ),
+    ],
+    "status": [
+        ( "status_id_unique", [ ( "status_id", ASCENDING ) ], { "unique": True } ),
+        ( "status_user_id",
+          [ ( "user_id", ASCENDING ), ( "status_id", ASCENDING ) ], {} ),
+        ( "status_text_search", [ ( "status_text", TEXT ) ], {} ),
+    ],
+}
+
+#
+# Seconds that MongoBackend trusts its copy of the tombstoned user
+# IDs before reading them again (its own deletions show up at once)
+#
+TOMBSTONE_REFRESH_SECONDS = 1.0
+
+#
+# Most tombstoned users that a status query excludes by listing their
+# IDs; with more, each status is joined with "user_tombstones" instead
+#
+MAX_LISTED_TOMBSTONES = 1000
+
+#
+# _id keys fetched per round trip when key_ranges scans the index
+#
+KEY_SCAN_BATCH_SIZE = 10000
+
+#
+# Aggregation stages that drop statuses whose user is tombstoned
+#
+TOMBSTONE_JOIN = [
+    { '$lookup': { 'from': "user_tombstones", 'localField': "user_id",
+                   'foreignField': "_id", 'as': "_tombstone" } },
+    { '$match': { '_tombstone': { '$size': 0 } } },
+]
+
+#
+# Fields returned when reading whole users or statuses
+#
+USER_PROJECTION = { '_id': 0, 'user_id': 1, 'email': 1,
+                    'user_name': 1, 'user_last_name': 1 }
+STATUS_PROJECTION = { '_id': 0, 'status_id': 1, 'user_id': 1, 'status_text': 1 }
+
+#
+# Statuses read with raw=True are left as undecoded BSON, so that
+# fields nobody looks at are never turned into Python objects
+#
+RAW_CODEC_OPTIONS = CodecOptions( document_class=RawBSONDocument )
+
+#
+# Ways that filter_status_by_string can match target strings:
+# - FILTER_REGEX: substring (regular expression) match; scans every status
+# - FILTER_TEXT: word match through the text index on status_text
+# - FILTER_TRIGRAM: substring match through the in-process trigram
+#   index (see UserStatusCollection.enable_trigram_index)
+#
+FILTER_REGEX = "regex"
+FILTER_TEXT = "text"
+FILTER_TRIGRAM = "trigram"
+
+
+#
+# Words for MemoryBackend's FILTER_TEXT matching
+#
+WORD_PATTERN = re.compile( r"\w+" )
+
+
+class StorageError( Exception ):
+    '''
+    Raised by a storage backend when an operation fails
+    '''
+
+
+class DuplicateKey( StorageError ):
+    '''
+    Raised when a user_id or status_id is already taken
+    '''
+
+
+class StorageBackend():
+    '''
+    Interface that every storage engine implements.
+
+    Users and statuses are passed in and out as plain dictionaries
+    (see UsersTable.as_dict and StatusTable.as_dict). Methods raise
+    StorageError when the engine fails, and DuplicateKey when a
+    single insert collides with an existing ID.
+
+    Bulk inserts are unordered: they return three lists of indexes
+    into the input (written, duplicate, failed) rather than raising.
+    '''
+    name = None
+
+    #
+    # Whether several processes can use the same data through their
+    # own copies of this backend (see parallel_load)
+    #
+    shared_between_processes = False
+
+    #
+    # Whether tombstone_user leaves a user's statuses behind (hidden)
+    # for a StatusReaper to delete, rather than deleting them itself
+    #
+    deferred_cascade = False
+
+    @property
+    def unique_keys_enforced( self ):
+        '''
+        Whether inserting a duplicate user_id or status_id is
+        guaranteed to raise DuplicateKey
+        '''
+        return True
+
+    def ensure_indexes( self ):
+        '''
+        Create whatever indexes the engine needs; safe to repeat
+        '''
+
+    def verify_indexes( self ):
+        '''
+        Returns a dictionary listing the present, missing and unused
+        indexes, each as "collection.index"
+        '''
+        raise NotImplementedError
+
+    def insert_user( self, user ):
+        '''
+        Store a new user
+        '''
+        raise NotImplementedError
+
+    def insert_users( self, users ):
+        '''
+        Store a batch of new users
+        '''
+        raise NotImplementedError
+
+    def find_user( self, user_id ):
+        '''
+        Returns the user dictionary, or None
+        '''
+        raise NotImplementedError
+
+    def existing_user_ids( self, user_ids ):
+        '''
+        Returns the set of user_ids that are stored
+        '''
+        raise NotImplementedError
+
+    def iter_user_ids( self, batch_size ):
+        '''
+        Yields every stored user_id
+        '''
+        raise NotImplementedError
+
+    def iter_users( self, batch_size, key_range=None ):
+        '''
+        Yields every stored user dictionary, or those in key_range
+        (one of the ranges returned by key_ranges)
+        '''
+        raise NotImplementedError
+
+    def key_ranges( self, collection_name, parts ):
+        '''
+        Split the "users" or "status" collection into at most parts
+        contiguous ranges of roughly equal size, for reading in
+        parallel. Returns a list of ( lower, upper ) pairs, where
+        None means unbounded.
+        '''
+        return [ ( None, None ) ]
+
+    def update_user( self, user_id, fields ):
+        '''
+        Set fields on a user, in one round trip. Returns the number of
+        users matched (0 if there is no such user).
+        '''
+        raise NotImplementedError
+
+    def delete_user( self, user_id ):
+        '''
+        Remove a user. Returns the number of users removed.
+        '''
+        raise NotImplementedError
+
+    def find_users( self, user_ids ):
+        '''
+        Returns a list of the user dictionaries for those of user_ids
+        that exist, in one query
+        '''
+        raise NotImplementedError
+
+    def tombstone_users( self, user_ids ):
+        '''
+        tombstone_user for each of user_ids, in a fixed number of
+        round trips. Returns the set of user IDs removed.
+        '''
+        raise NotImplementedError
+
+    def tombstone_user( self, user_id ):
+        '''
+        Remove a user and hide its statuses from every read, leaving
+        them to be deleted later with reap_statuses when
+        deferred_cascade is set. Returns the number of users removed.
+        '''
+        raise NotImplementedError
+
+    def tombstoned_user_ids( self ):
+        '''
+        Returns the IDs of removed users whose statuses have not all
+        been reaped yet
+        '''
+        raise NotImplementedError
+
+    def reap_statuses( self, user_id, batch_size ):
+        '''
+        Delete up to batch_size statuses of a user, if the user is
+        still tombstoned. Returns the number deleted; fewer than
+        batch_size means that none are left.
+        '''
+        raise NotImplementedError
+
+    def remove_tombstone( self, user_id ):
+        '''
+        Forget that a user was removed, once its statuses are reaped
+        '''
+        raise NotImplementedError
+
+    def insert_status( self, status ):
+        '''
+        Store a new status
+        '''
+        raise NotImplementedError
+
+    def insert_statuses( self, statuses ):
+        '''
+        Store a batch of new statuses
+        '''
+        raise NotImplementedError
+
+    def find_status( self, status_id ):
+        '''
+        Returns the status dictionary, or None
+        '''
+        raise NotImplementedError
+
+    def existing_status_ids( self, status_ids ):
+        '''
+        Returns the set of status_ids that are stored
+        '''
+        raise NotImplementedError
+
+    def update_status( self, status_id, fields ):
+        '''
+        Set fields on a status, in one round trip. Returns the number
+        of statuses matched (0 if there is no such status).
+        '''
+        raise NotImplementedError
+
+    def delete_status( self, status_id ):
+        '''
+        Remove a status. Returns the number of statuses removed.
+        '''
+        raise NotImplementedError
+
+    def delete_statuses_by_user( self, user_id ):
+        '''
+        Remove every status of a user. Returns the number removed.
+        '''
+        raise NotImplementedError
+
+    def find_statuses( self, status_ids ):
+        '''
+        Returns a list of the status dictionaries for those of
+        status_ids that exist, in one query
+        '''
+        raise NotImplementedError
+
+    def delete_statuses( self, status_ids ):
+        '''
+        Remove the statuses with the given IDs, in a fixed number of
+        round trips. Returns the set of status IDs removed.
+        '''
+        raise NotImplementedError
+
+    def find_statuses_by_user( self, user_id, fields=None, raw=False ):
+        '''
+        Yields the status dictionaries of a user (see match_statuses
+        for fields and raw)
+        '''
+        raise NotImplementedError
+
+    def page_statuses_by_user( self, user_id, page_size, after=None, fields=None ):
+        '''
+        Returns a list of up to page_size statuses of a user, in
+        status_id order, starting after the status_id `after` (from the
+        first one if None). With fields, each status dictionary holds
+        only status_id and those fields.
+        '''
+        raise NotImplementedError
+
+    def count_statuses_by_user( self, user_id ):
+        '''
+        Returns the number of statuses of a user
+        '''
+        raise NotImplementedError
+
+    def status_fingerprint( self ):
+        '''
+        Returns ( number of statuses, greatest status_id or None ) over
+        the statuses that iter_statuses yields, a cheap check of
+        whether a copy of them (such as a saved TrigramIndex) is
+        current
+        '''
+        raise NotImplementedError
+
+    def iter_statuses( self, batch_size, key_range=None, fields=None, raw=False ):
+        '''
+        Yields every stored status dictionary, or those in key_range
+        (one of the ranges returned by key_ranges); see
+        match_statuses for fields and raw
+        '''
+        raise NotImplementedError
+
+    def match_statuses( self, target_string, mode=FILTER_REGEX, limit=0,
+                        by_relevance=False, fields=None, raw=False ):
+        '''
+        Yields the status dictionaries whose text matches
+        target_string, in FILTER_REGEX or FILTER_TEXT mode.
+
+        With fields, each status holds only those fields, and the
+        others are not read from the database. With raw, a backend
+        may yield read-only mappings, rather than dictionaries, that
+        are only decoded when a field is first looked up; backends
+        that have nothing to decode ignore it.
+        '''
+        raise NotImplementedError
+
+    def async_writes( self ):
+        '''
+        Returns an object with coroutine versions of
+        existing_user_ids, existing_status_ids and insert_statuses,
+        for use from an event loop; close() it when done. By default
+        the blocking methods run on worker threads.
+        '''
+        return ThreadedAsyncWrites( self )
+
+
+class ThreadedAsyncWrites():
+    '''
+    Coroutine wrappers that run a backend's blocking methods on the
+    default executor
+    '''
+    def __init__( self, backend ):
+        self.backend = backend
+
+    async def existing_user_ids( self, user_ids ):
+        '''
+        See StorageBackend.existing_user_ids
+        '''
+        return await asyncio.to_thread( self.backend.existing_user_ids, user_ids )
+
+    async def existing_status_ids( self, status_ids ):
+        '''
+        See StorageBackend.existing_status_ids
+        '''
+        return await asyncio.to_thread( self.backend.existing_status_ids, status_ids )
+
+    async def insert_statuses( self, statuses ):
+        '''
+        See StorageBackend.insert_statuses
+        '''
+        return await asyncio.to_thread( self.backend.insert_statuses, statuses )
+
+    async def close( self ):
+        '''
+        Nothing to release
+        '''
+
+
+def split_bulk_write_error( bulk_error, num_docs ):
+    '''
+    Split the outcome of an unordered bulk write that raised
+    BulkWriteError into the indexes that were written, the indexes
+    that collided with an existing key and the indexes that failed
+    for any other reason.
+    '''
+    duplicate_indexes = set()
+    failed_indexes = set()
+    for write_error in bulk_error.details.get( "writeErrors", [] ):
+        if write_error.get( "code" ) == DUPLICATE_KEY_ERROR:
+            duplicate_indexes.add( write_error[ "index" ] )
+        else:
+            failed_indexes.add( write_error[ "index" ] )
+    written_indexes = [ index for index in range( num_docs )
+                        if index not in duplicate_indexes
+                        and index not in failed_indexes ]
+    return written_indexes, sorted( duplicate_indexes ), sorted( failed_indexes )
+
+
+class PoolMonitor( monitoring.ConnectionPoolListener ):
+    '''
+    Connection pool listener that keeps running counts of the
+    connections held by the shared MongoClient, so that we can report
+    how much of the pool is actually in use.
+    '''
+    def __init__( self ):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset( self ):
+        '''
+        Zero all of the counters
+        '''
+        with self._lock:
+            self.open = 0
+            self.in_use = 0
+            self.peak_in_use = 0
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.created = 0
+            self.closed = 0
+
+    def snapshot( self ):
+        '''
+        Return the current counters as a dictionary
+        '''
+        with self._lock:
+            return {
+                'open': self.open,
+                'in_use': self.in_use,
+                'peak_in_use': self.peak_in_use,
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+                'created': self.created,
+                'closed': self.closed,
+            }
+
+    def connection_created( self, event ):
+        with self._lock:
+            self.open += 1
+            self.created += 1
+
+    def connection_closed( self, event ):
+        with self._lock:
+            self.open = max( 0, self.open - 1 )
+            self.closed += 1
+
+    def connection_checked_out( self, event ):
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+            self.peak_in_use = max( self.peak_in_use, self.in_use )
+
+    def connection_checked_in( self, event ):
+        with self._lock:
+            self.in_use = max( 0, self.in_use - 1 )
+
+    def connection_check_out_failed( self, event ):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def pool_created( self, event ):
+        pass
+
+    def pool_ready( self, event ):
+        pass
+
+    def pool_cleared( self, event ):
+        pass
+
+    def pool_closed( self, event ):
+        pass
+
+    def connection_ready( self, event ):
+        pass
+
+    def connection_check_out_started( self, event ):
+        pass
+
+
+class MongoDBConnection():
+    """
+    MongoDB Connection
+
+    Holds one long-lived, pooled MongoClient for the whole process.
+    The client is created on first use and then shared by every
+    collection method; MongoClient is itself thread-safe. After a
+    fork, the child process drops the parent's client and lazily
+    creates its own, since MongoClient instances are not fork-safe.
+    """
+
+    def __init__(self, host='127.0.0.1', port=27017,
+                 max_pool_size=DEFAULT_MAX_POOL_SIZE,
+                 max_idle_time_ms=DEFAULT_MAX_IDLE_TIME_MS,
+                 wait_queue_timeout_ms=DEFAULT_WAIT_QUEUE_TIMEOUT_MS):
+        """ be sure to use the ip address not name for local windows"""
+        self.host = host
+        self.port = port
+        self.max_pool_size = max_pool_size
+        self.max_idle_time_ms = max_idle_time_ms
+        self.wait_queue_timeout_ms = wait_queue_timeout_ms
+        self.pool_monitor = PoolMonitor()
+        self._lock = threading.Lock()
+        self._client = None
+        self._client_pid = None
+        if hasattr( os, "register_at_fork" ):
+            os.register_at_fork( after_in_child=self._after_fork )
+
+    def _after_fork( self ):
+        #
+        # The lock might have been held by another thread at the
+        # moment of the fork, and the parent's sockets must not be
+        # reused here, so start over with a clean slate.
+        #
+        self._lock = threading.Lock()
+        self._client = None
+        self._client_pid = None
+        self.pool_monitor = PoolMonitor()
+
+    def configure( self, max_pool_size=None, max_idle_time_ms=None,
+                   wait_queue_timeout_ms=None ):
+        '''
+        Change the pool settings. Any existing client is closed, and
+        the next operation creates a new one with the new settings.
+        '''
+        with self._lock:
+            if max_pool_size is not None:
+                self.max_pool_size = max_pool_size
+            if max_idle_time_ms is not None:
+                self.max_idle_time_ms = max_idle_time_ms
+            if wait_queue_timeout_ms is not None:
+                self.wait_queue_timeout_ms = wait_queue_timeout_ms
+            self._close_client()
+
+    @property
+    def connection( self ):
+        '''
+        The shared MongoClient, created on first access
+        '''
+        client = self._client
+        if client is not None and self._client_pid == os.getpid():
+            return client
+
+        with self._lock:
+            if self._client is None or self._client_pid != os.getpid():
+                logger.debug( "Creating pooled MongoClient" )
+                self.pool_monitor.reset()
+                self._client = MongoClient(
+                    self.host,
+                    self.port,
+                    maxPoolSize=self.max_pool_size,
+                    maxIdleTimeMS=self.max_idle_time_ms,
+                    waitQueueTimeoutMS=self.wait_queue_timeout_ms,
+                    event_listeners=[ self.pool_monitor, tracing.command_listener ],
+                )
+                self._client_pid = os.getpid()
+            return self._client
+
+    def pool_stats( self ):
+        '''
+        Report connection pool utilisation for the shared client
+        '''
+        stats = self.pool_monitor.snapshot()
+        stats[ 'max_pool_size' ] = self.max_pool_size
+        stats[ 'utilisation' ] = (
+            stats[ 'in_use' ] / self.max_pool_size
+            if self.max_pool_size else 0.0
+        )
+        stats[ 'client_created' ] = self._client is not None
+        return stats
+
+    def _close_client( self ):
+        if self._client is not None and self._client_pid == os.getpid():
+            self._client.close()
+        self._client = None
+        self._client_pid = None
+
+    def close( self ):
+        '''
+        Close the shared client and release all pooled connections
+        '''
+        with self._lock:
+            self._close_client()
+
+    def __enter__(self):
+        # pylint:disable=pointless-statement
+        self.connection
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        #
+        # The client is long-lived: connections go back to the pool
+        # when each operation completes, so there is nothing to
+        # release here.
+        #
+        pass
+
+
+def index_matches( index_info, keys ):
+    '''
+    Whether an entry from index_information() has the given keys.
+
+    The server reports text indexes as _fts/_ftsx keys, with the
+    indexed fields listed under "weights".
+    '''
+    if any( direction == TEXT for _, direction in keys ):
+        return all( field in index_info.get( "weights", {} )
+                    for field, _ in keys )
+    return list( index_info[ "key" ] ) == keys
+
+
+@contextmanager
+def mongo_errors():
+    '''
+    Re-raise driver exceptions as StorageError / DuplicateKey
+    '''
+    try:
+        yield
+    except DuplicateKeyError as db_exception:
+        raise DuplicateKey( str( db_exception ) ) from db_exception
+    except PyMongoError as db_exception:
+        raise StorageError( str( db_exception ) ) from db_exception
+
+
+def status_projection( fields=None ):
+    '''
+    Projection that returns only fields of each status, or every
+    status field if None
+    '''
+    if not fields:
+        return STATUS_PROJECTION
+    projection = dict.fromkeys( fields, 1 )
+    projection[ '_id' ] = 0
+    return projection
+
+
+def translate_cursor( cursor ):
+    '''
+    Iterate over a cursor, translating driver exceptions raised
+    while fetching further batches
+    '''
+    with mongo_errors():
+        yield from cursor
+
+
+def id_range_query( key_range ):
+    '''
+    Query for the documents whose _id is in key_range
+    ( lower inclusive, upper exclusive; None for unbounded )
+    '''
+    if key_range is None:
+        return {}
+    lower, upper = key_range
+    bounds = {}
+    if lower is not None:
+        bounds[ '$gte' ] = lower
+    if upper is not None:
+        bounds[ '$lt' ] = upper
+    return { '_id': bounds } if bounds else {}
+
+
+class MongoBackend( StorageBackend ):
+    '''
+    Stores users and statuses in the "users" and "status" collections
+    of a MongoDB database, through a shared MongoDBConnection.
+
+    Deleted users are listed in "user_tombstones" until a StatusReaper
+    has removed their statuses. Reads check them as last read (at most
+    TOMBSTONE_REFRESH_SECONDS ago); updates check them as last read at
+    all, so that each update is one round trip.
+    '''
+    name = "mongo"
+    shared_between_processes = True
+    deferred_cascade = True
+
+    def __init__( self, connection=None, database="media" ):
+        self.connection = connection if connection is not None else mongo
+        self.database = database
+        self.indexes_ensured = False
+        #
+        # Tombstoned user IDs (from the "user_tombstones" collection)
+        # and when they were last read
+        #
+        self._tombstones = frozenset()
+        self._tombstones_read = None
+
+    def _collection( self, collection_name, raw=False ):
+        collection = self.connection.connection[ self.database ][ collection_name ]
+        if raw:
+            return collection.with_options( codec_options=RAW_CODEC_OPTIONS )
+        return collection
+
+    @property
+    def unique_keys_enforced( self ):
+        # Only once the unique indexes exist
+        return self.indexes_ensured
+
+    def ensure_indexes( self ):
+        with mongo_errors():
+            for collection_name, indexes in EXPECTED_INDEXES.items():
+                collection = self._collection( collection_name )
+                existing = collection.index_information()
+                for index_name, keys, options in indexes:
+                    if index_name in existing and \
+                            not index_matches( existing[ index_name ], keys ):
+                        #
+                        # An older definition under the same name; the
+                        # server refuses to redefine it in place
+                        #
+                        logger.info(
+                            f"Rebuilding index {collection_name}.{index_name}" )
+                        collection.drop_index( index_name )
+                    collection.create_index( keys, name=index_name, **options )
+        self.indexes_ensured = True
+
+    def verify_indexes( self ):
+        report = { 'present': [], 'missing': [], 'unused': [] }
+        with mongo_errors():
+            for collection_name, indexes in EXPECTED_INDEXES.items():
+                collection = self._collection( collection_name )
+                existing = collection.index_information()
+                usage = {
+                    stats[ "name" ]: stats[ "accesses" ][ "ops" ]
+                    for stats in collection.aggregate(
+                        [ { "$indexStats": {} } ] )
+                }
+                for index_name, keys, _ in indexes:
+                    qualified_name = f"{collection_name}.{index_name}"
+                    if index_name not in existing or not index_matches(
+                            existing[ index_name ], keys ):
+                        report[ 'missing' ].append( qualified_name )
+                        continue
+                    report[ 'present' ].append( qualified_name )
+                    if usage.get( index_name ) == 0:
+                        report[ 'unused' ].append( qualified_name )
+        return report
+
+    def _insert_one( self, collection_name, document ):
+        with mongo_errors():
+            #
+            # insert_one adds an _id to the document it is given
+            #
+            self._collection( collection_name ).insert_one( dict( document ) )
+
+    def _insert_many( self, collection_name, documents ):
+        if not documents:
+            return [], [], []
+        try:
+            with mongo_errors():
+                self._collection( collection_name ).bulk_write(
+                    [ InsertOne( dict( document ) ) for document in documents ],
+                    ordered=False
+                )
+        except StorageError as storage_error:
+            if isinstance( storage_error.__cause__, BulkWriteError ):
+                return split_bulk_write_error( storage_error.__cause__,
+                                               len( documents ) )
+            raise
+        return list( range( len( documents ) ) ), [], []
+
+    def _existing_ids( self, collection_name, key, ids ):
+        with mongo_errors():
+            query = { key: { '$in': list( ids ) } }
+            projection = { key: 1, '_id': 0 }
+            return { document[ key ] for document
+                     in self._collection( collection_name ).find( query, projection ) }
+
+    def _update( self, collection_name, key, value, fields ):
+        with mongo_errors():
+            return self._collection( collection_name ).update_one(
+                { key: value }, { '$set': fields } ).matched_count
+
+    def insert_user( self, user ):
+        self._insert_one( "users", user )
+
+    def insert_users( self, users ):
+        return self._insert_many( "users", users )
+
+    def find_user( self, user_id ):
+        with mongo_errors():
+            return self._collection( "users" ).find_one(
+                { 'user_id': user_id }, { '_id': 0 } )
+
+    def existing_user_ids( self, user_ids ):
+        return self._existing_ids( "users", "user_id", user_ids )
+
+    def iter_user_ids( self, batch_size ):
+        cursor = self._collection( "users" ).find(
+            {}, { 'user_id': 1, '_id': 0 }, batch_size=batch_size )
+        for user in translate_cursor( cursor ):
+            yield user[ "user_id" ]
+
+    def iter_users( self, batch_size, key_range=None ):
+        cursor = self._collection( "users" ).find(
+            id_range_query( key_range ), USER_PROJECTION, batch_size=batch_size )
+        return translate_cursor( cursor )
+
+    def key_ranges( self, collection_name, parts ):
+        #
+        # One pass over the _id index, keeping every step-th key as a
+        # boundary. The step comes from the collection's estimated
+        # size, so a stale estimate makes the last range bigger or
+        # smaller than the rest, but never empty.
+        #
+        bounds = []
+        with mongo_errors():
+            collection = self._collection( collection_name )
+            step = collection.estimated_document_count() // parts
+            if step < 1:
+                return [ ( None, None ) ]
+            keys = collection.find( {}, { '_id': 1 },
+                                    batch_size=KEY_SCAN_BATCH_SIZE,
+                                    sort=[ ( '_id', ASCENDING ) ] )
+            for position, document in enumerate( keys ):
+                if position and not position % step:
+                    bounds.append( document[ '_id' ] )
+                    if len( bounds ) == parts - 1:
+                        break
+            keys.close()
+        edges = [ None ] + bounds + [ None ]
+        return list( zip( edges, edges[ 1: ] ) )
+
+    def update_user( self, user_id, fields ):
+        #
+        # A tombstoned user is being deleted, even if its document is
+        # still there
+        #
+        if user_id in self._known_tombstones():
+            return 0
+        return self._update( "users", "user_id", user_id, fields )
+
+    def delete_user( self, user_id ):
+        with mongo_errors():
+            return self._collection( "users" ).delete_one(
+                { 'user_id': user_id } ).deleted_count
+
+    def find_users( self, user_ids ):
+        with mongo_errors():
+            return list( self._collection( "users" ).find(
+                { 'user_id': { '$in': list( user_ids ) } }, USER_PROJECTION ) )
+
+    def tombstone_users( self, user_ids ):
+        existing = self._existing_ids( "users", "user_id", user_ids )
+        if not existing:
+            return existing
+        deleted_at = time.time()
+        with mongo_errors():
+            self._collection( "user_tombstones" ).bulk_write(
+                [ UpdateOne( { '_id': user_id },
+                             { '$setOnInsert': { 'deleted_at': deleted_at } },
+                             upsert=True )
+                  for user_id in existing ],
+                ordered=False )
+            self._tombstones = self._tombstones | existing
+            self._collection( "users" ).delete_many(
+                { 'user_id': { '$in': list( existing ) } } )
+        return existing
+
+    def tombstone_user( self, user_id ):
+        tombstones = self._collection( "user_tombstones" )
+        with mongo_errors():
+            #
+            # Tombstone first, so that the statuses are hidden by the
+            # time the user is gone
+            #
+            created = tombstones.update_one(
+                { '_id': user_id },
+                { '$setOnInsert': { 'deleted_at': time.time() } },
+                upsert=True ).upserted_id is not None
+            self._tombstones = self._tombstones | { user_id }
+            deleted = self._collection( "users" ).delete_one(
+                { 'user_id': user_id } ).deleted_count
+            if not deleted and created:
+                tombstones.delete_one( { '_id': user_id } )
+                self._tombstones = self._tombstones - { user_id }
+        return deleted
+
+    def tombstoned_user_ids( self ):
+        now = time.monotonic()
+        if self._tombstones_read is None or \
+                now - self._tombstones_read > TOMBSTONE_REFRESH_SECONDS:
+            with mongo_errors():
+                self._tombstones = frozenset(
+                    document[ '_id' ] for document
+                    in self._collection( "user_tombstones" ).find( {}, { '_id': 1 } ) )
+            self._tombstones_read = now
+        return self._tombstones
+
+    def reap_statuses( self, user_id, batch_size ):
+        status_collection = self._collection( "status" )
+        with mongo_errors():
+            #
+            # Not the cached tombstones: the user may have been reaped
+            # and added again since they were read
+            #
+            if self._collection( "user_tombstones" ).find_one(
+                    { '_id': user_id }, { '_id': 1 } ) is None:
+                return 0
+            ids = [ document[ '_id' ] for document in status_collection.find(
+                { 'user_id': user_id }, { '_id': 1 } ).limit( batch_size ) ]
+            if not ids:
+                return 0
+            return status_collection.delete_many(
+                { '_id': { '$in': ids }, 'user_id': user_id } ).deleted_count
+
+    def remove_tombstone( self, user_id ):
+        with mongo_errors():
+            self._collection( "user_tombstones" ).delete_one( { '_id': user_id } )
+        self._tombstones = self._tombstones - { user_id }
+
+    def _known_tombstones( self ):
+        '''
+        The tombstoned user IDs as last read, read only if they never
+        have been
+        '''
+        if self._tombstones_read is None:
+            return self.tombstoned_user_ids()
+        return self._tombstones
+
+    def _visible( self, query, tombstoned=None ):
+        '''
+        query, narrowed to statuses whose user is not one of tombstoned
+        (by default, the tombstoned users), or None if there are too
+        many tombstones to list in it (see MAX_LISTED_TOMBSTONES)
+        '''
+        if tombstoned is None:
+            tombstoned = self.tombstoned_user_ids()
+        if not tombstoned:
+            return query
+        if len( tombstoned ) > MAX_LISTED_TOMBSTONES:
+            return None
+        return { **query, 'user_id': { '$nin': list( tombstoned ) } }
+
+    def _find_visible( self, query, projection, raw=False, sort=None, limit=0,
+                       batch_size=None ):
+        '''
+        Cursor over the statuses that match query and whose user is not
+        tombstoned, sorted by sort (a list of key, direction pairs)
+        '''
+        status_collection = self._collection( "status", raw )
+        options = { 'batch_size': batch_size } if batch_size else {}
+        visible = self._visible( query )
+        if visible is not None:
+            cursor = status_collection.find( visible, projection, **options )
+            if sort:
+                cursor = cursor.sort( sort )
+            if limit:
+                cursor = cursor.limit( limit )
+            return cursor
+        pipeline = [ { '$match': query } ] + TOMBSTONE_JOIN
+        if sort:
+            pipeline.append( { '$sort': dict( sort ) } )
+        if limit:
+            pipeline.append( { '$limit': limit } )
+        pipeline.append( { '$project': projection } )
+        return status_collection.aggregate( pipeline, **options )
+
+    def _count_visible( self, query ):
+        '''
+        Number of statuses that match query and whose user is not
+        tombstoned
+        '''
+        status_collection = self._collection( "status" )
+        visible = self._visible( query )
+        if visible is not None:
+            return status_collection.count_documents( visible )
+        counted = list( status_collection.aggregate(
+            [ { '$match': query } ] + TOMBSTONE_JOIN + [ { '$count': "statuses" } ] ) )
+        return counted[ 0 ][ "statuses" ] if counted else 0
+
+    def insert_status( self, status ):
+        self._insert_one( "status", status )
+
+    def insert_statuses( self, statuses ):
+        return self._insert_many( "status", statuses )
+
+    def find_status( self, status_id ):
+        with mongo_errors():
+            status = self._collection( "status" ).find_one(
+                { 'status_id': status_id }, { '_id': 0 } )
+        if status is not None and status[ 'user_id' ] in self.tombstoned_user_ids():
+            return None
+        return status
+
+    def existing_status_ids( self, status_ids ):
+        return self._existing_ids( "status", "status_id", status_ids )
+
+    def update_status( self, status_id, fields ):
+        tombstoned = self._known_tombstones()
+        query = self._visible( { 'status_id': status_id }, tombstoned )
+        with mongo_errors():
+            status_collection = self._collection( "status" )
+            if query is not None:
+                return status_collection.update_one(
+                    query, { '$set': fields } ).matched_count
+            #
+            # Too many tombstones to list: update, then check the owner.
+            # A tombstoned user's statuses are only waiting to be reaped,
+            # so updating one does no harm.
+            #
+            status = status_collection.find_one_and_update(
+                { 'status_id': status_id }, { '$set': fields }, { 'user_id': 1 } )
+        return 0 if status is None or status[ 'user_id' ] in tombstoned else 1
+
+    def delete_status( self, status_id ):
+        with mongo_errors():
+            return self._collection( "status" ).delete_one(
+                { 'status_id': status_id } ).deleted_count
+
+    def delete_statuses_by_user( self, user_id ):
+        with mongo_errors():
+            return self._collection( "status" ).delete_many(
+                { 'user_id': user_id } ).deleted_count
+
+    def find_statuses( self, status_ids ):
+        with mongo_errors():
+            return list( self._find_visible(
+                { 'status_id': { '$in': list( status_ids ) } }, STATUS_PROJECTION ) )
+
+    def delete_statuses( self, status_ids ):
+        existing = self._existing_ids( "status", "status_id", status_ids )
+        if existing:
+            with mongo_errors():
+                self._collection( "status" ).delete_many(
+                    { 'status_id': { '$in': list( existing ) } } )
+        return existing
+
+    def find_statuses_by_user( self, user_id, fields=None, raw=False ):
+        if user_id in self.tombstoned_user_ids():
+            return iter( () )
+        with mongo_errors():
+            cursor = self._collection( "status", raw ).find(
+                { 'user_id': user_id }, status_projection( fields ) )
+        return translate_cursor( cursor )
+
+    def page_statuses_by_user( self, user_id, page_size, after=None, fields=None ):
+        if user_id in self.tombstoned_user_ids():
+            return []
+        query = { 'user_id': user_id }
+        if after is not None:
+            query[ 'status_id' ] = { '$gt': after }
+        if fields:
+            fields = ( 'status_id', ) + tuple( fields )
+        with mongo_errors():
+            return list( self._collection( "status" )
+                         .find( query, status_projection( fields ) )
+                         .sort( 'status_id', ASCENDING )
+                         .limit( page_size ) )
+
+    def count_statuses_by_user( self, user_id ):
+        if user_id in self.tombstoned_user_ids():
+            return 0
+        with mongo_errors():
+            return self._collection( "status" ).count_documents(
+                { 'user_id': user_id } )
+
+    def status_fingerprint( self ):
+        with mongo_errors():
+            count = self._count_visible( {} )
+            greatest = list( self._find_visible(
+                {}, { 'status_id': 1, '_id': 0 }, sort=[ ( 'status_id', DESCENDING ) ],
+                limit=1 ) )
+        return count, greatest[ 0 ][ 'status_id' ] if greatest else None
+
+    def iter_statuses( self, batch_size, key_range=None, fields=None, raw=False ):
+        with mongo_errors():
+            cursor = self._find_visible( id_range_query( key_range ),
+                                         status_projection( fields ),
+                                         raw=raw, batch_size=batch_size )
+        return translate_cursor( cursor )
+
+    def async_writes( self ):
+        if AsyncMongoClient is None:
+            return super().async_writes()
+        return MongoAsyncWrites( self )
+
+    def match_statuses( self, target_string, mode=FILTER_REGEX, limit=0,
+                        by_relevance=False, fields=None, raw=False ):
+        projection = status_projection( fields )
+        sort = None
+        if mode == FILTER_TEXT:
+            query = { '$text': { '$search': target_string } }
+            if by_relevance:
+                score = { 'score': { '$meta': 'textScore' } }
+                projection = { **projection, **score }
+                sort = list( score.items() )
+        else:
+            #
+            # https://stackoverflow.com/a/10616781/1106930
+            #
+            query = { 'status_text': { '$regex' : target_string } }
+        with mongo_errors():
+            cursor = self._find_visible( query, projection, raw=raw, sort=sort,
+                                         limit=limit )
+        return translate_cursor( cursor )
+
+
+def status_fields( status, fields=None ):
+    '''
+    A copy of a status dictionary holding only fields, or every
+    field if None
+    '''
+    if not fields:
+        return dict( status )
+    return { field: status[ field ] for field in fields if field in status }
+
+
+def position_slice( values, key_range ):
+    '''
+    The part of values in key_range, a ( start, stop ) pair of
+    positions
+    '''
+    if key_range is None:
+        return values
+    return values[ slice( *key_range ) ]
+
+
+class MongoAsyncWrites():
+    '''
+    Native coroutine versions of MongoBackend's batch methods, on an
+    AsyncMongoClient of their own. The client belongs to the event
+    loop that first uses it, so make one of these per loop.
+    '''
+    def __init__( self, backend ):
+        connection = backend.connection
+        self.client = AsyncMongoClient(
+            connection.host,
+            connection.port,
+            maxPoolSize=connection.max_pool_size,
+            maxIdleTimeMS=connection.max_idle_time_ms,
+            waitQueueTimeoutMS=connection.wait_queue_timeout_ms,
+            event_listeners=[ tracing.command_listener ]
+        )
+        self.database = self.client[ backend.database ]
+
+    async def _existing_ids( self, collection_name, key, ids ):
+        with mongo_errors():
+            cursor = self.database[ collection_name ].find(
+                { key: { '$in': list( ids ) } }, { key: 1, '_id': 0 } )
+            return { document[ key ] async for document in cursor }
+
+    async def existing_user_ids( self, user_ids ):
+        '''
+        See StorageBackend.existing_user_ids
+        '''
+        return await self._existing_ids( "users", "user_id", user_ids )
+
+    async def existing_status_ids( self, status_ids ):
+        '''
+        See StorageBackend.existing_status_ids
+        '''
+        return await self._existing_ids( "status", "status_id", status_ids )
+
+    async def insert_statuses( self, statuses ):
+        '''
+        See StorageBackend.insert_statuses
+        '''
+        if not statuses:
+            return [], [], []
+        try:
+            with mongo_errors():
+                await self.database[ "status" ].bulk_write(
+                    [ InsertOne( dict( status ) ) for status in statuses ],
+                    ordered=False
+                )
+        except StorageError as storage_error:
+            if isinstance( storage_error.__cause__, BulkWriteError ):
+                return split_bulk_write_error( storage_error.__cause__,
+                                               len( statuses ) )
+            raise
+        return list( range( len( statuses ) ) ), [], []
+
+    async def close( self ):
+        '''
+        Close the client and its connections
+        '''
+        await self.client.close()
+
+
+class MemoryBackend( StorageBackend ):
+    '''
+    Keeps users and statuses in process memory, in dictionaries
+    indexed by user_id, status_id and (for statuses) user_id.
+
+    Nothing is persisted. FILTER_TEXT matching splits text into words
+    and ignores case, scoring each status by how many of its words
+    are in the query, but does not stem words the way MongoDB does.
+    '''
+    name = "memory"
+    deferred_cascade = True
+
+    def __init__( self ):
+        self._lock = threading.RLock()
+        self.users = {}
+        self.statuses = {}
+        self.statuses_by_user = defaultdict( dict )
+        self.tombstones = set()
+
+    def verify_indexes( self ):
+        return {
+            'present': [ 'users.user_id', 'status.status_id', 'status.user_id' ],
+            'missing': [],
+            'unused': [],
+        }
+
+    def insert_user( self, user ):
+        with self._lock:
+            if user[ "user_id" ] in self.users:
+                raise DuplicateKey( user[ "user_id" ] )
+            self.users[ user[ "user_id" ] ] = dict( user )
+
+    def insert_users( self, users ):
+        written, duplicates = [], []
+        with self._lock:
+            for position, user in enumerate( users ):
+                if user[ "user_id" ] in self.users:
+                    duplicates.append( position )
+                else:
+                    self.users[ user[ "user_id" ] ] = dict( user )
+                    written.append( position )
+        return written, duplicates, []
+
+    def find_user( self, user_id ):
+        with self._lock:
+            user = self.users.get( user_id )
+            return dict( user ) if user is not None else None
+
+    def existing_user_ids( self, user_ids ):
+        with self._lock:
+            return { user_id for user_id in user_ids if user_id in self.users }
+
+    def iter_user_ids( self, batch_size ):
+        with self._lock:
+            user_ids = list( self.users )
+        return iter( user_ids )
+
+    def iter_users( self, batch_size, key_range=None ):
+        with self._lock:
+            users = list( self.users.values() )
+        return iter( [ dict( user ) for user in position_slice( users, key_range ) ] )
+
+    def key_ranges( self, collection_name, parts ):
+        with self._lock:
+            total = len( self.users if collection_name == "users" else self.statuses )
+        #
+        # Ranges of positions in insertion order
+        #
+        edges = sorted( { part * total // parts for part in range( parts + 1 ) } )
+        return list( zip( edges, edges[ 1: ] ) ) or [ ( None, None ) ]
+
+    def update_user( self, user_id, fields ):
+        with self._lock:
+            user = self.users.get( user_id )
+            if user is None or user_id in self.tombstones:
+                return 0
+            user.update( fields )
+            return 1
+
+    def delete_user( self, user_id ):
+        with self._lock:
+            return 1 if self.users.pop( user_id, None ) is not None else 0
+
+    def find_users( self, user_ids ):
+        with self._lock:
+            return [ dict( self.users[ user_id ] ) for user_id in set( user_ids )
+                     if user_id in self.users ]
+
+    def tombstone_users( self, user_ids ):
+        with self._lock:
+            return { user_id for user_id in set( user_ids )
+                     if self.tombstone_user( user_id ) }
+
+    def tombstone_user( self, user_id ):
+        with self._lock:
+            if self.users.pop( user_id, None ) is None:
+                return 0
+            self.tombstones.add( user_id )
+            return 1
+
+    def tombstoned_user_ids( self ):
+        with self._lock:
+            return frozenset( self.tombstones )
+
+    def reap_statuses( self, user_id, batch_size ):
+        with self._lock:
+            user_statuses = self.statuses_by_user.get( user_id )
+            if not user_statuses or user_id not in self.tombstones:
+                return 0
+            status_ids = list( islice( user_statuses, batch_size ) )
+            for status_id in status_ids:
+                del self.statuses[ status_id ]
+                del user_statuses[ status_id ]
+            if not user_statuses:
+                del self.statuses_by_user[ user_id ]
+            return len( status_ids )
+
+    def remove_tombstone( self, user_id ):
+        with self._lock:
+            self.tombstones.discard( user_id )
+
+    def _store_status( self, status ):
+        # Caller holds the lock
+        self.statuses[ status[ "status_id" ] ] = dict( status )
+        self.statuses_by_user[ status[ "user_id" ] ][ status[ "status_id" ] ] = None
+
+    def insert_status( self, status ):
+        with self._lock:
+            if status[ "status_id" ] in self.statuses:
+                raise DuplicateKey( status[ "status_id" ] )
+            self._store_status( status )
+
+    def insert_statuses( self, statuses ):
+        written, duplicates = [], []
+        with self._lock:
+            for position, status in enumerate( statuses ):
+                if status[ "status_id" ] in self.statuses:
+                    duplicates.append( position )
+                else:
+                    self._store_status( status )
+                    written.append( position )
+        return written, duplicates, []
+
+    def find_status( self, status_id ):
+        with self._lock:
+            status = self.statuses.get( status_id )
+            if status is None or status[ "user_id" ] in self.tombstones:
+                return None
+            return dict( status )
+
+    def existing_status_ids( self, status_ids ):
+        with self._lock:
+            return { status_id for status_id in status_ids
+                     if status_id in self.statuses }
+
+    def update_status( self, status_id, fields ):
+        with self._lock:
+            status = self.statuses.get( status_id )
+            if status is None or status[ "user_id" ] in self.tombstones:
+                return 0
+            status.update( fields )
+            return 1
+
+    def delete_status( self, status_id ):
+        with self._lock:
+            status = self.statuses.pop( status_id, None )
+            if status is None:
+                return 0
+            user_statuses = self.statuses_by_user.get( status[ "user_id" ] )
+            if user_statuses is not None:
+                user_statuses.pop( status_id, None )
+                if not user_statuses:
+                    del self.statuses_by_user[ status[ "user_id" ] ]
+            return 1
+
+    def delete_statuses_by_user( self, user_id ):
+        with self._lock:
+            status_ids = self.statuses_by_user.pop( user_id, {} )
+            for status_id in status_ids:
+                del self.statuses[ status_id ]
+            return len( status_ids )
+
+    def find_statuses( self, status_ids ):
+        with self._lock:
+            statuses = ( self.statuses.get( status_id )
+                         for status_id in set( status_ids ) )
+            return [ dict( status ) for status in statuses
+                     if status is not None and
+                     status[ "user_id" ] not in self.tombstones ]
+
+    def delete_statuses( self, status_ids ):
+        with self._lock:
+            return { status_id for status_id in set( status_ids )
+                     if self.delete_status( status_id ) }
+
+    def _user_status_ids( self, user_id ):
+        # Caller holds the lock
+        if user_id in self.tombstones:
+            return ()
+        return self.statuses_by_user.get( user_id, () )
+
+    def _visible_statuses( self ):
+        # Caller holds the lock
+        if not self.tombstones:
+            return list( self.statuses.values() )
+        return [ status for status in self.statuses.values()
+                 if status[ "user_id" ] not in self.tombstones ]
+
+    def find_statuses_by_user( self, user_id, fields=None, raw=False ):
+        with self._lock:
+            statuses = [ status_fields( self.statuses[ status_id ], fields )
+                         for status_id in self._user_status_ids( user_id ) ]
+        return iter( statuses )
+
+    def page_statuses_by_user( self, user_id, page_size, after=None, fields=None ):
+        with self._lock:
+            status_ids = sorted(
+                status_id for status_id in self._user_status_ids( user_id )
+                if after is None or status_id > after )[ :page_size ]
+            statuses = [ self.statuses[ status_id ] for status_id in status_ids ]
+        if fields:
+            fields = ( 'status_id', ) + tuple( fields )
+        return [ status_fields( status, fields ) for status in statuses ]
+
+    def count_statuses_by_user( self, user_id ):
+        with self._lock:
+            return len( self._user_status_ids( user_id ) )
+
+    def status_fingerprint( self ):
+        with self._lock:
+            statuses = self._visible_statuses()
+        return len( statuses ), max( ( status[ "status_id" ] for status in statuses ),
+                                     default=None )
+
+    def iter_statuses( self, batch_size, key_range=None, fields=None, raw=False ):
+        with self._lock:
+            statuses = self._visible_statuses()
+        return iter( [ status_fields( status, fields )
+                       for status in position_slice( statuses, key_range ) ] )
+
+    def match_statuses( self, target_string, mode=FILTER_REGEX, limit=0,
+                        by_relevance=False, fields=None, raw=False ):
+        with self._lock:
+            statuses = self._visible_statuses()
+
+        if mode == FILTER_TEXT:
+            words = set( WORD_PATTERN.findall( target_string.lower() ) )
+            scored = []
+            for status in statuses:
+                score = sum( 1 for word
+                             in WORD_PATTERN.findall( status[ "status_text" ].lower() )
+                             if word in words )
+                if score:
+                    scored.append( ( score, status ) )
+            if by_relevance:
+                scored.sort( key=lambda pair: pair[ 0 ], reverse=True )
+            matches = [ status for _, status in scored ]
+        else:
+            try:
+                pattern = re.compile( target_string )
+            except re.error as regex_error:
+                raise StorageError( str( regex_error ) ) from regex_error
+            matches = [ status for status in statuses
+                        if pattern.search( status[ "status_text" ] ) ]
+
+        if limit:
+            matches = matches[ :limit ]
+        return iter( [ status_fields( status, fields ) for status in matches ] )
+
+
+#
+# Connection shared by every MongoBackend that is not given its own
+#
+mongo = MongoDBConnection()
+
+
+# --- END --- #
@@ -0,0 +1,337 @@
+'''
+Request tracing with database round-trip accounting
+
+While tracing is on (see start), every call of a main function that
+is not already inside a trace starts a trace. The collection methods
+and main functions that it calls, directly or not, become nested
+spans. metrics.timed does the wrapping, so anything metrics times is
+traced. Each MongoDB command that a span issues is recorded in it,
+through a pymongo command listener, with its duration and the BSON
+size of the command and its reply.
+
+When the outermost call returns, the trace is appended to the trace
+file as one line of JSON:
+
+- totals for the whole trace: commands, bytes_sent, bytes_received
+  and db_us (time waiting for the server)
+- calls: how many times each operation ran, and command_counts: how
+  many of each command went to each collection, which show up N+1
+  patterns and repeated lookups at a glance
+- root: the span tree, where each span has its duration, the part
+  spent in its own commands (db_us) and the part spent in neither
+  commands nor nested spans (self_us)
+
+Commands issued while a lazily consumed result (such as the iterator
+from filter_status_by_string) is read after its call has returned
+belong to no span and are not recorded. A coroutine's span lasts
+until it finishes, and the tasks it starts inherit the span. The
+memory and SQLite backends issue no commands, so their spans have
+times only.
+'''
+
+import contextvars
+import datetime
+import itertools
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+import bson
+from bson.errors import InvalidDocument
+from loguru import logger
+from pymongo import monitoring
+
+import metrics
+
+#
+# Operations that start a trace when called outside one
+#
+ROOT_PREFIX = "main."
+
+#
+# Spans kept in one trace, and commands kept in one span; beyond
+# these, only the trace totals count them
+#
+MAX_SPANS_PER_TRACE = 10000
+MAX_COMMANDS_PER_SPAN = 1000
+
+#
+# The span that commands and nested calls belong to
+#
+current_span = contextvars.ContextVar( "current_span", default=None )
+
+
+class Trace():
+    '''
+    Totals for one top-level call and all that it did
+    '''
+    def __init__( self, trace_id ):
+        self.trace_id = trace_id
+        self.started = datetime.datetime.now( datetime.timezone.utc )
+        self.spans = 0
+        self.dropped_spans = 0
+        self.commands = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.db_ns = 0
+        self.calls = Counter()
+        self.command_counts = Counter()
+
+
+class Span():
+    '''
+    One call of a traced operation
+    '''
+    __slots__ = ( 'name', 'trace', 'start', 'duration', 'error', 'commands',
+                  'children' )
+
+    def __init__( self, name, trace ):
+        self.name = name
+        self.trace = trace
+        self.start = time.perf_counter_ns()
+        self.duration = 0
+        self.error = False
+        self.commands = []
+        self.children = []
+
+    def as_dict( self, origin ):
+        '''
+        The span and its children as dictionaries, with times in
+        microseconds from origin (in perf_counter nanoseconds)
+        '''
+        db_ns = sum( command.get( 'duration_us', 0 )
+                     for command in self.commands ) * 1000
+        children_ns = sum( child.duration for child in self.children )
+        return {
+            'name': self.name,
+            'offset_us': ( self.start - origin ) / 1e3,
+            'duration_us': self.duration / 1e3,
+            'db_us': db_ns / 1e3,
+            'self_us': max( 0, self.duration - db_ns - children_ns ) / 1e3,
+            'error': self.error,
+            'commands': self.commands,
+            'children': [ child.as_dict( origin ) for child in self.children ],
+        }
+
+
+def bson_size( document ):
+    '''
+    Encoded size of a command or reply, or None if it cannot be
+    encoded
+    '''
+    raw = getattr( document, "raw", None )
+    if raw is not None:
+        return len( raw )
+    try:
+        return len( bson.encode( document ) )
+    except ( InvalidDocument, TypeError ):
+        return None
+
+
+class CommandTracer( monitoring.CommandListener ):
+    '''
+    Records each command issued inside a span in that span and its
+    trace; commands issued outside a trace are ignored
+    '''
+    def __init__( self ):
+        self._pending = {}
+
+    def started( self, event ):
+        span = current_span.get()
+        if span is None:
+            return
+        command = event.command
+        collection = command.get( event.command_name )
+        record = {
+            'command': event.command_name,
+            'collection': collection if isinstance( collection, str ) else None,
+            'bytes_sent': bson_size( command ),
+        }
+        trace = span.trace
+        trace.commands += 1
+        trace.bytes_sent += record[ 'bytes_sent' ] or 0
+        counted = f"{event.command_name} {record['collection'] or ''}".rstrip()
+        trace.command_counts[ counted ] += 1
+        if len( span.commands ) < MAX_COMMANDS_PER_SPAN:
+            span.commands.append( record )
+        self._pending[ ( event.connection_id, event.request_id ) ] = ( trace, record )
+
+    def succeeded( self, event ):
+        pending = self._pending.pop( ( event.connection_id, event.request_id ), None )
+        if pending is None:
+            return
+        trace, record = pending
+        record[ 'duration_us' ] = event.duration_micros
+        record[ 'bytes_received' ] = bson_size( event.reply )
+        trace.db_ns += event.duration_micros * 1000
+        trace.bytes_received += record[ 'bytes_received' ] or 0
+
+    def failed( self, event ):
+        pending = self._pending.pop( ( event.connection_id, event.request_id ), None )
+        if pending is None:
+            return
+        trace, record = pending
+        record[ 'duration_us' ] = event.duration_micros
+        record[ 'error' ] = str( event.failure )
+        trace.db_ns += event.duration_micros * 1000
+
+
+#
+# Given to every MongoClient that the backends create
+#
+command_listener = CommandTracer()
+
+
+class Tracer():
+    '''
+    Makes spans for the calls that metrics.timed hands it, and
+    appends each finished trace to a file
+    '''
+    def __init__( self, path ):
+        self.path = path
+        # pylint:disable-next=consider-using-with
+        self._file = open( path, "a", encoding="utf-8" )
+        self._lock = threading.Lock()
+        self._ids = itertools.count( 1 )
+        self.traces = 0
+
+    def call( self, name, function, args, kwargs, record ):
+        '''
+        Run function( *args, **kwargs ) in a span named name, passing
+        its duration and whether it failed to record as well
+        '''
+        opened = self._open( name )
+        if opened is None:
+            return metrics.call_timed( function, args, kwargs, record )
+        error = True
+        try:
+            result = function( *args, **kwargs )
+            error = result is False
+            return result
+        finally:
+            self._close( opened, error, record )
+
+    async def call_async( self, name, function, args, kwargs, record ):
+        '''
+        call, for a coroutine function: the span stays open until the
+        coroutine finishes, so the commands it issues belong to it
+        '''
+        opened = self._open( name )
+        if opened is None:
+            return await metrics.call_timed_async( function, args, kwargs, record )
+        error = True
+        try:
+            result = await function( *args, **kwargs )
+            error = result is False
+            return result
+        finally:
+            self._close( opened, error, record )
+
+    def _open( self, name ):
+        '''
+        Start a span named name and make it the current one. Returns
+        it, its parent and the token to reset current_span with, or
+        None if the call is not traced.
+        '''
+        parent = current_span.get()
+        if parent is None:
+            if not name.startswith( ROOT_PREFIX ):
+                return None
+            trace = Trace( f"{os.getpid()}-{next( self._ids )}" )
+        else:
+            trace = parent.trace
+        span = Span( name, trace )
+        trace.spans += 1
+        trace.calls[ name ] += 1
+        return span, parent, current_span.set( span )
+
+    def _close( self, opened, error, record ):
+        '''
+        Finish a span that _open started, writing the trace if it is
+        the outermost one
+        '''
+        span, parent, token = opened
+        trace = span.trace
+        span.duration = time.perf_counter_ns() - span.start
+        span.error = error
+        record( span.duration, error )
+        current_span.reset( token )
+        if parent is None:
+            self.write( span )
+        elif trace.spans <= MAX_SPANS_PER_TRACE:
+            parent.children.append( span )
+        else:
+            trace.dropped_spans += 1
+
+    def write( self, root ):
+        '''
+        Append the trace of root, a finished top-level span
+        '''
+        trace = root.trace
+        line = json.dumps( {
+            'trace_id': trace.trace_id,
+            'name': root.name,
+            'started': trace.started.isoformat(),
+            'duration_us': root.duration / 1e3,
+            'error': root.error,
+            'spans': trace.spans,
+            'dropped_spans': trace.dropped_spans,
+            'commands': trace.commands,
+            'bytes_sent': trace.bytes_sent,
+            'bytes_received': trace.bytes_received,
+            'db_us': trace.db_ns / 1e3,
+            'calls': dict( trace.calls ),
+            'command_counts': dict( trace.command_counts ),
+            'root': root.as_dict( root.start ),
+        }, default=str )
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write( line + "\n" )
+            self._file.flush()
+            self.traces += 1
+
+    def close( self ):
+        '''
+        Close the trace file
+        '''
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def running():
+    '''
+    Whether tracing is on
+    '''
+    return metrics.tracer is not None
+
+
+def start( path ):
+    '''
+    Start appending a trace of every top-level main call to path,
+    replacing any tracer already running
+    '''
+    stop()
+    metrics.tracer = Tracer( path )
+    logger.info( f"Tracing to {path}" )
+    return metrics.tracer
+
+
+def stop():
+    '''
+    Stop tracing, if on. Returns the number of traces written.
+    '''
+    tracer = metrics.tracer
+    if tracer is None:
+        return 0
+    metrics.tracer = None
+    tracer.close()
+    logger.info( f"Wrote {tracer.traces} traces to {tracer.path}" )
+    return tracer.traces
+
+
+# --- END --- #
@@ -0,0 +1,263 @@
+'''
+In-process trigram index for substring search over status text
+'''
+
+import json
+import struct
+import threading
+import zlib
+from array import array
+from collections import defaultdict
+
+from loguru import logger
+
+#
+# First bytes of a saved index file, including the format version
+#
+FILE_MAGIC = b"TRGM0001"
+
+TRIGRAM_LENGTH = 3
+
+
+def trigrams( text ):
+    '''
+    Returns the set of three-character substrings of text
+    '''
+    return { text[ i:i + TRIGRAM_LENGTH ]
+             for i in range( len( text ) - TRIGRAM_LENGTH + 1 ) }
+
+
+class TrigramIndex():
+    '''
+    Inverted index from every trigram of a status' text to the
+    statuses that contain it.
+
+    A substring query intersects the posting sets for the query's
+    trigrams, smallest first, and then checks only the surviving
+    candidates for the full substring. Matching is case-sensitive and
+    literal, like FILTER_REGEX with a plain string.
+
+    Each status is held as ( status_id, user_id, status_text ), so
+    that matches can be returned without a database round trip.
+    '''
+    def __init__( self ):
+        self._lock = threading.RLock()
+        self._docs = []
+        self._doc_numbers = {}
+        self._user_docs = defaultdict( set )
+        self._postings = defaultdict( set )
+
+    def __len__( self ):
+        return len( self._doc_numbers )
+
+    def __contains__( self, status_id ):
+        return status_id in self._doc_numbers
+
+    def fingerprint( self ):
+        '''
+        Returns ( number of statuses, greatest status_id or None ), to
+        compare with StorageBackend.status_fingerprint. A saved index
+        carries its fingerprint in the statuses it holds.
+        '''
+        with self._lock:
+            return len( self._doc_numbers ), max( self._doc_numbers, default=None )
+
+    def add( self, status_id, user_id, status_text ):
+        '''
+        Index a status, replacing any earlier entry with the same ID
+        '''
+        with self._lock:
+            doc_number = self._doc_numbers.get( status_id )
+            if doc_number is None:
+                doc_number = len( self._docs )
+                self._docs.append( None )
+                self._doc_numbers[ status_id ] = doc_number
+            else:
+                self._unindex( doc_number )
+            self._docs[ doc_number ] = ( status_id, user_id, status_text )
+            self._user_docs[ user_id ].add( doc_number )
+            for gram in trigrams( status_text ):
+                self._postings[ gram ].add( doc_number )
+
+    def update( self, status_id, status_text ):
+        '''
+        Re-index the text of a status that is already indexed.
+        Returns False if the status is not in the index.
+        '''
+        with self._lock:
+            doc_number = self._doc_numbers.get( status_id )
+            if doc_number is None:
+                return False
+            self.add( status_id, self._docs[ doc_number ][ 1 ], status_text )
+            return True
+
+    def _unindex( self, doc_number ):
+        # Caller holds the lock
+        _, user_id, status_text = self._docs[ doc_number ]
+        self._docs[ doc_number ] = None
+        self._user_docs[ user_id ].discard( doc_number )
+        if not self._user_docs[ user_id ]:
+            del self._user_docs[ user_id ]
+        for gram in trigrams( status_text ):
+            postings = self._postings.get( gram )
+            if postings is not None:
+                postings.discard( doc_number )
+                if not postings:
+                    del self._postings[ gram ]
+
+    def _remove( self, status_id ):
+        # Caller holds the lock
+        doc_number = self._doc_numbers.pop( status_id, None )
+        if doc_number is None:
+            return False
+        self._unindex( doc_number )
+        return True
+
+    def remove( self, status_id ):
+        '''
+        Drop a status from the index. Returns False if it was not there.
+        '''
+        with self._lock:
+            return self._remove( status_id )
+
+    def remove_user( self, user_id ):
+        '''
+        Drop every status that belongs to user_id. Returns the number
+        of statuses removed.
+        '''
+        with self._lock:
+            status_ids = [ self._docs[ doc_number ][ 0 ]
+                           for doc_number in self._user_docs.get( user_id, () ) ]
+            for status_id in status_ids:
+                self._remove( status_id )
+            return len( status_ids )
+
+    def search( self, substring, limit=0 ):
+        '''
+        Returns a list of ( status_id, user_id, status_text ) tuples
+        for the statuses whose text contains substring, in the order
+        they were indexed.
+
+        A non-zero limit caps the number returned; the search then
+        stops as soon as it has found that many, so which matches are
+        returned is not defined.
+        '''
+        with self._lock:
+            grams = trigrams( substring )
+            if grams:
+                posting_sets = []
+                for gram in grams:
+                    postings = self._postings.get( gram )
+                    if not postings:
+                        return []
+                    posting_sets.append( postings )
+                posting_sets.sort( key=len )
+                if limit:
+                    #
+                    # Walk the smallest posting set and stop early,
+                    # rather than building the full intersection.
+                    #
+                    others = posting_sets[ 1: ]
+                    candidates = ( doc_number for doc_number in posting_sets[ 0 ]
+                                   if all( doc_number in postings
+                                           for postings in others ) )
+                else:
+                    candidates = set( posting_sets[ 0 ] )
+                    for postings in posting_sets[ 1: ]:
+                        candidates &= postings
+                        if not candidates:
+                            return []
+                    candidates = sorted( candidates )
+            else:
+                #
+                # Too short to have a trigram: every status is a
+                # candidate.
+                #
+                candidates = self._doc_numbers.values()
+
+            matches = []
+            for doc_number in candidates:
+                doc = self._docs[ doc_number ]
+                if substring in doc[ 2 ]:
+                    matches.append( doc )
+                    if limit and len( matches ) >= limit:
+                        break
+            return matches
+
+    def save( self, path ):
+        '''
+        Write the index to path.
+
+        The file holds the statuses as compressed JSON, followed by
+        the posting lists as compressed arrays of 32-bit document
+        numbers, so that loading does not re-tokenise any text.
+        '''
+        logger.debug( "Entering method" )
+        with self._lock:
+            #
+            # Renumber the live statuses so the saved file has no
+            # holes left by removals.
+            #
+            renumber = {}
+            live_docs = []
+            for doc_number, doc in enumerate( self._docs ):
+                if doc is not None:
+                    renumber[ doc_number ] = len( live_docs )
+                    live_docs.append( doc )
+
+            postings_blob = bytearray()
+            for gram, postings in self._postings.items():
+                gram_bytes = gram.encode( "utf-8" )
+                numbers = array( "I", sorted( renumber[ doc_number ]
+                                              for doc_number in postings ) )
+                postings_blob += struct.pack( "<HI", len( gram_bytes ), len( numbers ) )
+                postings_blob += gram_bytes
+                postings_blob += numbers.tobytes()
+
+        docs_blob = zlib.compress( json.dumps( live_docs ).encode( "utf-8" ) )
+        postings_blob = zlib.compress( bytes( postings_blob ) )
+        with open( path, "wb" ) as index_file:
+            index_file.write( FILE_MAGIC )
+            index_file.write(
+                struct.pack( "<QQ", len( docs_blob ), len( postings_blob ) ) )
+            index_file.write( docs_blob )
+            index_file.write( postings_blob )
+        logger.debug( "Saved {} statuses to {}", len( live_docs ), path )
+
+    @classmethod
+    def load( cls, path ):
+        '''
+        Read an index written by save()
+        '''
+        logger.debug( "Entering method" )
+        with open( path, "rb" ) as index_file:
+            if index_file.read( len( FILE_MAGIC ) ) != FILE_MAGIC:
+                raise ValueError( f"{path} is not a trigram index file" )
+            docs_size, postings_size = struct.unpack( "<QQ", index_file.read( 16 ) )
+            docs = json.loads( zlib.decompress( index_file.read( docs_size ) ) )
+            postings_blob = zlib.decompress( index_file.read( postings_size ) )
+
+        index = cls()
+        for doc_number, ( status_id, user_id, status_text ) in enumerate( docs ):
+            index._docs.append( ( status_id, user_id, status_text ) )
+            index._doc_numbers[ status_id ] = doc_number
+            index._user_docs[ user_id ].add( doc_number )
+
+        header = struct.Struct( "<HI" )
+        offset = 0
+        while offset < len( postings_blob ):
+            gram_size, count = header.unpack_from( postings_blob, offset )
+            offset += header.size
+            gram = postings_blob[ offset:offset + gram_size ].decode( "utf-8" )
+            offset += gram_size
+            numbers = array( "I" )
+            end = offset + count * numbers.itemsize
+            numbers.frombytes( postings_blob[ offset:end ] )
+            offset = end
+            index._postings[ gram ] = set( numbers )
+
+        logger.debug( "Loaded {} statuses from {}", len( index ), path )
+        return index
+
+
+# --- END --- #
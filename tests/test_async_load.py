@@ -0,0 +1,99 @@
+'''
+Unit test module for async_load.py
+'''
+
+# pylint: disable=C0305
+
+import asyncio
+import os
+import tempfile
+import unittest
+
+import async_load
+
+
+class Summary():
+    '''
+    Minimal stand-in for main.LoadSummary
+    '''
+    def __init__(self):
+        self.rejected = 0
+        self.malformed = 0
+        self.seconds = 0.0
+        self.rows_per_second = 0.0
+
+
+class TestAsyncLoadPipeline(unittest.TestCase):
+    '''
+    Class definition for unit tests for async_load.py
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint:disable=consider-using-with
+        self.path = os.path.join( self.directory.name, "rows.csv" )
+        with open( self.path, "w", encoding="utf-8" ) as csv_file:
+            csv_file.write( "ID,TEXT\n" )
+            for number in range( 250 ):
+                csv_file.write( f"id{number},text {number}\n" )
+            csv_file.write( "bad,\n" )
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_pipeline(self):
+        written = []
+        in_flight = [ 0, 0 ]
+
+        async def write_batch( batch, summary ):  # pylint:disable=unused-argument
+            in_flight[ 0 ] += 1
+            in_flight[ 1 ] = max( in_flight )
+            await asyncio.sleep( 0.001 )
+            written.extend( row[ "ID" ] for row in batch )
+            in_flight[ 0 ] -= 1
+
+        pipeline = async_load.AsyncLoadPipeline(
+            self.path, write_batch, Summary(), writers=3, batch_size=20,
+            batch_queue_size=2 )
+        summary = asyncio.run( pipeline.run() )
+
+        self.assertEqual( len( written ), 250 )
+        self.assertEqual( ( summary.rejected, summary.malformed ), ( 1, 1 ) )
+        self.assertGreater( summary.rows_per_second, 0 )
+        #
+        # Writers overlapped, and the batch queue stayed within bounds
+        #
+        self.assertGreater( in_flight[ 1 ], 1 )
+        stats = pipeline.stats()
+        self.assertLessEqual( stats[ "queues" ][ "batches" ][ "max_depth" ], 2 )
+        self.assertEqual( stats[ "stages" ][ "parse" ][ "items" ], 251 )
+        self.assertEqual( stats[ "stages" ][ "write" ][ "items" ], 250 )
+
+    def test_writer_failure(self):
+        calls = []
+        unwound = []
+
+        async def write_batch( batch, summary ):  # pylint:disable=unused-argument
+            calls.append( batch )
+            if len( calls ) == 1:
+                await asyncio.sleep( 0.01 )
+                raise RuntimeError( "database went away" )
+            try:
+                await asyncio.sleep( 10 )
+            finally:
+                unwound.append( len( batch ) )
+
+        async def load():
+            pipeline = async_load.AsyncLoadPipeline(
+                self.path, write_batch, Summary(), writers=2, batch_size=10 )
+            with self.assertRaises( RuntimeError ):
+                await pipeline.run()
+            #
+            # The other writer was cancelled and waited for
+            #
+            return list( unwound )
+
+        self.assertEqual( asyncio.run( load() ), [ 10 ] )
+
+
+if __name__ == '__main__':
+    unittest.main()
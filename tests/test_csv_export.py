@@ -0,0 +1,86 @@
+'''
+Unit test module for csv_export.py
+'''
+
+# pylint: disable=C0305
+
+import csv
+import gzip
+import os
+import tempfile
+import unittest
+
+import csv_export
+
+
+USERS = [
+    { "user_id": f"user{i}", "user_name": "Name", "user_last_name": "Last, Jr.",
+      "email": f"user{i}@example.com" }
+    for i in range( 10 )
+]
+
+
+def read_rows( path ):
+    '''
+    Returns the rows of a (possibly gzipped) CSV file
+    '''
+    opener = gzip.open if path.endswith( ".gz" ) else open
+    with opener( path, "rt", newline="", encoding="utf-8" ) as csv_file:
+        return list( csv.reader( csv_file ) )
+
+
+class TestCsvExport(unittest.TestCase):
+    '''
+    Class definition for unit tests for csv_export.py
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint:disable=consider-using-with
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        '''
+        Returns a path in the scratch directory
+        '''
+        return os.path.join( self.directory.name, name )
+
+    def test_write_csv(self):
+        path = self.path( "users.csv" )
+        written = csv_export.write_csv( path, iter( USERS ), csv_export.USER_COLUMNS )
+        self.assertEqual( written, 10 )
+        rows = read_rows( path )
+        self.assertEqual( rows[ 0 ], [ "USER_ID", "NAME", "LASTNAME", "EMAIL" ] )
+        self.assertEqual( rows[ 1 ],
+                          [ "user0", "Name", "Last, Jr.", "user0@example.com" ] )
+
+    def test_gzip_from_suffix(self):
+        path = self.path( "users.csv.gz" )
+        csv_export.write_csv( path, iter( USERS ), csv_export.USER_COLUMNS )
+        self.assertEqual( len( read_rows( path ) ), 11 )
+
+    def test_unknown_compression(self):
+        with self.assertRaises( ValueError ):
+            csv_export.write_csv( self.path( "users.csv" ), iter( USERS ),
+                                  csv_export.USER_COLUMNS, compression="lzma" )
+
+    def test_part_path(self):
+        self.assertEqual( csv_export.part_path( "out/status.csv.gz", 2 ),
+                          os.path.join( "out", "status-002.csv.gz" ) )
+
+    def test_export_parts(self):
+        path = self.path( "users.csv.gz" )
+        report = csv_export.export_csv(
+            path,
+            lambda key_range: iter( USERS[ slice( *key_range ) ] ),
+            csv_export.USER_COLUMNS,
+            key_ranges=[ ( 0, 4 ), ( 4, 8 ), ( 8, 10 ) ]
+        )
+        self.assertEqual( report[ "rows" ], 10 )
+        self.assertEqual( [ len( read_rows( part ) ) for part in report[ "files" ] ],
+                          [ 5, 5, 3 ] )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+'''
+Unit test module for dataset_generator.py
+'''
+
+# pylint: disable=C0305
+
+import csv
+import os
+import tempfile
+import unittest
+from collections import Counter
+
+import dataset_generator
+import main
+from storage_backends import MemoryBackend
+
+
+def read_rows( path ):
+    '''
+    Returns the header and the rows of a CSV file
+    '''
+    with open( path, newline="", encoding="utf-8" ) as csv_file:
+        rows = list( csv.reader( csv_file ) )
+    return rows[ 0 ], rows[ 1: ]
+
+
+class TestDatasetGenerator(unittest.TestCase):
+    '''
+    Class definition for unit tests for dataset_generator.py
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint:disable=consider-using-with
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        '''
+        Returns a path in the scratch directory
+        '''
+        return os.path.join( self.directory.name, name )
+
+    def test_users(self):
+        generated = dataset_generator.write_users( self.path( "users.csv" ), 50 )
+        header, rows = read_rows( generated.path )
+        self.assertEqual( header, [ "USER_ID", "NAME", "LASTNAME", "EMAIL" ] )
+        self.assertEqual( ( generated.rows, generated.valid ), ( 50, 50 ) )
+        self.assertEqual( len( { row[ 0 ] for row in rows } ), 50 )
+        population = dataset_generator.Population( 50 )
+        self.assertEqual( rows[ 7 ][ 0 ], population.user_id( 7 ) )
+
+    def test_same_seed_same_files(self):
+        contents = []
+        for seed in ( 3, 3, 4 ):
+            generated = dataset_generator.write_statuses(
+                self.path( f"statuses_{seed}.csv" ), 200, 20, seed=seed,
+                bad_rate=0.1, duplicate_rate=0.1 )
+            with open( generated.path, encoding="utf-8" ) as csv_file:
+                contents.append( csv_file.read() )
+        self.assertEqual( contents[ 0 ], contents[ 1 ] )
+        self.assertNotEqual( contents[ 0 ], contents[ 2 ] )
+
+    def test_skew_and_text(self):
+        generated = dataset_generator.write_statuses(
+            self.path( "statuses.csv" ), 5000, 500, min_words=2, max_words=4,
+            vocabulary_size=100 )
+        _, rows = read_rows( generated.path )
+        population = dataset_generator.Population( 500 )
+        user_ids = { population.user_id( index ) for index in range( 500 ) }
+        self.assertTrue( all( row[ 1 ] in user_ids for row in rows ) )
+        self.assertTrue( all( 2 <= len( row[ 2 ].split() ) <= 4 for row in rows ) )
+        self.assertLessEqual( len( { word for row in rows for word in row[ 2 ].split() } ), 100 )
+        per_user = Counter( row[ 1 ] for row in rows ).most_common()
+        #
+        # Zipfian: the busiest user has far more than the average of 10
+        #
+        self.assertGreater( per_user[ 0 ][ 1 ], 100 )
+
+    def test_bad_and_duplicate_rows(self):
+        users, statuses = dataset_generator.write_dataset(
+            self.directory.name, 100, 1000, bad_rate=0.05, duplicate_rate=0.05 )
+        self.assertEqual( ( users.valid, statuses.valid ), ( 100, 1000 ) )
+        self.assertGreater( statuses.bad, 0 )
+        self.assertGreater( statuses.duplicates, 0 )
+        _, rows = read_rows( statuses.path )
+        self.assertEqual( len( rows ), statuses.rows )
+
+        backend = MemoryBackend()
+        summary = main.load_users_bulk( users.path, main.init_user_collection( backend ) )
+        self.assertEqual( ( summary.inserted, summary.duplicates, summary.rejected ),
+                          ( 100, users.duplicates, users.bad ) )
+        summary = main.load_status_updates_bulk(
+            statuses.path, main.init_status_collection( backend ) )
+        self.assertEqual( summary.inserted, 1000 )
+        self.assertEqual( summary.duplicates, statuses.duplicates )
+        self.assertEqual( summary.rejected + summary.unknown_user, statuses.bad )
+
+    def test_rates_checked(self):
+        with self.assertRaises( ValueError ):
+            dataset_generator.write_users( self.path( "users.csv" ), 10,
+                                           bad_rate=0.5, duplicate_rate=0.5 )
+
+
+if __name__ == '__main__':
+    unittest.main()
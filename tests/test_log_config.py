@@ -0,0 +1,71 @@
+'''
+Unit test module for log_config.py
+'''
+
+# pylint: disable=C0305
+
+import os
+import tempfile
+import unittest
+
+from loguru import logger
+
+import log_config
+
+
+def record( module, level ):
+    '''
+    Returns the parts of a loguru record that LevelFilter reads
+    '''
+    return { "name": module, "level": logger.level( level ) }
+
+
+class TestLogConfig(unittest.TestCase):
+    '''
+    Class definition for unit tests for log_config.py
+    '''
+
+    def tearDown(self):
+        log_config.configure()
+
+    def test_parse_module_levels(self):
+        self.assertEqual(
+            log_config.parse_module_levels( "main=debug, socialnetwork_model=WARNING," ),
+            { "main": "DEBUG", "socialnetwork_model": "WARNING" } )
+        self.assertEqual( log_config.parse_module_levels( "" ), {} )
+
+    def test_module_levels(self):
+        level_filter = log_config.LevelFilter(
+            "INFO", { "main": "DEBUG", "storage": "ERROR" } )
+        self.assertEqual( level_filter.min_level(), logger.level( "DEBUG" ).no )
+        self.assertTrue( level_filter( record( "main", "DEBUG" ) ) )
+        self.assertFalse( level_filter( record( "socialnetwork_model", "DEBUG" ) ) )
+        self.assertTrue( level_filter( record( "socialnetwork_model", "INFO" ) ) )
+        #
+        # Submodules inherit their package's level
+        #
+        self.assertFalse( level_filter( record( "storage.mongo", "WARNING" ) ) )
+        self.assertTrue( level_filter( record( "storage.mongo", "ERROR" ) ) )
+
+    def test_debug_sample(self):
+        level_filter = log_config.LevelFilter( "DEBUG", {}, debug_sample=0.0 )
+        self.assertFalse( level_filter( record( "main", "DEBUG" ) ) )
+        self.assertTrue( level_filter( record( "main", "INFO" ) ) )
+
+    def test_configure(self):
+        with tempfile.TemporaryDirectory() as directory:
+            log_file = os.path.join( directory, "sn.log" )
+            log_config.configure( level="WARNING", log_file=log_file, stderr=False )
+            logger.debug( "Param: user_id: {}", "dropped" )
+            logger.warning( "Param: user_id: {}", "kept" )
+            logger.complete()
+            log_config.configure( log_file="", stderr=False )
+            with open( log_file, encoding="utf-8" ) as log:
+                lines = log.readlines()
+        self.assertEqual( len( lines ), 1 )
+        self.assertTrue( lines[ 0 ].rstrip().endswith( "Param: user_id: kept" ) )
+        self.assertTrue( log_config.configured )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,7 +7,11 @@ Unit test module for functions in main.py
 
 from collections.abc import Iterable
 
+import asyncio
+import os
+import tempfile
 import unittest
+from unittest import mock
 
 import socialnetwork_model as sn
 
@@ -60,6 +64,85 @@ class TestMain(unittest.TestCase):
             True
         )
 
+    def test_load_users_bulk(self):
+        '''
+        Test bulk loading users from a CSV into the collection
+        '''
+        user_col = main.init_user_collection()
+        summary = main.load_users_bulk( "accounts.csv", user_col, batch_size=128 )
+        self.assertIsInstance( summary, main.LoadSummary )
+        self.assertEqual( summary.total, 1000 )
+        self.assertEqual( summary.rejected, 0 )
+        self.assertIsNone( summary.stats )
+        self.assertTrue( sn.UserCache.of().read( "Keri.Royce8" ) )
+        #
+        # Everything is already there the second time around
+        #
+        sn.UserCache.of().reset()
+        summary = main.load_users_bulk( "accounts.csv", user_col, batch_size=128 )
+        self.assertEqual( summary.inserted, 0 )
+        self.assertEqual( summary.duplicates, 1000 )
+        #
+        # Users found to be there already are cached too
+        #
+        self.assertTrue( sn.UserCache.of().read( "Keri.Royce8" ) )
+
+    def test_load_status_updates_bulk(self):
+        '''
+        Test loading statuses from a CSV in small chunks
+        '''
+        user_col = main.init_user_collection()
+        main.load_users_bulk( "accounts.csv", user_col )
+        status_col = main.init_status_collection()
+        summary = main.load_status_updates_bulk(
+            "status_updates_reasonable.csv",
+            status_col,
+            batch_size=16,
+            flush_interval=0.5
+        )
+        self.assertIsInstance( summary, main.LoadSummary )
+        self.assertEqual( summary.total, 200 )
+        self.assertEqual( summary.rejected, 0 )
+        self.assertIsInstance(
+            status_col.search_status( "Isabel.Avivah34_27" ),
+            sn.StatusTable
+        )
+        #
+        # A second load finds every status already present
+        #
+        summary = main.load_status_updates_bulk(
+            "status_updates_reasonable.csv",
+            status_col,
+            batch_size=16
+        )
+        self.assertEqual( summary.inserted, 0 )
+        self.assertEqual( summary.malformed, 0 )
+
+    def test_load_status_updates_skipped(self):
+        '''
+        Test that skipped statuses do not make the load fail, as long
+        as no row is malformed
+        '''
+        user_col = main.init_user_collection()
+        main.load_users_bulk( "accounts.csv", user_col )
+        status_col = main.init_status_collection()
+        self.assertIs(
+            main.load_status_updates( "status_updates_reasonable.csv", status_col ), True )
+        #
+        # Every status is a duplicate the second time around
+        #
+        self.assertIs(
+            main.load_status_updates( "status_updates_reasonable.csv", status_col ), True )
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join( directory, "statuses.csv" )
+            with open( path, "w", encoding="utf-8" ) as status_file:
+                status_file.write( "STATUS_ID,USER_ID,STATUS_TEXT\n"
+                                   "nobody_1,nobody,Unknown user\n" )
+            self.assertIs( main.load_status_updates( path, status_col ), True )
+            with open( path, "a", encoding="utf-8" ) as status_file:
+                status_file.write( "nobody_2,,Missing user\n" )
+            self.assertIs( main.load_status_updates( path, status_col ), False )
+
     def test_save_users(self):
         '''
         Test saving users from the collection to a CSV
@@ -68,6 +151,129 @@ class TestMain(unittest.TestCase):
         main.load_users( "accounts.csv", user_col )
         self.assertIs( main.save_users( "accounts-new.csv", user_col), True )
 
+    def test_save_users_round_trip(self):
+        '''
+        Test that exported users and statuses load back in, including
+        from part files
+        '''
+        with tempfile.TemporaryDirectory() as directory:
+            user_col = main.init_user_collection( sn.MemoryBackend() )
+            status_col = main.init_status_collection( user_col.backend )
+            main.load_users_bulk( "accounts.csv", user_col )
+            main.load_status_updates_bulk( "status_updates_reasonable.csv", status_col )
+
+            users_file = os.path.join( directory, "accounts.csv" )
+            self.assertTrue( main.save_users( users_file, user_col,
+                                              batch_size=100, parts=3 ) )
+            status_file = os.path.join( directory, "status_updates.csv" )
+            self.assertTrue( main.save_status_updates( status_file, status_col ) )
+
+            copy_col = main.init_user_collection( sn.MemoryBackend() )
+            loaded = sum( main.load_users_bulk( os.path.join( directory, part ),
+                                                copy_col ).inserted
+                          for part in sorted( os.listdir( directory ) )
+                          if part.startswith( "accounts-" ) )
+            self.assertEqual( loaded, 1000 )
+            with open( status_file, encoding="utf-8" ) as exported, \
+                    open( "status_updates_reasonable.csv", encoding="utf-8" ) as original:
+                self.assertEqual( len( exported.readlines() ), len( original.readlines() ) )
+
+        self.assertFalse( main.save_users( os.path.join( directory, "gone", "x.csv" ),
+                                           user_col ) )
+
+    def test_enable_trigram_index(self):
+        '''
+        Test that a saved trigram index is only used while it matches
+        the database
+        '''
+        backend = sn.MemoryBackend()
+        backend.insert_users( [ sn.UsersTable.as_dict( user_id="trgm", email="t@example.com",
+                                                       user_name="Tri", user_last_name="Gram" ) ] )
+        backend.insert_statuses( [ sn.StatusTable.as_dict( status_id="trgm_1", user_id="trgm",
+                                                           status_text="First post" ) ] )
+        status_col = main.init_status_collection( backend )
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join( directory, "status.idx" )
+                self.assertTrue( main.enable_trigram_index( status_col, path ) )
+                self.assertTrue( main.save_trigram_index( status_col, path ) )
+                with mock.patch.object( status_col, "build_trigram_index" ) as build:
+                    self.assertTrue( main.enable_trigram_index( status_col, path ) )
+                    build.assert_not_called()
+                #
+                # Written behind the index's back, as by another process
+                #
+                backend.insert_statuses( [ sn.StatusTable.as_dict(
+                    status_id="trgm_2", user_id="trgm", status_text="Second post" ) ] )
+                self.assertTrue( main.enable_trigram_index( status_col, path ) )
+                self.assertIn( "trgm_2", status_col.trigram_index )
+        finally:
+            status_col.enable_trigram_index( None )
+
+    def test_load_parallel(self):
+        '''
+        Test loading users and statuses with several processes
+        '''
+        with tempfile.TemporaryDirectory() as directory:
+            backend = sn.SQLiteBackend( os.path.join( directory, "sn.db" ) )
+            user_col = main.init_user_collection( backend )
+            status_col = main.init_status_collection( backend )
+            #
+            # A complete (empty) user cache, which the load must add to
+            #
+            main.warm_user_cache( user_collection=user_col )
+
+            summary = main.load_users_parallel( "accounts.csv", user_col,
+                                                workers=3, chunk_size=4096 )
+            self.assertEqual( summary.inserted, 1000 )
+            self.assertGreater( summary.rows_per_second, 0 )
+            self.assertTrue( sn.UserCache.of( backend ).complete )
+            self.assertTrue( main.add_status( "Keri.Royce8", "Keri.Royce8_parallel",
+                                              "Loaded elsewhere", status_col ) )
+
+            sn.StatusCache.configure( 8 )
+            status_col.enable_trigram_index( status_col.build_trigram_index() )
+            try:
+                self.assertIsNone( status_col.search_status( "Isabel.Avivah34_27" ) )
+                summary = main.load_status_updates_parallel(
+                    "status_updates_reasonable.csv", status_col, workers=2, chunk_size=2048 )
+                self.assertEqual( summary.inserted, 200 )
+                self.assertIsNotNone( status_col.search_status( "Isabel.Avivah34_27" ) )
+                self.assertIn( "Isabel.Avivah34_27", status_col.trigram_index )
+            finally:
+                sn.StatusCache.configure( 0 )
+                status_col.enable_trigram_index( None )
+            summary = main.load_status_updates_parallel(
+                "status_updates_reasonable.csv", status_col, workers=2, chunk_size=2048 )
+            self.assertEqual( ( summary.inserted, summary.duplicates ), ( 0, 200 ) )
+            backend.close()
+
+        #
+        # Every process would have its own copy of an in-memory backend
+        #
+        self.assertIsNone( main.load_users_parallel(
+            "accounts.csv", main.init_user_collection( sn.MemoryBackend() ) ) )
+
+    def test_load_status_updates_async(self):
+        '''
+        Test loading statuses through the asyncio pipeline
+        '''
+        user_col = main.init_user_collection( sn.MemoryBackend() )
+        status_col = main.init_status_collection( user_col.backend )
+        main.load_users_bulk( "accounts.csv", user_col )
+
+        progress = []
+        summary = asyncio.run( main.load_status_updates_async(
+            "status_updates_reasonable.csv", status_col, writers=3, batch_size=16,
+            report_interval=0.001, on_progress=progress.append ) )
+        self.assertEqual( summary.inserted, 200 )
+        self.assertIn( "batches", summary.stats[ "queues" ] )
+        self.assertEqual( summary.stats[ "stages" ][ "write" ][ "items" ], 200 )
+
+        summary = asyncio.run( main.load_status_updates_async(
+            "status_updates_reasonable.csv", status_col ) )
+        self.assertEqual( ( summary.inserted, summary.duplicates ), ( 0, 200 ) )
+
     def test_load_bad_users(self):
         '''
         Test how we handle loading a malformed CSV of users
@@ -0,0 +1,171 @@
+'''
+Unit test module for metrics.py
+'''
+
+# pylint: disable=C0305
+
+import asyncio
+import inspect
+import json
+import os
+import tempfile
+import unittest
+import urllib.request
+
+import main
+import metrics
+import socialnetwork_model as sn
+from storage_backends import MemoryBackend
+
+
+@metrics.instrument( "Sample" )
+class Sample():
+    '''
+    A class to instrument
+    '''
+    def work( self, result ):
+        '''
+        Returns result
+        '''
+        return result
+
+    def fail( self ):
+        '''
+        Raises ValueError
+        '''
+        raise ValueError( "failed" )
+
+    @classmethod
+    def build( cls ):
+        '''
+        Returns a new Sample
+        '''
+        return cls()
+
+    def each( self ):
+        '''
+        A generator, which is left alone
+        '''
+        yield 1
+
+    async def wait( self, seconds, result=True ):
+        '''
+        Returns result after sleeping for seconds
+        '''
+        await asyncio.sleep( seconds )
+        if result is None:
+            raise ValueError( "failed" )
+        return result
+
+    def _private( self ):
+        return 1
+
+
+class TestMetrics(unittest.TestCase):
+    '''
+    Class definition for unit tests for metrics.py
+    '''
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_buckets(self):
+        previous = 0
+        for index in range( metrics.BUCKET_COUNT ):
+            lowest, highest = metrics.bucket_bounds( index )
+            self.assertEqual( lowest, previous )
+            previous = highest
+        for nanoseconds in ( 0, 1, 63, 64, 65, 1000, 123456789 ):
+            lowest, highest = metrics.bucket_bounds( metrics.bucket_index( nanoseconds ) )
+            self.assertTrue( lowest <= nanoseconds < highest )
+            #
+            # Within about 3% of the value
+            #
+            self.assertLessEqual( highest - lowest, max( 1, nanoseconds / 32 ) )
+        self.assertEqual( metrics.bucket_index( 2 ** 50 ), metrics.BUCKET_COUNT - 1 )
+
+    def test_percentiles(self):
+        stats = metrics.OperationStats( "test" )
+        for nanoseconds in range( 1, 1001 ):
+            stats.record( nanoseconds * 1000 )
+        self.assertAlmostEqual( stats.value_at( 50 ), 500000, delta=500000 / 32 )
+        self.assertAlmostEqual( stats.value_at( 99 ), 990000, delta=990000 / 32 )
+        self.assertEqual( stats.value_at( 100 ), 1000000 )
+        snapshot = stats.snapshot()
+        self.assertEqual( snapshot[ "calls" ], 1000 )
+        self.assertEqual( sum( count for _, count in snapshot[ "buckets" ] ), 1000 )
+        self.assertAlmostEqual( snapshot[ "mean_us" ], 500.5 )
+
+    def test_instrument(self):
+        sample = Sample.build()
+        self.assertEqual( sample.work( 3 ), 3 )
+        self.assertFalse( sample.work( False ) )
+        with self.assertRaises( ValueError ):
+            sample.fail()
+        self.assertEqual( list( sample.each() ), [ 1 ] )
+        self.assertEqual( Sample.work.__name__, "work" )
+        operations = metrics.snapshot()[ "operations" ]
+        self.assertEqual( sorted( operations ), [ "Sample.build", "Sample.fail", "Sample.work" ] )
+        self.assertEqual( ( operations[ "Sample.work" ][ "calls" ],
+                            operations[ "Sample.work" ][ "errors" ] ), ( 2, 1 ) )
+        self.assertEqual( operations[ "Sample.fail" ][ "errors" ], 1 )
+        metrics.reset()
+        self.assertEqual( metrics.snapshot()[ "operations" ], {} )
+
+    def test_instrument_async(self):
+        sample = Sample()
+        self.assertTrue( inspect.iscoroutinefunction( Sample.wait ) )
+        self.assertTrue( asyncio.run( sample.wait( 0.05 ) ) )
+        self.assertFalse( asyncio.run( sample.wait( 0, False ) ) )
+        with self.assertRaises( ValueError ):
+            asyncio.run( sample.wait( 0, None ) )
+        operations = metrics.snapshot()[ "operations" ]
+        self.assertEqual( ( operations[ "Sample.wait" ][ "calls" ],
+                            operations[ "Sample.wait" ][ "errors" ] ), ( 3, 2 ) )
+        #
+        # The time spent awaiting is counted
+        #
+        self.assertGreaterEqual( operations[ "Sample.wait" ][ "max_us" ], 45000 )
+        self.assertTrue( inspect.iscoroutinefunction( main.load_status_updates_async ) )
+        self.assertTrue(
+            inspect.iscoroutinefunction( sn.UserStatusCollection.insert_statuses_async ) )
+
+    def test_collections(self):
+        users = sn.UserCollection( MemoryBackend() )
+        users.add_user( "metric_1", "m@example.com", "Met", "Ric" )
+        users.add_user( "metric_1", "m@example.com", "Met", "Ric" )
+        users.search_user( "metric_1" )
+        operations = metrics.snapshot()[ "operations" ]
+        self.assertEqual( ( operations[ "UserCollection.add_user" ][ "calls" ],
+                            operations[ "UserCollection.add_user" ][ "errors" ] ), ( 2, 1 ) )
+        self.assertEqual( operations[ "UserCollection.search_user" ][ "calls" ], 1 )
+
+    def test_dump(self):
+        Sample().work( 1 )
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join( directory, "metrics.json" )
+            metrics.dump( path, reset_after=True )
+            with open( path, encoding="utf-8" ) as metrics_file:
+                dumped = json.load( metrics_file )
+        self.assertEqual( dumped[ "operations" ][ "Sample.work" ][ "calls" ], 1 )
+        self.assertEqual( metrics.snapshot()[ "operations" ], {} )
+
+    def test_serve(self):
+        Sample().work( 1 )
+        server = metrics.serve( port=0 )
+        try:
+            url = f"http://127.0.0.1:{server.server_address[ 1 ]}/metrics"
+            with urllib.request.urlopen( url, timeout=5 ) as response:
+                served = json.load( response )
+            self.assertEqual( served[ "operations" ][ "Sample.work" ][ "calls" ], 1 )
+            request = urllib.request.Request( url + "/reset", method="POST" )
+            with urllib.request.urlopen( request, timeout=5 ) as response:
+                self.assertIn( "Sample.work", json.load( response )[ "operations" ] )
+            self.assertEqual( metrics.snapshot()[ "operations" ], {} )
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
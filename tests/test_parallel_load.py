@@ -0,0 +1,51 @@
+'''
+Unit test module for parallel_load.py
+'''
+
+# pylint: disable=C0305
+
+import os
+import tempfile
+import unittest
+
+import parallel_load
+
+
+class TestParallelLoad(unittest.TestCase):
+    '''
+    Class definition for unit tests for parallel_load.py
+    '''
+
+    def test_byte_ranges(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join( directory, "rows.csv" )
+            with open( path, "w", encoding="utf-8" ) as csv_file:
+                csv_file.write( "ID,TEXT\n" )
+                for number in range( 100 ):
+                    csv_file.write( f"id{number},text for row {number}\n" )
+
+            header, ranges = parallel_load.byte_ranges( path, chunk_size=100 )
+            self.assertEqual( header, "ID,TEXT\n" )
+            self.assertGreater( len( ranges ), 1 )
+            #
+            # The ranges cover the file without gaps, on line boundaries
+            #
+            self.assertEqual( ranges[ -1 ][ 1 ], os.path.getsize( path ) )
+            lines = []
+            for number, ( start, end ) in enumerate( ranges ):
+                if number:
+                    self.assertEqual( start, ranges[ number - 1 ][ 1 ] )
+                lines.extend( parallel_load.read_range( path, start, end ) )
+            self.assertEqual( len( lines ), 100 )
+            self.assertTrue( all( line.startswith( "id" ) for line in lines ) )
+
+    def test_partition_of(self):
+        partitions = { parallel_load.partition_of( f"key{number}", 4 )
+                       for number in range( 100 ) }
+        self.assertEqual( partitions, { 0, 1, 2, 3 } )
+        self.assertEqual( parallel_load.partition_of( "key1", 4 ),
+                          parallel_load.partition_of( "key1", 4 ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,7 +6,10 @@ Unit test module for functions in main.py
 # pylint: disable=R0904
 
 
+import threading
+import time
 import unittest
+from unittest import mock
 
 import socialnetwork_model as sn
 
@@ -37,11 +40,150 @@ class TestSN(unittest.TestCase):
         )
 
     def test_user_cache( self ):
-        sn.UserCache().store( "cajopa" )
-        self.assertTrue( sn.UserCache().read( "cajopa" ) )
+        sn.UserCache.of().store( "cajopa" )
+        self.assertTrue( sn.UserCache.of().read( "cajopa" ) )
 
-        sn.UserCache().erase( "cajopa" )
-        self.assertFalse( sn.UserCache().read( "cajopa" ) )
+        sn.UserCache.of().erase( "cajopa" )
+        self.assertFalse( sn.UserCache.of().read( "cajopa" ) )
+
+    def test_shared_client( self ):
+        with sn.mongo:
+            first_client = sn.mongo.connection
+        with sn.mongo:
+            second_client = sn.mongo.connection
+        self.assertIs( first_client, second_client )
+
+        stats = sn.mongo.pool_stats()
+        self.assertEqual( stats[ "max_pool_size" ], sn.mongo.max_pool_size )
+        self.assertIn( "in_use", stats )
+        self.assertIn( "utilisation", stats )
+
+    def test_ensure_indexes( self ):
+        self.assertTrue( sn.IndexManager.ensure( force=True ) )
+        self.assertTrue( sn.IndexManager.ensure() )
+        with sn.mongo:
+            d_b = sn.mongo.connection.media
+            self.assertIn( "user_id_unique", d_b[ "users" ].index_information() )
+            self.assertIn( "status_id_unique", d_b[ "status" ].index_information() )
+            self.assertIn( "status_user_id", d_b[ "status" ].index_information() )
+
+    def test_add_status_duplicate( self ):
+        sn.IndexManager.ensure()
+        self.user_col.add_user( "dupdup", "dupdup@uw.edu", "Dup", "Dup" )
+        self.assertTrue( self.status_col.add_status( "dupdup", "dupdup_0001", "once" ) )
+        self.assertFalse( self.status_col.add_status( "dupdup", "dupdup_0001", "twice" ) )
+
+    def test_records( self ):
+        status = sn.StatusTable.from_document(
+            { "_id": 1, "status_id": "rec_1", "user_id": "rec", "status_text": "Compact" } )
+        self.assertEqual( ( status.status_id, status.user_id, status.status_text ),
+                          ( "rec_1", "rec", "Compact" ) )
+        user = sn.UsersTable.from_document(
+            sn.UsersTable.as_dict( "rec", "Rec", "Ord", "rec@uw.edu" ) )
+        self.assertEqual( user.email, "rec@uw.edu" )
+        self.assertFalse( hasattr( user, "__dict__" ) )
+        with self.assertRaises( AttributeError ):
+            status.extra = 1
+
+    def test_bounded_cache_lru( self ):
+        cache = sn.BoundedCache( 2 )
+        cache.put( "a", True )
+        cache.put( "b", True )
+        cache.get( "a" )
+        cache.put( "c", True )
+        self.assertIsNone( cache.get( "b" ) )
+        self.assertTrue( cache.get( "a" ) )
+        self.assertTrue( cache.get( "c" ) )
+        stats = cache.stats()
+        self.assertEqual( stats[ "evictions" ], 1 )
+        self.assertEqual( stats[ "misses" ], 1 )
+        self.assertEqual( stats[ "size" ], 2 )
+
+    def test_bounded_cache_ttl( self ):
+        cache = sn.BoundedCache( 10, ttl=0.01, negative_ttl=60 )
+        cache.put( "a", True )
+        cache.put( "gone", sn.BoundedCache.ABSENT )
+        time.sleep( 0.02 )
+        self.assertIsNone( cache.get( "a" ) )
+        self.assertIs( cache.get( "gone" ), sn.BoundedCache.ABSENT )
+        self.assertEqual( cache.stats()[ "expirations" ], 1 )
+        self.assertEqual( cache.stats()[ "negative_hits" ], 1 )
+
+    def test_bounded_cache_threads( self ):
+        cache = sn.BoundedCache( 100 )
+
+        def hammer( prefix ):
+            for i in range( 1000 ):
+                cache.put( f"{prefix}{i}", True )
+                cache.get( f"{prefix}{i // 2}" )
+
+        threads = [ threading.Thread( target=hammer, args=( str( n ), ) )
+                    for n in range( 4 ) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual( len( cache ), 100 )
+        self.assertEqual( cache.stats()[ "evictions" ], 3900 )
+
+    def test_user_cache_negative( self ):
+        self.user_col.add_user( "ghosted", "ghosted@uw.edu", "Ghost", "Ed" )
+        self.assertTrue( self.user_col.delete_user( "ghosted" ) )
+        self.assertFalse( sn.UserCache.of().read( "ghosted" ) )
+        present, absent = sn.UserCache.of().lookup_many( [ "ghosted" ] )
+        self.assertIn( "ghosted", absent )
+        self.assertFalse( sn.confirm_users( [ "ghosted" ] ) )
+
+    def test_status_cache( self ):
+        sn.StatusCache.configure( 8 )
+        try:
+            self.user_col.add_user( "cachey", "cachey@uw.edu", "Cache", "Y" )
+            self.assertIsNone( self.status_col.search_status( "cachey_0001" ) )
+            self.assertTrue( self.status_col.add_status( "cachey", "cachey_0001", "first" ) )
+            self.assertEqual( self.status_col.search_status( "cachey_0001" ).status_text, "first" )
+            self.assertEqual( self.status_col.search_status( "cachey_0001" ).status_text, "first" )
+
+            self.assertTrue( self.status_col.modify_status( "cachey_0001", "cachey", "second" ) )
+            self.assertEqual( self.status_col.search_status( "cachey_0001" ).status_text, "second" )
+
+            self.assertTrue( sn.UserStatusCollection().delete_status( "cachey_0001" ) )
+            self.assertIsNone( self.status_col.search_status( "cachey_0001" ) )
+
+            stats = sn.StatusCache.of().stats()
+            self.assertGreater( stats[ "hits" ], 0 )
+            self.assertLessEqual( stats[ "size" ], 8 )
+        finally:
+            sn.StatusCache.configure( 0 )
+        self.assertIsNone( sn.StatusCache.of().stats() )
+
+    def test_warm_user_cache( self ):
+        with sn.mongo:
+            d_b = sn.mongo.connection.media
+            d_b[ "users" ].insert_one(
+                sn.UsersTable.as_dict( "coldstart", "Cold", "Start", "cold@uw.edu" ) )
+        sn.UserCache.of().erase( "coldstart" )
+        self.assertFalse( sn.UserCache.of().read( "coldstart" ) )
+
+        report = sn.UserCache.of().warm( batch_size=2 )
+        self.assertTrue( sn.UserCache.of().read( "coldstart" ) )
+        self.assertGreaterEqual( report[ "entries" ], 1 )
+        self.assertIn( "seconds", report )
+
+        sn.UserCache.of().erase( "coldstart" )
+        warm_thread = sn.UserCache.of().warm_in_background()
+        warm_thread.join()
+        self.assertTrue( sn.UserCache.of().read( "coldstart" ) )
+
+    def test_add_status_cold_cache( self ):
+        self.user_col.add_user( "notcached", "notcached@uw.edu", "Not", "Cached" )
+        sn.UserCache.of().erase( "notcached" )
+        complete = sn.UserCache.of().complete
+        sn.UserCache.of().complete = False
+        try:
+            self.assertTrue(
+                self.status_col.add_status( "notcached", "notcached_0001", "still here" ) )
+        finally:
+            sn.UserCache.of().complete = complete
 
     def test_add_user(self):
         new_user = self.user_col.add_user( "cajopa", "cajopa@uw.edu", "Carl", "Parker" )
@@ -122,6 +264,77 @@ class TestSN(unittest.TestCase):
         status = self.status_col.search_status( "rogerd_0009" )
         self.assertIsNone( status )
 
+    def test_tombstone_filters(self):
+        backend = sn.MongoBackend( database="tombstone_test" )
+        backend.connection.connection.drop_database( "tombstone_test" )
+        try:
+            backend.insert_users( [
+                sn.UsersTable.as_dict( user_id=user_id, email=f"{user_id}@uw.edu",
+                                       user_name="Tomb", user_last_name="Stone" )
+                for user_id in ( "tombed", "living" ) ] )
+            backend.insert_statuses( [
+                sn.StatusTable.as_dict( status_id=f"{user_id}_1", user_id=user_id,
+                                        status_text="Still here" )
+                for user_id in ( "tombed", "living" ) ] )
+            self.assertEqual( backend.tombstone_user( "tombed" ), 1 )
+            #
+            # As if the user's document had not been deleted yet
+            #
+            backend.insert_user( sn.UsersTable.as_dict(
+                user_id="tombed", email="tombed@uw.edu", user_name="Tomb",
+                user_last_name="Stone" ) )
+            self.assertEqual( backend.update_user( "tombed", { 'email': "x@uw.edu" } ), 0 )
+            #
+            # Updates do not read the tombstones again once read
+            #
+            with mock.patch.object( backend, "tombstoned_user_ids",
+                                    side_effect=AssertionError ):
+                self.assertEqual(
+                    backend.update_status( "tombed_1", { 'status_text': "x" } ), 0 )
+                self.assertEqual(
+                    backend.update_status( "living_1", { 'status_text': "x" } ), 1 )
+                self.assertEqual(
+                    backend.update_user( "living", { 'email': "x@uw.edu" } ), 1 )
+            self.assertEqual( backend.reap_statuses( "living", 10 ), 0 )
+            #
+            # Too many tombstones to list: statuses are joined with them
+            #
+            with mock.patch( "storage_backends.MAX_LISTED_TOMBSTONES", 0 ):
+                self.assertEqual( [ status[ "status_id" ] for status in
+                                    backend.iter_statuses( 10 ) ], [ "living_1" ] )
+                self.assertEqual( [ status[ "status_id" ] for status in
+                                    backend.find_statuses( [ "tombed_1", "living_1" ] ) ],
+                                  [ "living_1" ] )
+                self.assertEqual( backend.status_fingerprint(), ( 1, "living_1" ) )
+                self.assertEqual(
+                    backend.update_status( "tombed_1", { 'status_text': "y" } ), 0 )
+                self.assertEqual(
+                    backend.update_status( "living_1", { 'status_text': "y" } ), 1 )
+                self.assertEqual(
+                    backend.update_status( "missing_1", { 'status_text': "y" } ), 0 )
+            self.assertEqual( backend.find_status( "living_1" )[ "status_text" ], "y" )
+        finally:
+            backend.connection.connection.drop_database( "tombstone_test" )
+
+    def test_key_ranges(self):
+        backend = sn.MongoBackend( database="key_range_test" )
+        backend.connection.connection.drop_database( "key_range_test" )
+        try:
+            self.assertEqual( backend.key_ranges( "users", 4 ), [ ( None, None ) ] )
+            backend.insert_users( [
+                sn.UsersTable.as_dict( user_id=f"ranged_{number:02}", email="r@uw.edu",
+                                       user_name="Ran", user_last_name="Ged" )
+                for number in range( 10 ) ] )
+            ranges = backend.key_ranges( "users", 3 )
+            self.assertEqual( len( ranges ), 3 )
+            parts = [ [ user[ "user_id" ] for user in backend.iter_users( 4, key_range ) ]
+                      for key_range in ranges ]
+            self.assertEqual( [ len( part ) for part in parts ], [ 3, 3, 4 ] )
+            self.assertEqual( sorted( sum( parts, [] ) ),
+                              [ f"ranged_{number:02}" for number in range( 10 ) ] )
+        finally:
+            backend.connection.connection.drop_database( "key_range_test" )
+
     def test_search_all_status_updates(self):
         self.user_col.add_user( "maddrox", "maddrox@uw.edu", "Bart", "Muller" )
         new_status = self.status_col.add_status( "maddrox", "maddrox_0008", "Netflix ads as well" )
@@ -131,6 +344,39 @@ class TestSN(unittest.TestCase):
         status_list = self.status_col.search_all_status_updates( "maddrox" )
         self.assertIsInstance( status_list, list )
 
+    def test_batch_crud(self):
+        results = self.user_col.add_users( [
+            sn.UsersTable.as_dict( user_id=user_id, email=f"{user_id}@uw.edu",
+                                   user_name="Bat", user_last_name="Ch" )
+            for user_id in ( "batch_1", "batch_2" ) ] )
+        self.assertEqual( results, { "batch_1": True, "batch_2": True } )
+        found = self.user_col.search_users( [ "batch_1", "batch_none" ] )
+        self.assertEqual( found[ "batch_1" ].email, "batch_1@uw.edu" )
+        self.assertIsNone( found[ "batch_none" ] )
+        self.status_col.add_status( "batch_1", "batch_1_1", "First" )
+        self.status_col.add_status( "batch_2", "batch_2_1", "Second" )
+        found = self.status_col.search_statuses( [ "batch_1_1", "batch_2_1" ] )
+        self.assertEqual( found[ "batch_2_1" ].status_text, "Second" )
+        self.assertEqual( self.status_col.delete_statuses( [ "batch_1_1", "batch_none_1" ] ),
+                          { "batch_1_1": True, "batch_none_1": False } )
+        self.assertEqual( self.user_col.delete_users( [ "batch_1", "batch_2" ] ),
+                          { "batch_1": True, "batch_2": True } )
+        self.assertIsNone( self.status_col.search_status( "batch_2_1" ) )
+
+    def test_page_status_updates(self):
+        self.user_col.add_user( "pagep", "pagep@uw.edu", "Page", "Pager" )
+        for number in range( 3 ):
+            self.status_col.add_status( "pagep", f"pagep_000{number}", f"Page {number}" )
+        statuses, token = self.status_col.page_status_updates( "pagep", 2 )
+        self.assertEqual( statuses, [ { "status_id": "pagep_0000", "status_text": "Page 0" },
+                                      { "status_id": "pagep_0001", "status_text": "Page 1" } ] )
+        statuses, token = self.status_col.page_status_updates( "pagep", 2, token )
+        self.assertEqual( [ status[ "status_text" ] for status in statuses ], [ "Page 2" ] )
+        self.assertIsNone( token )
+        self.assertEqual( list( self.status_col.iter_status_updates( "pagep", 1 ) ),
+                          [ "Page 0", "Page 1", "Page 2" ] )
+        self.assertEqual( self.status_col.count_status_updates( "pagep" ), 3 )
+
     def test_filter_status_by_string(self):
         self.user_col.add_user( "lukec", "lukec@uw.edu", "Luke", "Cage" )
         new_status = self.status_col.add_status( "lukec", "lukec_0008", "Netflix hosts my show" )
@@ -141,6 +387,57 @@ class TestSN(unittest.TestCase):
         self.assertIsInstance( status_iterator, Iterable )
         self.assertEqual( len( [ stat.status_text for stat in status_iterator ] ), 2 )
 
+    def test_filter_status_fields(self):
+        self.user_col.add_user( "frankc", "frankc@uw.edu", "Frank", "Castle" )
+        self.status_col.add_status( "frankc", "frankc_0001", "Punishing projections" )
+        status_iterator = self.status_col.filter_status_by_string(
+            "projections", fields=( "status_id", "status_text" ) )
+        found = list( status_iterator )
+        self.assertEqual( [ stat.status_id for stat in found ], [ "frankc_0001" ] )
+        self.assertEqual( found[ 0 ].status_text, "Punishing projections" )
+        with self.assertRaises( AttributeError ):
+            found[ 0 ].user_id
+
+    def test_filter_status_by_text(self):
+        sn.IndexManager.ensure()
+        self.user_col.add_user( "jessj", "jessj@uw.edu", "Jessica", "Jones" )
+        self.status_col.add_status( "jessj", "jessj_0001", "Private investigations are my thing" )
+        self.status_col.add_status( "jessj", "jessj_0002", "Investigating again, investigations never stop" )
+        status_iterator = self.status_col.filter_status_by_string(
+            "investigations", mode=sn.FILTER_TEXT, by_relevance=True )
+        self.assertEqual(
+            [ stat.status_id for stat in status_iterator ][ :2 ],
+            [ "jessj_0002", "jessj_0001" ]
+        )
+        status_iterator = self.status_col.filter_status_by_string(
+            "investigations", mode=sn.FILTER_TEXT, limit=1 )
+        self.assertEqual( len( list( status_iterator ) ), 1 )
+
+    def test_filter_status_by_trigram(self):
+        self.user_col.add_user( "dannyr", "dannyr@uw.edu", "Danny", "Rand" )
+        self.status_col.add_status( "dannyr", "dannyr_0001", "Iron Fist in the house" )
+        index = self.status_col.build_trigram_index()
+        self.assertIn( "dannyr_0001", index )
+        self.status_col.enable_trigram_index( index )
+        try:
+            self.status_col.add_status( "dannyr", "dannyr_0002", "Fisticuffs at dawn" )
+            self.status_col.modify_status( "dannyr_0001", "dannyr", "Iron Fist at home" )
+            status_iterator = self.status_col.filter_status_by_string(
+                "Fist", mode=sn.FILTER_TRIGRAM )
+            self.assertEqual(
+                sorted( stat.status_id for stat in status_iterator ),
+                [ "dannyr_0001", "dannyr_0002" ]
+            )
+            self.status_col.delete_status( "dannyr_0002" )
+            status_iterator = self.status_col.filter_status_by_string(
+                "Fist at", mode=sn.FILTER_TRIGRAM )
+            self.assertEqual(
+                [ stat.status_text for stat in status_iterator ],
+                [ "Iron Fist at home" ]
+            )
+        finally:
+            self.status_col.enable_trigram_index( None )
+
 
 # --- END --- #
 
@@ -0,0 +1,214 @@
+'''
+Unit test module for sqlite_backend.py
+'''
+
+# pylint: disable=C0305
+
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+import socialnetwork_model as sn
+from sqlite_backend import SQLiteBackend, fts_query
+from storage_backends import FILTER_TEXT, DuplicateKey, StorageError
+
+
+def user( user_id ):
+    '''
+    Returns a user dictionary for user_id
+    '''
+    return sn.UsersTable.as_dict( user_id=user_id, email=f"{user_id}@example.com",
+                                  user_name="Test", user_last_name="User" )
+
+
+def status( status_id, user_id, status_text ):
+    '''
+    Returns a status dictionary
+    '''
+    return sn.StatusTable.as_dict( status_id=status_id, user_id=user_id,
+                                   status_text=status_text )
+
+
+class TestSQLiteBackend(unittest.TestCase):
+    '''
+    Class definition for unit tests for sqlite_backend.py
+    '''
+
+    def setUp(self):
+        self.backend = SQLiteBackend( ":memory:" )
+        self.backend.insert_users( [ user( "alice" ), user( "bob" ) ] )
+        self.backend.insert_statuses( [
+            status( "alice_1", "alice", "Sunny day at the beach" ),
+            status( "alice_2", "alice", "Rainy days, rainy mood" ),
+            status( "bob_1", "bob", "Beach volleyball tonight" ),
+        ] )
+
+    def tearDown(self):
+        self.backend.close()
+
+    def test_insert_user(self):
+        self.backend.insert_user( user( "carol" ) )
+        self.assertEqual( self.backend.find_user( "carol" )[ "email" ],
+                          "carol@example.com" )
+        with self.assertRaises( DuplicateKey ):
+            self.backend.insert_user( user( "carol" ) )
+
+    def test_insert_statuses(self):
+        written, duplicates, failed = self.backend.insert_statuses( [
+            status( "bob_2", "bob", "New" ),
+            status( "bob_1", "bob", "Duplicate" ),
+            status( "zed_1", "zed", "No such user" ),
+            status( "bob_2", "bob", "Repeated in batch" ),
+            status( "bob_3", "bob", "Also new" ),
+        ] )
+        self.assertEqual( ( written, duplicates, failed ), ( [ 0, 4 ], [ 1, 3 ], [ 2 ] ) )
+        self.assertEqual( self.backend.find_status( "bob_2" )[ "status_text" ], "New" )
+
+    def test_foreign_key(self):
+        with self.assertRaises( StorageError ):
+            self.backend.insert_status( status( "zed_1", "zed", "No such user" ) )
+
+    def test_delete_cascades(self):
+        self.assertEqual( self.backend.delete_user( "alice" ), 1 )
+        self.assertIsNone( self.backend.find_status( "alice_1" ) )
+        self.assertEqual( list( self.backend.find_statuses_by_user( "alice" ) ), [] )
+        self.assertEqual( self.backend.existing_status_ids( [ "alice_2", "bob_1" ] ),
+                          { "bob_1" } )
+
+    def test_batches(self):
+        self.assertEqual( sorted( found[ "user_id" ] for found
+                                  in self.backend.find_users( [ "alice", "bob", "zed" ] ) ),
+                          [ "alice", "bob" ] )
+        self.assertEqual( self.backend.delete_statuses( [ "alice_1", "zed_1" ] ),
+                          { "alice_1" } )
+        self.assertEqual( self.backend.tombstone_users( [ "alice", "zed" ] ), { "alice" } )
+        self.assertEqual( [ found[ "status_id" ] for found
+                            in self.backend.find_statuses( [ "alice_2", "bob_1" ] ) ],
+                          [ "bob_1" ] )
+
+    def test_tombstone_user(self):
+        #
+        # The cascade happens at once, leaving nothing to reap
+        #
+        self.assertFalse( self.backend.deferred_cascade )
+        self.assertEqual( self.backend.tombstone_user( "alice" ), 1 )
+        self.assertEqual( self.backend.tombstoned_user_ids(), frozenset() )
+        self.assertIsNone( self.backend.find_status( "alice_1" ) )
+        self.assertEqual( self.backend.reap_statuses( "bob", 10 ), 0 )
+        self.assertIsNotNone( self.backend.find_status( "bob_1" ) )
+
+    def test_update(self):
+        self.assertEqual( self.backend.update_status( "bob_1", { "status_text": "Rained off" } ), 1 )
+        self.assertEqual( self.backend.find_status( "bob_1" )[ "status_text" ], "Rained off" )
+        self.assertEqual( self.backend.update_user( "zed", { "email": "x" } ), 0 )
+        with self.assertRaises( StorageError ):
+            self.backend.update_user( "bob", { "password": "x" } )
+
+    def test_status_fingerprint(self):
+        self.assertEqual( self.backend.status_fingerprint(), ( 3, "bob_1" ) )
+        self.backend.delete_status( "bob_1" )
+        self.assertEqual( self.backend.status_fingerprint(), ( 2, "alice_2" ) )
+
+    def test_match_regex(self):
+        matches = self.backend.match_statuses( "[Bb]each" )
+        self.assertEqual( sorted( match[ "status_id" ] for match in matches ),
+                          [ "alice_1", "bob_1" ] )
+        self.assertEqual( len( list( self.backend.match_statuses( "y", limit=2 ) ) ), 2 )
+        with self.assertRaises( StorageError ):
+            self.backend.match_statuses( "(" )
+
+    def test_match_text(self):
+        self.assertEqual( fts_query( 'sunny "rainy mood"' ),
+                          '"rainy mood" AND ( "sunny" )' )
+        matches = [ match[ "status_id" ] for match in self.backend.match_statuses(
+            "rainy day", mode=FILTER_TEXT, by_relevance=True ) ]
+        self.assertEqual( matches, [ "alice_2", "alice_1" ] )
+        #
+        # The full-text index follows updates and deletes
+        #
+        self.backend.update_status( "bob_1", { "status_text": "Snow day" } )
+        self.backend.delete_status( "alice_2" )
+        matches = { match[ "status_id" ] for match in self.backend.match_statuses(
+            "day", mode=FILTER_TEXT ) }
+        self.assertEqual( matches, { "alice_1", "bob_1" } )
+
+    def test_projections(self):
+        matches = self.backend.match_statuses( "rainy", mode=FILTER_TEXT,
+                                               fields=( "status_id", ), raw=True )
+        self.assertEqual( list( matches ), [ { "status_id": "alice_2" } ] )
+        self.assertEqual(
+            list( self.backend.find_statuses_by_user( "bob", fields=( "status_text", ) ) ),
+            [ { "status_text": "Beach volleyball tonight" } ] )
+        self.assertEqual(
+            [ list( found ) for found in self.backend.iter_statuses(
+                10, fields=( "user_id", "user_id" ) ) ],
+            [ [ "user_id" ] ] * 3 )
+        with self.assertRaises( StorageError ):
+            self.backend.iter_statuses( 10, fields=( "rowid", ) )
+
+    def test_page_statuses_by_user(self):
+        page = self.backend.page_statuses_by_user( "alice", 1, fields=( "status_text", ) )
+        self.assertEqual( page, [ { "status_id": "alice_1",
+                                    "status_text": "Sunny day at the beach" } ] )
+        page = self.backend.page_statuses_by_user( "alice", 5, after="alice_1" )
+        self.assertEqual( [ found[ "status_id" ] for found in page ], [ "alice_2" ] )
+        self.assertEqual( self.backend.count_statuses_by_user( "alice" ), 2 )
+        with self.assertRaises( StorageError ):
+            self.backend.page_statuses_by_user( "alice", 1, fields=( "password", ) )
+        plan = self.backend.connection.execute(
+            "EXPLAIN QUERY PLAN SELECT status_id, status_text FROM status "
+            "WHERE user_id = ? AND status_id > ? ORDER BY status_id LIMIT ?",
+            ( "alice", "alice_1", 1 ) ).fetchall()
+        self.assertIn( "status_user_id", plan[ 0 ][ 3 ] )
+        self.assertNotIn( "TEMP B-TREE", " ".join( row[ 3 ] for row in plan ) )
+
+    def test_verify_indexes(self):
+        self.assertEqual( self.backend.verify_indexes()[ "missing" ], [] )
+
+    def test_rebuilds_old_index(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join( directory, "sn.db" )
+            connection = sqlite3.connect( path )
+            connection.execute( "CREATE TABLE status ( status_id TEXT PRIMARY KEY, "
+                                "user_id TEXT, status_text TEXT )" )
+            connection.execute( "CREATE INDEX status_user_id ON status ( user_id )" )
+            connection.commit()
+            connection.close()
+            backend = SQLiteBackend( path )
+            self.assertIn( "status.status_user_id", backend.verify_indexes()[ "present" ] )
+            backend.close()
+
+    def test_file_database(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join( directory, "sn.db" )
+            backend = SQLiteBackend( path )
+            backend.insert_users( [ user( "dave" ) ] )
+            #
+            # Another thread has its own connection, and sees the write
+            #
+            found = []
+            reader = threading.Thread(
+                target=lambda: found.extend( backend.iter_user_ids( 10 ) ) )
+            reader.start()
+            reader.join()
+            self.assertEqual( found, [ "dave" ] )
+            self.assertEqual(
+                backend.connection.execute( "PRAGMA journal_mode" ).fetchone()[ 0 ],
+                "wal" )
+            backend.close()
+
+    def test_collections(self):
+        users = sn.UserCollection( self.backend )
+        statuses = sn.UserStatusCollection( self.backend )
+        self.assertTrue( users.add_user( "sqlbk_0001", "s@example.com", "Sql", "Bk" ) )
+        self.assertFalse( users.add_user( "sqlbk_0001", "s@example.com", "Sql", "Bk" ) )
+        self.assertTrue( statuses.add_status( "sqlbk_0001", "sqlbk_0001_1", "Embedded" ) )
+        self.assertTrue( statuses.modify_status( "sqlbk_0001_1", "sqlbk_0001", "Changed" ) )
+        self.assertTrue( users.delete_user( "sqlbk_0001" ) )
+        self.assertIsNone( statuses.search_status( "sqlbk_0001_1" ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+'''
+Unit test module for status_reaper.py
+'''
+
+# pylint: disable=C0305
+
+import threading
+import time
+import unittest
+
+import socialnetwork_model as sn
+from status_reaper import StatusReaper, reaper_for
+from storage_backends import FILTER_REGEX, MemoryBackend
+
+
+def user( user_id ):
+    '''
+    Returns a user dictionary for user_id
+    '''
+    return sn.UsersTable.as_dict( user_id=user_id, email=f"{user_id}@example.com",
+                                  user_name="Test", user_last_name="User" )
+
+
+def statuses( user_id, count ):
+    '''
+    Returns count status dictionaries for user_id
+    '''
+    return [ sn.StatusTable.as_dict( status_id=f"{user_id}_{number}", user_id=user_id,
+                                     status_text=f"Status {number}" )
+             for number in range( count ) ]
+
+
+class TestStatusReaper(unittest.TestCase):
+    '''
+    Class definition for unit tests of StatusReaper
+    '''
+
+    def setUp(self):
+        self.backend = MemoryBackend()
+        self.backend.insert_users( [ user( "alice" ), user( "bob" ) ] )
+        self.backend.insert_statuses( statuses( "alice", 5 ) + statuses( "bob", 1 ) )
+
+    def test_tombstone_hides_statuses(self):
+        self.assertEqual( self.backend.tombstone_user( "alice" ), 1 )
+        self.assertEqual( self.backend.tombstone_user( "alice" ), 0 )
+        self.assertIsNone( self.backend.find_user( "alice" ) )
+        self.assertIsNone( self.backend.find_status( "alice_0" ) )
+        self.assertEqual( list( self.backend.find_statuses_by_user( "alice" ) ), [] )
+        self.assertEqual( self.backend.count_statuses_by_user( "alice" ), 0 )
+        self.assertEqual(
+            [ status[ "status_id" ] for status
+              in self.backend.match_statuses( "Status", mode=FILTER_REGEX ) ],
+            [ "bob_0" ] )
+        self.assertEqual( len( self.backend.statuses ), 6 )
+
+    def test_run_once(self):
+        self.backend.tombstone_user( "alice" )
+        reaper = StatusReaper( self.backend, batch_size=2, max_rate=0 )
+        self.assertEqual( reaper.stats()[ "backlog_users" ], 1 )
+        self.assertEqual( reaper.run_once(), 5 )
+        self.assertEqual( set( self.backend.statuses ), { "bob_0" } )
+        self.assertEqual( self.backend.tombstoned_user_ids(), frozenset() )
+        stats = reaper.stats()
+        self.assertEqual( ( stats[ "statuses_deleted" ], stats[ "batches" ],
+                            stats[ "users_reaped" ], stats[ "backlog_users" ] ),
+                          ( 5, 3, 1, 0 ) )
+
+    def test_rate_limit(self):
+        self.backend.tombstone_user( "alice" )
+        reaper = StatusReaper( self.backend, batch_size=2, max_rate=20 )
+        start = time.perf_counter()
+        reaper.run_once()
+        #
+        # Two full batches of 2, at 20 statuses a second
+        #
+        self.assertGreaterEqual( time.perf_counter() - start, 0.19 )
+
+    def test_background(self):
+        users = sn.UserCollection( self.backend )
+        self.assertTrue( users.delete_user( "alice" ) )
+        self.assertFalse( users.delete_user( "alice" ) )
+        reaper = reaper_for( self.backend )
+        self.assertIs( reaper_for( self.backend ), reaper )
+        deadline = time.monotonic() + 5
+        while reaper.running and time.monotonic() < deadline:
+            time.sleep( 0.01 )
+        self.assertFalse( reaper.running )
+        self.assertEqual( set( self.backend.statuses ), { "bob_0" } )
+        self.assertEqual( reaper.stats()[ "backlog_users" ], 0 )
+
+    def test_add_deleted_user_again(self):
+        self.backend.tombstone_user( "alice" )
+        users = sn.UserCollection( self.backend )
+        self.assertTrue( users.add_user( "alice", "alice@example.com", "New", "Alice" ) )
+        self.assertEqual( self.backend.tombstoned_user_ids(), frozenset() )
+        self.assertEqual( self.backend.count_statuses_by_user( "alice" ), 0 )
+        self.assertIsNone( self.backend.find_status( "alice_0" ) )
+
+    def test_reap_after_added_again(self):
+        self.backend.tombstone_user( "alice" )
+        reaper = StatusReaper( self.backend, batch_size=2, max_rate=0 )
+        self.assertEqual( reaper.finish_user( "alice" ), 5 )
+        self.backend.insert_user( user( "alice" ) )
+        self.backend.insert_statuses( statuses( "alice", 3 ) )
+        #
+        # As the reaper thread would, having listed the tombstones
+        # before finish_user removed alice's
+        #
+        self.assertEqual( reaper._reap_user( self.backend, "alice", throttle=True ), 0 )
+        self.assertEqual( self.backend.count_statuses_by_user( "alice" ), 3 )
+        self.assertEqual( self.backend.reap_statuses( "bob", 10 ), 0 )
+
+    def test_finish_user_waits(self):
+        self.backend.tombstone_user( "alice" )
+        reaper = StatusReaper( self.backend, batch_size=2, max_rate=0 )
+        finished = []
+        with reaper._reaping( "alice" ):
+            waiting = threading.Thread(
+                target=lambda: finished.append( reaper.finish_user( "alice" ) ) )
+            waiting.start()
+            waiting.join( 0.1 )
+            self.assertTrue( waiting.is_alive() )
+        waiting.join( 5 )
+        self.assertEqual( finished, [ 5 ] )
+        self.assertEqual( reaper._user_locks, {} )
+        self.assertEqual( reaper.stats()[ "users_reaped" ], 1 )
+
+
+if __name__ == '__main__':
+    unittest.main()
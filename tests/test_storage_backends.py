@@ -0,0 +1,322 @@
+'''
+Unit test module for storage_backends.py
+'''
+
+# pylint: disable=C0305
+
+import time
+import unittest
+
+import bson
+from bson.raw_bson import RawBSONDocument
+
+import socialnetwork_model as sn
+from storage_backends import (
+    FILTER_REGEX,
+    FILTER_TEXT,
+    DuplicateKey,
+    MemoryBackend,
+    StorageError,
+)
+
+
+def user( user_id ):
+    '''
+    Returns a user dictionary for user_id
+    '''
+    return sn.UsersTable.as_dict( user_id=user_id, email=f"{user_id}@example.com",
+                                  user_name="Test", user_last_name="User" )
+
+
+def status( status_id, user_id, status_text ):
+    '''
+    Returns a status dictionary
+    '''
+    return sn.StatusTable.as_dict( status_id=status_id, user_id=user_id,
+                                   status_text=status_text )
+
+
+class TestMemoryBackend(unittest.TestCase):
+    '''
+    Class definition for unit tests of MemoryBackend
+    '''
+
+    def setUp(self):
+        self.backend = MemoryBackend()
+        self.backend.insert_users( [ user( "alice" ), user( "bob" ) ] )
+        self.backend.insert_statuses( [
+            status( "alice_1", "alice", "Sunny day at the beach" ),
+            status( "alice_2", "alice", "Rainy day, rainy mood" ),
+            status( "bob_1", "bob", "Beach volleyball tonight" ),
+        ] )
+
+    def test_insert_user(self):
+        self.backend.insert_user( user( "carol" ) )
+        self.assertEqual( self.backend.find_user( "carol" )[ "user_id" ], "carol" )
+        with self.assertRaises( DuplicateKey ):
+            self.backend.insert_user( user( "carol" ) )
+
+    def test_insert_users(self):
+        written, duplicates, failed = self.backend.insert_users(
+            [ user( "dave" ), user( "alice" ), user( "erin" ) ] )
+        self.assertEqual( ( written, duplicates, failed ), ( [ 0, 2 ], [ 1 ], [] ) )
+
+    def test_returns_copies(self):
+        found = self.backend.find_user( "alice" )
+        found[ "email" ] = "changed"
+        self.assertNotEqual( self.backend.find_user( "alice" )[ "email" ], "changed" )
+
+    def test_existing_ids(self):
+        self.assertEqual( self.backend.existing_user_ids( [ "alice", "zed" ] ),
+                          { "alice" } )
+        self.assertEqual( self.backend.existing_status_ids( [ "bob_1", "bob_2" ] ),
+                          { "bob_1" } )
+        self.assertEqual( sorted( self.backend.iter_user_ids( 10 ) ), [ "alice", "bob" ] )
+
+    def test_update(self):
+        self.assertEqual( self.backend.update_status( "bob_1", { "status_text": "Rained off" } ), 1 )
+        self.assertEqual( self.backend.find_status( "bob_1" )[ "status_text" ], "Rained off" )
+        self.assertEqual( self.backend.update_user( "zed", { "email": "x" } ), 0 )
+
+    def test_delete(self):
+        self.assertEqual( self.backend.delete_status( "alice_1" ), 1 )
+        self.assertEqual( self.backend.delete_status( "alice_1" ), 0 )
+        self.assertEqual( self.backend.delete_statuses_by_user( "alice" ), 1 )
+        self.assertEqual( list( self.backend.find_statuses_by_user( "alice" ) ), [] )
+        self.assertEqual( self.backend.delete_user( "alice" ), 1 )
+        self.assertIsNone( self.backend.find_user( "alice" ) )
+
+    def test_batches(self):
+        self.assertEqual( sorted( found[ "user_id" ] for found
+                                  in self.backend.find_users( [ "alice", "bob", "zed" ] ) ),
+                          [ "alice", "bob" ] )
+        self.assertEqual( [ found[ "status_id" ] for found
+                            in self.backend.find_statuses( [ "bob_1", "bob_2" ] ) ],
+                          [ "bob_1" ] )
+        self.assertEqual( self.backend.delete_statuses( [ "alice_1", "zed_1" ] ),
+                          { "alice_1" } )
+        self.assertEqual( self.backend.tombstone_users( [ "alice", "zed" ] ), { "alice" } )
+        self.assertEqual( self.backend.find_statuses( [ "alice_2", "bob_1" ] ),
+                          [ self.backend.find_status( "bob_1" ) ] )
+
+    def test_page_statuses_by_user(self):
+        self.backend.insert_status( status( "alice_0", "alice", "First" ) )
+        page = self.backend.page_statuses_by_user( "alice", 2, fields=( "status_text", ) )
+        self.assertEqual( page, [ { "status_id": "alice_0", "status_text": "First" },
+                                  { "status_id": "alice_1",
+                                    "status_text": "Sunny day at the beach" } ] )
+        page = self.backend.page_statuses_by_user( "alice", 2, after="alice_1" )
+        self.assertEqual( [ found[ "status_id" ] for found in page ], [ "alice_2" ] )
+        self.assertEqual( page[ 0 ][ "user_id" ], "alice" )
+        self.assertEqual( self.backend.count_statuses_by_user( "alice" ), 3 )
+        self.assertEqual( self.backend.count_statuses_by_user( "zed" ), 0 )
+
+    def test_status_fingerprint(self):
+        self.assertEqual( self.backend.status_fingerprint(), ( 3, "bob_1" ) )
+        #
+        # The statuses of a deleted user no longer count, even before
+        # they are reaped
+        #
+        self.backend.tombstone_user( "bob" )
+        self.assertEqual( self.backend.status_fingerprint(), ( 2, "alice_2" ) )
+
+    def test_match_regex(self):
+        matches = self.backend.match_statuses( "[Bb]each", mode=FILTER_REGEX )
+        self.assertEqual( sorted( match[ "status_id" ] for match in matches ),
+                          [ "alice_1", "bob_1" ] )
+        self.assertEqual(
+            len( list( self.backend.match_statuses( "day", limit=1 ) ) ), 1 )
+        with self.assertRaises( StorageError ):
+            self.backend.match_statuses( "(" )
+
+    def test_match_text(self):
+        matches = self.backend.match_statuses( "rainy beach", mode=FILTER_TEXT,
+                                               by_relevance=True )
+        self.assertEqual( [ match[ "status_id" ] for match in matches ][ 0 ], "alice_2" )
+
+    def test_projections(self):
+        self.assertEqual(
+            list( self.backend.match_statuses( "Beach", fields=( "status_id", ),
+                                               raw=True ) ),
+            [ { "status_id": "bob_1" } ] )
+        self.assertEqual(
+            list( self.backend.find_statuses_by_user( "bob", fields=( "status_text", ) ) ),
+            [ { "status_text": "Beach volleyball tonight" } ] )
+        self.assertEqual(
+            [ sorted( found ) for found
+              in self.backend.iter_statuses( 10, fields=( "user_id", "status_id" ) ) ],
+            [ [ "status_id", "user_id" ] ] * 3 )
+
+
+class TestCollectionsOnMemoryBackend(unittest.TestCase):
+    '''
+    The collection classes should behave the same on any backend
+    '''
+
+    def setUp(self):
+        self.backend = MemoryBackend()
+        self.users = sn.UserCollection( self.backend )
+        self.statuses = sn.UserStatusCollection( self.backend )
+
+    def test_user_round_trip(self):
+        self.assertTrue( self.users.add_user( "membk_0001", "m@example.com", "Mem", "Bk" ) )
+        self.assertFalse( self.users.add_user( "membk_0001", "m@example.com", "Mem", "Bk" ) )
+        self.assertTrue( self.users.modify_user( "membk_0001", "n@example.com", "Mem", "Bk" ) )
+        self.assertEqual( self.users.search_user( "membk_0001" ).email, "n@example.com" )
+        self.assertFalse( self.users.modify_user( "membk_none", "n@example.com", "Mem", "Bk" ) )
+
+    def test_status_round_trip(self):
+        self.users.add_user( "membk_0002", "m@example.com", "Mem", "Bk" )
+        self.assertTrue( self.statuses.add_status( "membk_0002", "membk_0002_1", "In memory" ) )
+        self.assertFalse( self.statuses.add_status( "membk_0002", "membk_0002_1", "Again" ) )
+        self.assertFalse( self.statuses.add_status( "membk_none", "membk_none_1", "No user" ) )
+        self.assertFalse( self.statuses.modify_status( "membk_none_1", "membk_none", "Nope" ) )
+        self.assertEqual( self.statuses.search_all_status_updates( "membk_0002" ),
+                          [ "In memory" ] )
+        self.assertTrue( self.users.delete_user( "membk_0002" ) )
+        self.assertIsNone( self.statuses.search_status( "membk_0002_1" ) )
+
+    def test_backends_kept_apart(self):
+        other_backend = MemoryBackend()
+        other_users = sn.UserCollection( other_backend )
+        other_statuses = sn.UserStatusCollection( other_backend )
+        self.assertTrue( self.users.add_user( "twobk_0001", "t@example.com", "Two", "Bk" ) )
+        self.assertTrue( self.users.add_user( "twobk_0002", "t@example.com", "Two", "Bk" ) )
+        sn.UserCache.of( self.backend ).warm()
+        self.assertTrue( sn.UserCache.of( self.backend ).complete )
+        self.assertFalse( sn.UserCache.of( other_backend ).complete )
+        #
+        # Users of the first backend are unknown to the second
+        #
+        self.assertTrue( other_users.add_user( "twobk_0001", "t@example.com", "Two", "Bk" ) )
+        self.assertFalse( other_statuses.add_status( "twobk_0002", "twobk_0002_1", "Orphan" ) )
+        self.assertEqual( other_backend.statuses, {} )
+
+        self.assertTrue( self.statuses.add_status( "twobk_0001", "twobk_0001_1", "First" ) )
+        self.statuses.enable_trigram_index( self.statuses.build_trigram_index() )
+        self.assertIsNone( other_statuses.trigram_index )
+        self.assertTrue( other_statuses.add_status( "twobk_0001", "twobk_0001_1", "Other" ) )
+        self.assertNotEqual( self.statuses.trigram_index.search( "First" ), [] )
+        sn.StatusCache.configure( 8 )
+        try:
+            self.assertEqual( self.statuses.search_status( "twobk_0001_1" ).status_text,
+                              "First" )
+            self.assertEqual( other_statuses.search_status( "twobk_0001_1" ).status_text,
+                              "Other" )
+        finally:
+            sn.StatusCache.configure( 0 )
+
+    def test_user_cache_complete(self):
+        self.assertTrue( self.users.add_user( "whole_0001", "w@example.com", "Wh", "Ole" ) )
+        user_cache = sn.UserCache.of( self.backend )
+        user_cache.warm()
+        self.assertTrue( user_cache.authoritative )
+        self.backend.insert_user( user( "whole_0002" ) )
+        self.assertEqual( sn.confirm_users( [ "whole_0002" ], self.backend ), set() )
+        #
+        # As if other processes could be writing to the backend too
+        #
+        self.backend.shared_between_processes = True
+        self.assertTrue( user_cache.complete )
+        self.assertFalse( user_cache.authoritative )
+        self.assertEqual( sn.confirm_users( [ "whole_0001", "whole_0002", "whole_none" ],
+                                            self.backend ),
+                          { "whole_0001", "whole_0002" } )
+        self.assertTrue( user_cache.read( "whole_0002" ) )
+
+    def test_status_cache_entries(self):
+        sn.StatusCache.configure( 8, negative_ttl=0.05 )
+        try:
+            self.assertTrue( self.users.add_user( "cache_0001", "c@example.com", "Ca", "Che" ) )
+            self.assertIsNone( self.statuses.search_status( "cache_0001_1" ) )
+            #
+            # Written behind the cache's back, as another process would
+            #
+            self.backend.insert_status( status( "cache_0001_1", "cache_0001", "Hello" ) )
+            self.assertIsNone( self.statuses.search_status( "cache_0001_1" ) )
+            time.sleep( 0.1 )
+            found = self.statuses.search_status( "cache_0001_1" )
+            self.assertEqual( found.status_text, "Hello" )
+            #
+            # Changing a returned record leaves the cached one alone
+            #
+            found.status_text = "Changed"
+            self.assertEqual( self.statuses.search_status( "cache_0001_1" ).status_text,
+                              "Hello" )
+            self.statuses.search_status( "cache_0001_1" ).status_text = "Changed"
+            found, = self.statuses.search_statuses( [ "cache_0001_1" ] ).values()
+            self.assertEqual( found.status_text, "Hello" )
+        finally:
+            sn.StatusCache.configure( 0 )
+
+    def test_batch_crud(self):
+        new_users = [ sn.UsersTable.as_dict( user_id=f"membt_000{number}",
+                                             email="b@example.com",
+                                             user_name="Mem", user_last_name="Batch" )
+                      for number in range( 3 ) ]
+        self.assertTrue( self.users.add_user( "membt_0000", "b@example.com", "Mem", "Batch" ) )
+        self.assertEqual( self.users.add_users( new_users ),
+                          { "membt_0000": False, "membt_0001": True, "membt_0002": True } )
+        found = self.users.search_users( [ "membt_0001", "membt_none" ] )
+        self.assertEqual( found[ "membt_0001" ].user_last_name, "Batch" )
+        self.assertIsNone( found[ "membt_none" ] )
+        self.assertTrue( self.statuses.add_status( "membt_0001", "membt_0001_1", "One" ) )
+        self.assertTrue( self.statuses.add_status( "membt_0001", "membt_0001_2", "Two" ) )
+        found = self.statuses.search_statuses( [ "membt_0001_1", "membt_none_1" ] )
+        self.assertEqual( found[ "membt_0001_1" ].status_text, "One" )
+        self.assertIsNone( found[ "membt_none_1" ] )
+        self.assertEqual( self.statuses.delete_statuses( [ "membt_0001_1", "membt_none_1" ] ),
+                          { "membt_0001_1": True, "membt_none_1": False } )
+        self.assertEqual( self.users.delete_users( [ "membt_0001", "membt_none" ] ),
+                          { "membt_0001": True, "membt_none": False } )
+        self.assertFalse( sn.UserCache.of( self.backend ).read( "membt_0001" ) )
+        self.assertIsNone( self.statuses.search_statuses( [ "membt_0001_2" ] )[ "membt_0001_2" ] )
+
+    def test_page_status_updates(self):
+        self.users.add_user( "membk_0003", "m@example.com", "Mem", "Bk" )
+        for number in range( 5 ):
+            self.statuses.add_status( "membk_0003", f"membk_0003_{number}", f"Status {number}" )
+        statuses, token = self.statuses.page_status_updates( "membk_0003", 2 )
+        self.assertEqual( [ found[ "status_text" ] for found in statuses ],
+                          [ "Status 0", "Status 1" ] )
+        statuses, token = self.statuses.page_status_updates( "membk_0003", 2, token )
+        statuses, token = self.statuses.page_status_updates( "membk_0003", 2, token )
+        self.assertEqual( [ found[ "status_id" ] for found in statuses ], [ "membk_0003_4" ] )
+        self.assertIsNone( token )
+        self.assertEqual( list( self.statuses.iter_status_updates( "membk_0003", 2 ) ),
+                          [ f"Status {number}" for number in range( 5 ) ] )
+        self.assertEqual( self.statuses.count_status_updates( "membk_0003" ), 5 )
+
+    def test_filter_fields(self):
+        self.users.add_user( "membk_0004", "m@example.com", "Mem", "Bk" )
+        self.statuses.add_status( "membk_0004", "membk_0004_1", "Projected status" )
+        found = list( self.statuses.filter_status_by_string(
+            "Projected", fields=( "status_id", "status_text" ) ) )
+        self.assertEqual( [ ( view.status_id, view.status_text ) for view in found ],
+                          [ ( "membk_0004_1", "Projected status" ) ] )
+        with self.assertRaises( AttributeError ):
+            found[ 0 ].user_id
+        found = list( self.statuses.filter_status_by_string( "Projected", lazy=True ) )
+        self.assertEqual( found[ 0 ].user_id, "membk_0004" )
+
+    def test_status_view_raw(self):
+        view = sn.StatusView( RawBSONDocument( bson.encode(
+            { "status_id": "raw_1", "status_text": "Undecoded" } ) ) )
+        self.assertEqual( ( view.status_id, view.status_text ), ( "raw_1", "Undecoded" ) )
+        with self.assertRaises( AttributeError ):
+            view.user_id
+        with self.assertRaises( AttributeError ):
+            view.email
+
+    def test_ensure_indexes(self):
+        self.assertTrue( sn.IndexManager.ensure( backend=self.backend ) )
+        self.assertEqual( sn.IndexManager.verify( backend=self.backend )[ "missing" ], [] )
+
+    def test_make_backend(self):
+        self.assertIsInstance( sn.make_backend( "memory" ), MemoryBackend )
+        with self.assertRaises( ValueError ):
+            sn.make_backend( "nosuch" )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+'''
+Unit test module for tracing.py
+'''
+
+# pylint: disable=C0305
+
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import main
+import metrics
+import socialnetwork_model as sn
+import tracing
+from storage_backends import MemoryBackend
+
+
+def command_events( request_id, command_name, collection, reply ):
+    '''
+    Returns stand-ins for the started and succeeded events of one
+    command
+    '''
+    started = SimpleNamespace( command={ command_name: collection, 'filter': {} },
+                               command_name=command_name, connection_id=( "db", 1 ),
+                               request_id=request_id )
+    succeeded = SimpleNamespace( reply=reply, duration_micros=250,
+                                 connection_id=( "db", 1 ), request_id=request_id )
+    return started, succeeded
+
+
+class TestTracing(unittest.TestCase):
+    '''
+    Class definition for unit tests for tracing.py
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint:disable=consider-using-with
+        self.path = os.path.join( self.directory.name, "traces.jsonl" )
+        self.backend = MemoryBackend()
+        self.users = sn.UserCollection( self.backend )
+        self.statuses = sn.UserStatusCollection( self.backend )
+        tracing.start( self.path )
+
+    def tearDown(self):
+        tracing.stop()
+        self.directory.cleanup()
+
+    def traces(self):
+        '''
+        Returns the traces written so far
+        '''
+        with open( self.path, encoding="utf-8" ) as trace_file:
+            return [ json.loads( line ) for line in trace_file ]
+
+    def test_nested_spans(self):
+        self.assertTrue( main.add_user( "trace_1", "t@example.com", "Tra", "Ce", self.users ) )
+        self.assertFalse( main.add_user( "trace_1", "t@example.com", "Tra", "Ce", self.users ) )
+        main.search_user( "trace_1", self.users )
+        #
+        # Outside a main function: timed, but not traced
+        #
+        self.users.search_user( "trace_1" )
+        self.assertTrue( tracing.running() )
+        self.assertEqual( tracing.stop(), 3 )
+        self.assertFalse( tracing.running() )
+
+        added, again, searched = self.traces()
+        self.assertEqual( added[ "name" ], "main.add_user" )
+        self.assertEqual( added[ "calls" ], { "main.add_user": 1, "UserCollection.add_user": 1 } )
+        self.assertEqual( [ child[ "name" ] for child in added[ "root" ][ "children" ] ],
+                          [ "UserCollection.add_user" ] )
+        self.assertFalse( added[ "error" ] )
+        self.assertTrue( again[ "error" ] )
+        self.assertEqual( searched[ "commands" ], 0 )
+        root = searched[ "root" ]
+        self.assertLessEqual( root[ "children" ][ 0 ][ "duration_us" ], root[ "duration_us" ] )
+        self.assertNotEqual( added[ "trace_id" ], again[ "trace_id" ] )
+
+    def test_commands(self):
+        listener = tracing.command_listener
+
+        def lookups():
+            for request_id in ( 1, 2 ):
+                started, succeeded = command_events(
+                    request_id, "find", "users", { 'ok': 1, 'cursor': { 'firstBatch': [] } } )
+                listener.started( started )
+                listener.succeeded( succeeded )
+            return True
+
+        traced = metrics.timed( "main.lookups", lookups )
+        self.assertTrue( traced() )
+        #
+        # Commands outside a trace are ignored
+        #
+        listener.started( command_events( 3, "find", "users", {} )[ 0 ] )
+        tracing.stop()
+
+        trace, = self.traces()
+        self.assertEqual( trace[ "commands" ], 2 )
+        self.assertEqual( trace[ "command_counts" ], { "find users": 2 } )
+        self.assertEqual( trace[ "db_us" ], 500 )
+        self.assertGreater( trace[ "bytes_sent" ], 0 )
+        self.assertGreater( trace[ "bytes_received" ], 0 )
+        commands = trace[ "root" ][ "commands" ]
+        self.assertEqual( [ command[ "collection" ] for command in commands ], [ "users" ] * 2 )
+        self.assertEqual( trace[ "root" ][ "db_us" ], 500 )
+
+    def test_async_spans(self):
+        listener = tracing.command_listener
+        request_ids = iter( range( 10, 20 ) )
+
+        class Writes():
+            '''
+            Stands in for the backend's async writes, issuing one
+            insert command after yielding to the event loop
+            '''
+            async def insert_statuses( self, statuses ):
+                await asyncio.sleep( 0 )
+                started, succeeded = command_events(
+                    next( request_ids ), "insert", "status", { 'ok': 1, 'n': len( statuses ) } )
+                listener.started( started )
+                await asyncio.sleep( 0 )
+                listener.succeeded( succeeded )
+                return list( range( len( statuses ) ) ), [], []
+
+        async def load( user_id ):
+            statuses = [ sn.StatusTable.as_dict( status_id=f"{user_id}_1", user_id=user_id,
+                                                 status_text="Async" ) ]
+            inserted, _, _ = await self.statuses.insert_statuses_async( statuses, Writes() )
+            return inserted == [ f"{user_id}_1" ]
+
+        traced = metrics.timed( "main.load", load )
+
+        async def both():
+            return await asyncio.gather( traced( "async_1" ), traced( "async_2" ) )
+
+        self.assertEqual( asyncio.run( both() ), [ True, True ] )
+        tracing.stop()
+
+        traces = self.traces()
+        self.assertEqual( len( traces ), 2 )
+        for trace in traces:
+            self.assertEqual( trace[ "commands" ], 1 )
+            self.assertEqual( trace[ "command_counts" ], { "insert status": 1 } )
+            inserted, = trace[ "root" ][ "children" ]
+            self.assertEqual( inserted[ "name" ], "UserStatusCollection.insert_statuses_async" )
+            self.assertEqual( [ command[ "command" ] for command in inserted[ "commands" ] ],
+                              [ "insert" ] )
+            self.assertEqual( inserted[ "db_us" ], 250 )
+            self.assertEqual( trace[ "root" ][ "commands" ], [] )
+
+    def test_exception(self):
+        def broken():
+            raise ValueError( "broken" )
+
+        with self.assertRaises( ValueError ):
+            metrics.timed( "main.broken", broken )()
+        self.assertIsNone( tracing.current_span.get() )
+        tracing.stop()
+        self.assertTrue( self.traces()[ 0 ][ "error" ] )
+
+
+if __name__ == '__main__':
+    unittest.main()
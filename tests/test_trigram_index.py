@@ -0,0 +1,78 @@
+'''
+Unit test module for trigram_index.py
+'''
+
+# pylint: disable=C0305
+
+import os
+import tempfile
+import unittest
+
+from trigram_index import TrigramIndex, trigrams
+
+
+class TestTrigramIndex(unittest.TestCase):
+    '''
+    Class definition for unit tests for trigram_index.py
+    '''
+
+    def setUp(self):
+        self.index = TrigramIndex()
+        self.index.add( "lukec_0008", "lukec", "Netflix hosts my show" )
+        self.index.add( "lukec_0009", "lukec", "Amazon Prime is too lame to host my show" )
+        self.index.add( "jessj_0001", "jessj", "Private investigations" )
+
+    def test_trigrams(self):
+        self.assertEqual( trigrams( "abcd" ), { "abc", "bcd" } )
+        self.assertEqual( trigrams( "ab" ), set() )
+
+    def test_search(self):
+        matches = self.index.search( "host" )
+        self.assertEqual( [ match[ 0 ] for match in matches ],
+                          [ "lukec_0008", "lukec_0009" ] )
+        self.assertEqual( self.index.search( "ghost" ), [] )
+        self.assertEqual( len( self.index.search( "host", limit=1 ) ), 1 )
+
+    def test_search_verifies_candidates(self):
+        #
+        # Every trigram of "my tho" is present, but not the substring
+        #
+        self.index.add( "decoy_0001", "decoy", "my thought, my show" )
+        self.assertEqual( self.index.search( "my tho" )[ 0 ][ 0 ], "decoy_0001" )
+        self.assertEqual( self.index.search( "show my" ), [] )
+
+    def test_short_query(self):
+        self.assertEqual( len( self.index.search( "my" ) ), 2 )
+
+    def test_update_and_remove(self):
+        self.assertTrue( self.index.update( "lukec_0008", "Disney hosts my show now" ) )
+        self.assertEqual( self.index.search( "Netflix" ), [] )
+        self.assertEqual( self.index.search( "Disney" )[ 0 ][ 0 ], "lukec_0008" )
+        self.assertFalse( self.index.update( "nobody_0001", "text" ) )
+
+        self.assertTrue( self.index.remove( "lukec_0008" ) )
+        self.assertNotIn( "lukec_0008", self.index )
+        self.assertEqual( self.index.remove_user( "lukec" ), 1 )
+        self.assertEqual( self.index.search( "show" ), [] )
+        self.assertEqual( len( self.index ), 1 )
+
+    def test_fingerprint(self):
+        self.assertEqual( self.index.fingerprint(), ( 3, "lukec_0009" ) )
+        self.index.remove( "lukec_0009" )
+        self.assertEqual( self.index.fingerprint(), ( 2, "lukec_0008" ) )
+        self.assertEqual( TrigramIndex().fingerprint(), ( 0, None ) )
+
+    def test_save_and_load(self):
+        self.index.remove( "lukec_0008" )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join( tmp_dir, "status.idx" )
+            self.index.save( path )
+            loaded = TrigramIndex.load( path )
+        self.assertEqual( len( loaded ), 2 )
+        self.assertEqual( loaded.search( "host" ), self.index.search( "host" ) )
+        self.assertEqual( loaded.fingerprint(), self.index.fingerprint() )
+        loaded.remove_user( "jessj" )
+        self.assertEqual( loaded.search( "Private" ), [] )
+
+
+# --- END --- #